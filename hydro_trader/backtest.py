@@ -0,0 +1,155 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from hydro_trader.data_store import ForcingDataStore
+from hydro_trader.game import Game, create_game
+from hydro_trader.headless import HeadlessRunner
+from hydro_trader.strategies import load_strategy
+
+
+# Each worker process keeps its own data store, the cached data files are memory-mapped so
+# every worker shares the same pages and only the first game in a worker reads anything.
+_worker_data_store = None
+
+
+def _init_worker(data_dir):
+    global _worker_data_store
+    _worker_data_store = ForcingDataStore(data_dir=data_dir)
+
+
+def run_backtest(task) -> dict:
+    """
+    Plays one headless game for a task and returns a compact result row.
+
+    task: {"strategy": {"strategy": "module:Class", "kwargs": {...}}, "start_timestep": int, "n_timesteps": int,
+           "opponents": [strategy specs], "engine": str, "data_dir": str, "environment": str}
+    Strategy specs are plain dicts so they are cheap to send to the worker processes.
+    """
+    data_store = _worker_data_store
+    if data_store is None or data_store.data_dir != task["data_dir"]:
+        data_store = ForcingDataStore(data_dir=task["data_dir"])
+
+    game = create_game(data_dir=task["data_dir"], engine=task["engine"], data_store=data_store,
+                       start_timestep=task["start_timestep"], environment=task.get("environment", "norwegian"))
+    runner = HeadlessRunner(game)
+
+    spec = task["strategy"]
+    runner.add_player("candidate", spec_name(spec), load_strategy(spec["strategy"], **spec.get("kwargs", {})))
+    for i, opponent in enumerate(task["opponents"]):
+        runner.add_player("opponent_{}".format(i), spec_name(opponent), load_strategy(opponent["strategy"], **opponent.get("kwargs", {})))
+
+    results = runner.run(task["n_timesteps"])
+    candidate = results["players"]["candidate"]
+
+    return {
+        "strategy": candidate["name"],
+        "start_timestep": task["start_timestep"],
+        "cash": candidate["cash"],
+        "production_mwh": candidate["production_mwh"],
+        "overflow_penalty": candidate["overflow_penalty"],
+        "timesteps_per_second": results["timesteps_per_second"],
+    }
+
+
+def spec_name(spec) -> str:
+    kwargs = spec.get("kwargs", {})
+    if not kwargs:
+        return spec["strategy"]
+    return "{}({})".format(spec["strategy"], ", ".join("{}={}".format(k, v) for k, v in sorted(kwargs.items())))
+
+
+def run_backtests(strategy_specs, start_timesteps, n_timesteps, opponents=(), engine="object", data_dir="data", max_workers=None,
+                  environment="norwegian") -> list:
+    """
+    Plays every strategy spec from every start timestep on a process pool, returns one result row per game
+    """
+    # convert the data files once in this process, so the workers only memory-map the cache
+    ForcingDataStore(data_dir=data_dir).build_cache()
+
+    tasks = [
+        {"strategy": spec, "start_timestep": start_timestep, "n_timesteps": n_timesteps,
+         "opponents": list(opponents), "engine": engine, "data_dir": data_dir, "environment": environment}
+        for spec in strategy_specs
+        for start_timestep in start_timesteps
+    ]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(data_dir,)) as executor:
+        return list(executor.map(run_backtest, tasks, chunksize=chunksize))
+
+
+def aggregate(rows) -> list:
+    """
+    One row per strategy with the mean cash, production and overflow penalty over all start timesteps
+    """
+    by_strategy = {}
+    for row in rows:
+        by_strategy.setdefault(row["strategy"], []).append(row)
+
+    table = []
+    for strategy, strategy_rows in by_strategy.items():
+        n = len(strategy_rows)
+        table.append({
+            "strategy": strategy,
+            "n_games": n,
+            "mean_cash": sum(r["cash"] for r in strategy_rows) / n,
+            "min_cash": min(r["cash"] for r in strategy_rows),
+            "mean_production_mwh": sum(r["production_mwh"] for r in strategy_rows) / n,
+            "mean_overflow_penalty": sum(r["overflow_penalty"] for r in strategy_rows) / n,
+        })
+
+    return sorted(table, key=lambda r: r["mean_cash"], reverse=True)
+
+
+def _parse_start(value) -> int:
+    """A start is either a timestep or a date (YYYY-MM-DD), timestep 0 is Jan 1 2010"""
+    try:
+        return int(value)
+    except ValueError:
+        return (datetime.datetime.strptime(value, "%Y-%m-%d") - datetime.datetime(2010, 1, 1)).days
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest strategies over many start dates on all cores')
+    parser.add_argument('--strategies', '-s', required=True, help='JSON list of strategy specs ({"strategy": "module:Class", "kwargs": {...}}), inline or a file name')
+    parser.add_argument('--opponents', default='[]', help='JSON list of strategy specs that play against each strategy (default: none)')
+    parser.add_argument('--starts', nargs='+', default=['0'], help='Start timesteps or dates (YYYY-MM-DD) (default: 0)')
+    parser.add_argument('--n_timesteps', '-n', type=int, default=200, help='Number of timesteps per game (default: 200)')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='Number of processes (default: number of cores)')
+    parser.add_argument('--engine', default='object', choices=Game.ENGINES, help='Simulation engine (default: object)')
+    parser.add_argument('--environment', default='norwegian', help='Environment (map) in <data_dir>/environments or a json file (default: norwegian)')
+    parser.add_argument('--data_dir', default='data', help='Data directory (default: data)')
+    parser.add_argument('--output', '-o', default=None, help='Write every game result to this csv file')
+    args = parser.parse_args()
+
+    def load_specs(value):
+        if os.path.isfile(value):
+            with open(value, 'r') as f:
+                return json.load(f)
+        return json.loads(value)
+
+    rows = run_backtests(load_specs(args.strategies), [_parse_start(s) for s in args.starts], args.n_timesteps,
+                         opponents=load_specs(args.opponents), engine=args.engine, data_dir=args.data_dir, max_workers=args.workers,
+                         environment=args.environment)
+    if not rows:
+        sys.exit("No backtests to run, give at least one strategy and one start")
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=["strategy", "n_games", "mean_cash", "min_cash", "mean_production_mwh", "mean_overflow_penalty"], delimiter='\t')
+    writer.writeheader()
+    writer.writerows(aggregate(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+from copy import copy
+
+import numpy as np
+
+from hydro_trader.simulation import Simulation, compute_natural_inflow
+
+
+class BatchSimulation:
+    """
+    Vectorized alternative to running one deep-copied Simulation per player.
+
+    All players play on the same reservoir network, so the static description (capacities,
+    areas, connections and weather data) is stored once, and every dynamic value is stored
+    as a (players x components) NumPy array. simulate_day advances every player in one step.
+
+    The results are the same as calling Simulation.simulate_day on each player's copy.
+    """
+
+    SECONDS_IN_DAY = 86400
+    PRODUCTION_HEAD_HEIGHT = 50.0 # Reservoir.calculate_production always produces with a 50m head
+    RHO = 1000  # kg/m³ (water density)
+    G = 9.81    # m/s² (gravitational acceleration)
+
+    def __init__(self, simulation: Simulation):
+        reservoirs = simulation.reservoirs
+        rivers = simulation.rivers
+        mountains = simulation.mountains
+
+        self.reservoir_ids = [r.id for r in reservoirs]
+        self.river_ids = [r.id for r in rivers]
+        self.mountain_ids = [m.id for m in mountains]
+        self.reservoir_index = {r_id: i for i, r_id in enumerate(self.reservoir_ids)}
+
+        # Static reservoir properties (R,)
+        self.capacity = np.array([r.capacity for r in reservoirs], dtype=np.float64)
+        self.water_area = np.array([r.water_area for r in reservoirs], dtype=np.float64)
+        self.basin_area = np.array([r.basin_area for r in reservoirs], dtype=np.float64)
+        self.rain_height = np.array([r.rain_height for r in reservoirs], dtype=np.float64)
+        self.generator_efficiency = np.array([r.generator_efficiency for r in reservoirs], dtype=np.float64)
+        self.max_generator_flow = np.array([r.max_generator_flow for r in reservoirs], dtype=np.float64)
+
+        # Static river properties (K,)
+        self.length_in_timesteps = np.array([r.length_in_timesteps for r in rivers], dtype=np.int64)
+        self.max_flow = np.array([r.max_flow for r in rivers], dtype=np.float64)
+        self.max_length = int(self.length_in_timesteps.max()) if rivers else 1
+
+        # Static mountain properties (M,)
+        self.snow_area = np.array([m.snow_area for m in mountains], dtype=np.float64)
+
+        # Connections, from the compiled network : -1 when a river runs into the ocean
+        self.network = simulation.get_network()
+        self.reservoir_out_rivers = [self.network.out_rivers(i).tolist() for i in range(len(reservoirs))]
+        self.reservoir_in_rivers = [[river.id for river in r.in_rivers] for r in reservoirs]
+        self.river_output = self.network.river_output.tolist()
+        self.mountain_output = self.network.mountain_output.tolist()
+
+        # Weather data, padded with the last row so that it can be indexed by any timestep
+        self.rain_length = np.array([len(r.rain_data) for r in reservoirs], dtype=np.int64)
+        self.is_raining_data = self._pad_series([r.rain_data.is_raining for r in reservoirs], np.bool_)
+        self.forecast_data = self._pad_series([r.rain_data.forecast_probability for r in reservoirs], np.float64)
+
+        self.snow_length = np.array([len(m.data) for m in mountains], dtype=np.int64)
+        self.snow_height_data = self._pad_series([m.data.snow_height for m in mountains], np.float64)
+        self.temperature_data = self._pad_series([m.data.temperature for m in mountains], np.float64)
+
+        # Rain and snow melt does not depend on the players, computed once for every timestep (timesteps x reservoirs)
+        if reservoirs and all(r.natural_inflow_data is not None for r in reservoirs):
+            # already precomputed by the simulation
+            self.natural_inflow_data = np.stack([r.natural_inflow_data.total for r in reservoirs], axis=1)
+            self.rain_inflow_data = np.stack([r.natural_inflow_data.rain for r in reservoirs], axis=1)
+        else:
+            self.natural_inflow_data, self.rain_inflow_data, _ = compute_natural_inflow(reservoirs, mountains)
+
+        # The state a new player starts with, copied from the template simulation
+        self.template = self._row_from_simulation(simulation)
+
+        # Dynamic state, one row per player
+        self.n_players = 0
+        self.river_head = 0 # rivers are ring buffers sharing the same head, logical index i is at (head + i) % max_length
+        self.state = {name: np.zeros((0,) + np.shape(value), dtype=np.asarray(value).dtype) for name, value in self.template.items()}
+
+    @staticmethod
+    def _pad_series(series, dtype):
+        """Stacks a list of per component series into a (timesteps x components) array"""
+        n_timesteps = max([len(s) for s in series] + [1])
+        out = np.zeros((n_timesteps, len(series)), dtype=dtype)
+        for i, s in enumerate(series):
+            if len(s) > 0:
+                out[:len(s), i] = s
+                out[len(s):, i] = s[-1]
+        return out
+
+    def _row_from_simulation(self, simulation: Simulation) -> dict:
+        reservoirs = simulation.reservoirs
+        rivers = simulation.rivers
+        mountains = simulation.mountains
+
+        water_queue = np.zeros((len(rivers), self.max_length), dtype=np.float64)
+        for k, river in enumerate(rivers):
+            water_queue[k, :river.length_in_timesteps] = river.water_queue
+
+        # all components of a simulation advance together, so they share the same timestep
+        components = reservoirs + mountains
+        timestep = components[0].timestep if components else 0
+
+        return {
+            "timestep": np.int64(timestep),
+            "water_amount": np.array([r.water_amount for r in reservoirs], dtype=np.float64),
+            "river_inflow": np.array([r.river_inflow for r in reservoirs], dtype=np.float64),
+            "natural_inflow": np.array([r.natural_inflow for r in reservoirs], dtype=np.float64),
+            "river_outflow": np.array([r.river_outflow for r in reservoirs], dtype=np.float64),
+            "generator_head_height": np.array([r.generator_head_height for r in reservoirs], dtype=np.float64),
+            "generator_flow": np.array([r.generator_flow for r in reservoirs], dtype=np.float64),
+            "is_producing": np.array([r.is_producing for r in reservoirs], dtype=np.bool_),
+            "current_production": np.array([r.current_production for r in reservoirs], dtype=np.float64),
+            "is_raining": np.array([r.is_raining for r in reservoirs], dtype=np.bool_),
+            "rain_forecast_probability": np.array([r.rain_forecast_probability for r in reservoirs], dtype=np.float64),
+            "water_queue": water_queue,
+            "current_flow": np.array([r.current_flow for r in rivers], dtype=np.float64),
+            "consecutive_days_over_max": np.array([r.consecutive_days_over_max for r in rivers], dtype=np.int64),
+            "cumulative_penalty": np.array([r.cumulative_penalty for r in rivers], dtype=np.float64),
+            "current_snow_height": np.array([m.current_snow_height for m in mountains], dtype=np.float64),
+            "temperature": np.array([m.temperature for m in mountains], dtype=np.float64),
+        }
+
+    def _ordered_sum(self, values, order):
+        """Sums the columns of values (players x components) one at a time in the given order"""
+        if len(order) == 0:
+            return np.zeros(self.n_players, dtype=np.float64)
+        return np.cumsum(values[:, order], axis=1)[:, -1]
+
+    def add_player(self) -> int:
+        """
+        Adds a player with the template state, returns the row index of the player
+        """
+        for name, value in self.template.items():
+            row = np.asarray(value)
+            if name == "water_queue":
+                # the template queue is in logical order, rotate it to the current head
+                row = np.roll(row, self.river_head, axis=1)
+            self.state[name] = np.concatenate([self.state[name], row[np.newaxis]])
+
+        self.n_players += 1
+        return self.n_players - 1
+
+    def player_view(self, index) -> "BatchPlayerView":
+        return BatchPlayerView(self, index)
+
+    def rollout(self, index, plans, horizon=None) -> dict:
+        """
+        Evaluates production plans from the current state of the player at row *index*, see Simulation.rollout
+        """
+        row = {name: value[index] for name, value in self.state.items()}
+        return self._rollout(row, self.river_head, plans, horizon)
+
+    def _rollout(self, row, river_head, plans, horizon):
+        producing = self._plan_masks(plans, horizon)
+        n_plans, horizon = producing.shape[:2]
+
+        # a scratch batch with one row per plan, the static arrays are shared with this batch
+        scratch = copy(self)
+        scratch.n_players = n_plans
+        scratch.river_head = river_head
+        scratch.state = {name: np.repeat(np.asarray(value)[np.newaxis], n_plans, axis=0) for name, value in row.items()}
+
+        production_mwh = np.zeros(n_plans, dtype=np.float64)
+        overflow_penalty = np.zeros(n_plans, dtype=np.float64)
+        for day in range(horizon):
+            scratch.state["is_producing"][:] = producing[:, day]
+            day_production, day_penalty = scratch.simulate_day()
+            production_mwh += day_production
+            overflow_penalty += day_penalty
+
+        return {
+            "reservoir_ids": list(self.reservoir_ids),
+            "production_mwh": production_mwh,
+            "overflow_penalty": overflow_penalty,
+            "water_amount": scratch.state["water_amount"],
+        }
+
+    def _plan_masks(self, plans, horizon):
+        """
+        Converts plans to a bool array (n_plans x horizon x reservoirs)
+        """
+        if isinstance(plans, np.ndarray):
+            masks = plans.astype(np.bool_)
+        else:
+            masks = np.zeros((len(plans), len(self.reservoir_ids)), dtype=np.bool_)
+            for i, reservoir_ids in enumerate(plans):
+                for r_id in reservoir_ids:
+                    masks[i, self.reservoir_index[r_id]] = True
+
+        if masks.ndim == 2:
+            if horizon is None:
+                raise ValueError("horizon is required when the plans are the same every day")
+            masks = np.repeat(masks[:, np.newaxis], horizon, axis=1)
+        elif masks.ndim != 3 or (horizon is not None and masks.shape[1] != horizon):
+            raise ValueError("Plans must be (n_plans x reservoirs) or (n_plans x horizon x reservoirs), got {}".format(masks.shape))
+
+        if masks.shape[2] != len(self.reservoir_ids):
+            raise ValueError("Plans have {} reservoirs, the network has {}".format(masks.shape[2], len(self.reservoir_ids)))
+
+        return masks
+
+    def set_production(self, index, reservoir_ids):
+        """Sets the reservoirs that should produce this timestep for the player at row *index*"""
+        producing = self.state["is_producing"][index]
+        producing[:] = False
+        for r_id in reservoir_ids:
+            i = self.reservoir_index.get(r_id)
+            if i is not None:
+                producing[i] = True
+
+    def get_water_queue(self, index, river_index) -> list:
+        """Returns the flow profile of a river in the same order as River.water_queue"""
+        length = int(self.length_in_timesteps[river_index])
+        slots = (self.river_head + np.arange(length)) % self.max_length
+        return self.state["water_queue"][index, river_index, slots].tolist()
+
+    def simulate_day(self):
+        """
+        Advances every player one day.
+
+        Returns two arrays of length n_players: the total production in MWh and the river overflow penalty.
+        """
+        s = self.state
+        water = s["water_amount"]
+        capacity = self.capacity
+
+        timestep = s["timestep"] + 1
+        s["timestep"] = timestep
+
+        # Mountains - the snow melt is part of the precomputed natural inflow
+        t = np.minimum(timestep, self.snow_height_data.shape[0] - 1)
+        has_snow_data = timestep[:, np.newaxis] < self.snow_length
+        s["current_snow_height"] = np.where(has_snow_data, self.snow_height_data[t], s["current_snow_height"])
+        s["temperature"] = np.where(has_snow_data, self.temperature_data[t], s["temperature"])
+
+        # Reservoirs - rain and snow melt
+        s["river_inflow"][:] = 0.0
+        s["river_outflow"][:] = 0.0
+
+        t = np.minimum(timestep, self.is_raining_data.shape[0] - 1)
+        has_rain_data = timestep[:, np.newaxis] < self.rain_length
+        s["is_raining"] = np.where(has_rain_data, self.is_raining_data[t], s["is_raining"])
+        s["rain_forecast_probability"] = np.where(has_rain_data, self.forecast_data[t], s["rain_forecast_probability"])
+
+        t = np.minimum(timestep, self.natural_inflow_data.shape[0] - 1)
+        has_inflow_data = (timestep < self.natural_inflow_data.shape[0])[:, np.newaxis]
+        s["natural_inflow"] = np.where(has_inflow_data, self.rain_inflow_data[t], 0.0)
+        water[:] = np.minimum(water + np.where(has_inflow_data, self.natural_inflow_data[t], 0.0), capacity)
+
+        # Reservoirs - production (see Reservoir.calculate_production)
+        water0 = water.copy()
+        is_producing = s["is_producing"]
+        has_water = (water / capacity) > 0.1
+        is_active = is_producing & has_water & (water / self.water_area > 0)
+        is_producing &= has_water
+
+        head = s["generator_head_height"]
+        head[is_active] = self.PRODUCTION_HEAD_HEIGHT
+
+        max_water_height = capacity / self.water_area
+        flow_factor = np.minimum((water / self.water_area) / max_water_height, 1.0)
+        actual_flow_rate = flow_factor * self.max_generator_flow
+
+        power_watts = self.generator_efficiency * self.RHO * self.G * actual_flow_rate * head
+        power_mwh = (power_watts / 1000000) * 24
+        s["current_production"] = np.where(is_active, power_mwh, 0.0)
+        s["generator_flow"][~is_active] = 0.0
+
+        water_used = np.minimum(water, actual_flow_rate * self.SECONDS_IN_DAY)
+        water -= np.where(is_active, water_used, 0.0)
+
+        # Production water is divided equally between the out rivers, one scatter-add over the outflow edges
+        # of the whole network (np.add.at adds in edge order, the same order as the object simulation)
+        network = self.network
+        water_out = (water0 - water)[:, network.outflow_reservoir]
+        queue = s["water_queue"]
+        np.add.at(queue[:, :, self.river_head], (slice(None), network.outflow_river),
+                  np.where(water_out > 0, water_out / network.outflow_n_rivers, 0.0))
+
+        # cumsum adds one reservoir at a time, so the total is rounded the same way as in Simulation.simulate_day
+        total_production = self._ordered_sum(s["current_production"], network.reservoir_order)
+
+        # Rivers
+        current_flow = queue.sum(axis=2)
+        s["current_flow"] = current_flow
+
+        # River.process_timestep and Simulation.simulate_day both call get_max_flow_penalty,
+        # so the cumulative penalty grows by two each day the river is over max flow
+        is_over_max = current_flow > self.max_flow
+        s["consecutive_days_over_max"] = np.where(is_over_max, s["consecutive_days_over_max"] + 1, 0)
+        cumulative_penalty = np.where(is_over_max, (s["cumulative_penalty"] + 1.0) + 1.0, 0.0)
+        s["cumulative_penalty"] = cumulative_penalty
+
+        river_overflow_penalty = self._ordered_sum(cumulative_penalty, network.river_order)
+
+        # pop the end of every river queue, the freed slot becomes the new head
+        rivers = np.arange(len(self.river_ids))
+        tail = (self.river_head + self.length_in_timesteps - 1) % self.max_length
+        outflow_water = queue[:, rivers, tail]
+        queue[:, rivers, tail] = 0.0
+        self.river_head = (self.river_head - 1) % self.max_length
+
+        # Deliver the river water over the delivery edges, clamping once after all rivers gives the same result
+        # as clamping after each river since all the water is positive
+        delivered = outflow_water[:, network.delivery_river]
+        np.add.at(s["river_inflow"], (slice(None), network.delivery_reservoir), delivered)
+        np.add.at(water, (slice(None), network.delivery_reservoir), delivered)
+        np.minimum(water, capacity, out=water)
+
+        # turn off all reservoirs
+        is_producing[:] = False
+
+        return total_production, river_overflow_penalty
+
+
+class BatchPlayerView:
+    """
+    Read-only view of one player's row in a BatchSimulation, exposes the same state methods as Simulation
+    """
+
+    def __init__(self, batch: BatchSimulation, index: int):
+        self.batch = batch
+        self.index = index
+
+    def set_production_plan(self, reservoir_ids):
+        self.batch.set_production(self.index, reservoir_ids)
+
+    def rollout(self, plans, horizon=None) -> dict:
+        return self.batch.rollout(self.index, plans, horizon)
+
+    def get_total_water_in_m3(self):
+        return sum(self.batch.state["water_amount"][self.index].tolist())
+
+    def get_timestep_state(self) -> dict:
+        b = self.batch
+        s = {name: value[self.index].tolist() for name, value in b.state.items() if name != "water_queue"}
+
+        return {
+            "reservoirs": {
+                r_id: {
+                    "water_amount": s["water_amount"][i],
+                    "capacity": float(b.capacity[i]),
+                    "forecast_probability": s["rain_forecast_probability"][i],
+                    "did_rain": s["is_raining"][i],
+                }
+                for i, r_id in enumerate(b.reservoir_ids)
+            },
+            "rivers": {
+                r_id: {
+                    "flow": b.get_water_queue(self.index, k),
+                }
+                for k, r_id in enumerate(b.river_ids)
+            },
+            "mountains": {
+                m_id: {
+                    "snow_height": s["current_snow_height"][m],
+                    "temperature": s["temperature"][m],
+                }
+                for m, m_id in enumerate(b.mountain_ids)
+            },
+            }
+
+    def get_full_state(self) -> dict:
+        """
+        Same layout as Simulation.get_full_state
+        """
+        b = self.batch
+        s = {name: value[self.index].tolist() for name, value in b.state.items() if name != "water_queue"}
+
+        state: dict = {
+            "reservoirs": {},
+            "rivers": {},
+            "mountains": {},
+        }
+
+        for i, r_id in enumerate(b.reservoir_ids):
+            state["reservoirs"][r_id] = {
+                "water_amount": s["water_amount"][i],
+                "water_area": float(b.water_area[i]),
+                "basin_area": float(b.basin_area[i]),
+                "capacity": float(b.capacity[i]),
+                "river_inflow": s["river_inflow"][i],
+                "natural_inflow": s["natural_inflow"][i],
+                "river_outflow": s["river_outflow"][i],
+                "generator_efficiency": float(b.generator_efficiency[i]),
+                "max_generator_flow": float(b.max_generator_flow[i]),
+                "generator_head_height": s["generator_head_height"][i],
+                "generator_flow": s["generator_flow"][i],
+                "is_raining": s["is_raining"][i],
+                "rain_forecast_probability": s["rain_forecast_probability"][i],
+                "in_rivers": list(b.reservoir_in_rivers[i]),
+                "out_rivers": [b.river_ids[k] for k in b.reservoir_out_rivers[i]],
+            }
+
+        for k, r_id in enumerate(b.river_ids):
+            output = b.river_output[k]
+            state["rivers"][r_id] = {
+                "length_in_timesteps": int(b.length_in_timesteps[k]),
+                "max_flow": float(b.max_flow[k]),
+                "current_flow": s["current_flow"][k],
+                "output_reservoir": b.reservoir_ids[output] if output >= 0 else None,
+            }
+
+        for m, m_id in enumerate(b.mountain_ids):
+            state["mountains"][m_id] = {
+                "current_snow_height": s["current_snow_height"][m],
+                "temperature": s["temperature"][m],
+                "snow_area": float(b.snow_area[m]),
+                "output_reservoir": b.reservoir_ids[b.mountain_output[m]],
+            }
+
+        return state
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict
+
+
+logger = logging.getLogger("hydro_trader.broadcast")
+
+POLICIES = ("latest", "drop")
+
+
+class Connection:
+    """
+    The outbound side of a player's websocket: a bounded queue of encoded messages (str for text frames, bytes for
+    binary frames) drained by its own writer task, so queueing a message never waits on the socket.
+
+    Timestep states are marked as states: with the "latest" policy a newer state replaces a state that was not
+    sent yet (the player skips to the latest state), with "drop" a player whose queue is full is disconnected.
+    Other messages (the full state, "started") are never replaced.
+    """
+
+    def __init__(self, websocket, max_queue=8, policy="latest", name=""):
+        if policy not in POLICIES:
+            raise ValueError("Unknown send policy: {}, expected one of {}".format(policy, POLICIES))
+
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.name = name
+
+        self.queue = deque() # (payload, is_state)
+        self.closed = False
+        self.dropped = False # closed because the player was too slow, not because of the socket
+        self.n_sent = 0
+        self.n_skipped = 0
+
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event() # set when the writer has sent everything
+        self._drained.set()
+        self._task = asyncio.create_task(self._writer())
+
+    def send(self, payload, is_state=False) -> bool:
+        """Queues a message, returns False if the connection is closed or was dropped because it is too slow"""
+        if self.closed:
+            return False
+
+        if is_state and self.policy == "latest":
+            for i, (_, queued_is_state) in enumerate(self.queue):
+                if queued_is_state:
+                    del self.queue[i]
+                    self.n_skipped += 1
+                    break
+
+        if len(self.queue) >= self.max_queue:
+            logger.warning("Dropping %s, %d messages waiting to be sent", self.name, len(self.queue))
+            self.dropped = True
+            self.close()
+            return False
+
+        self.queue.append((payload, is_state))
+        self._drained.clear()
+        self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._drained.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                payload, _ = self.queue.popleft()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                self.n_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Stopped sending to %s: %s", self.name, e)
+            self.closed = True
+            self.queue.clear()
+            self._drained.set()
+
+    async def flush(self, timeout=1.0):
+        """Waits (at most timeout seconds) until the queued messages are sent"""
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        """Stops the writer, messages that were not sent are discarded, and closes the websocket"""
+        if self.closed and self._task.done():
+            return
+        self.closed = True
+        self.queue.clear()
+        self._task.cancel()
+        asyncio.create_task(self._close_websocket())
+
+    async def _close_websocket(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+class Broadcaster:
+    """
+    The connections of all players. publish hands the states of a timestep to every connection without waiting,
+    each connection is written by its own task, so a slow player only delays (or drops) itself.
+    """
+
+    def __init__(self, max_queue=8, policy="latest"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown send policy: {}, expected one of {}".format(policy, POLICIES))
+
+        self.max_queue = max_queue
+        self.policy = policy
+        self.connections : Dict[str, Connection] = {}
+        self.n_dropped = 0 # connections dropped by the send policy
+        self.n_closed = 0 # connections found closed by a socket error
+
+    def connect(self, player_id, websocket) -> Connection:
+        """A new connection for the player, an older connection of the same player is closed"""
+        self.disconnect(player_id)
+        connection = Connection(websocket, max_queue=self.max_queue, policy=self.policy, name="player {}".format(player_id))
+        self.connections[player_id] = connection
+        return connection
+
+    def disconnect(self, player_id):
+        connection = self.connections.pop(player_id, None)
+        if connection is not None:
+            connection.close()
+
+    async def flush_and_disconnect(self, player_id, timeout=1.0):
+        connection = self.connections.get(player_id)
+        if connection is not None:
+            await connection.flush(timeout)
+        self.disconnect(player_id)
+
+    def disconnect_all(self):
+        for player_id in list(self.connections):
+            self.disconnect(player_id)
+
+    def send(self, player_id, payload, is_state=False) -> bool:
+        connection = self.connections.get(player_id)
+        if connection is None:
+            return False
+
+        if not connection.send(payload, is_state=is_state):
+            if connection.dropped:
+                self.n_dropped += 1
+            else:
+                self.n_closed += 1
+            del self.connections[player_id]
+            return False
+        return True
+
+    def publish(self, payloads: Dict[str, object]):
+        """Queues the timestep state of every player (player_id -> encoded state)"""
+        for player_id, payload in payloads.items():
+            self.send(player_id, payload, is_state=True)
+
+    def stats(self) -> dict:
+        connections = list(self.connections.values())
+        return {
+            "policy": self.policy,
+            "max_queue": self.max_queue,
+            "connections": len(connections),
+            "queued": sum(len(c.queue) for c in connections),
+            "sent": sum(c.n_sent for c in connections),
+            "skipped": sum(c.n_skipped for c in connections),
+            "dropped": self.n_dropped,
+            "closed": self.n_closed,
+        }
@@ -9,6 +9,9 @@ from typing import Any, Callable, Dict, Optional, Type
 import websockets
 from websockets import WebSocketClientProtocol
 
+from hydro_trader.delta import DeltaDecoder
+from hydro_trader.wire import ENCODINGS, StateCodec, packb, unpackb
+
 # setup logger
 logging.basicConfig(
     level=logging.INFO,
@@ -67,7 +70,15 @@ class Strategy:
     
 
 class Client:
-    def __init__(self, strategy, uri, player_name, game_id):
+    def __init__(self, strategy, uri, player_name, game_id, delta=False, encoding="json"):
+        """
+        delta: ask the server to send only the changes of each timestep state, the full state is
+               rebuilt here so the strategy always sees the complete current_state
+        encoding: "json" or "binary" (MessagePack with component indices, see hydro_trader.wire), the strategy
+                  gets the same states either way
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding: {}, expected one of {}".format(encoding, ENCODINGS))
         self.uri = uri
         self.player_id = str(uuid.uuid4())
         self.player_name = player_name
@@ -77,6 +88,12 @@ class Client:
         self.game_id = game_id
         self.game_uri = "{}/{}/{}".format(self.uri, self.game_id, self.player_id)
 
+        self.delta = delta
+        self.decoder = DeltaDecoder() if delta else None
+
+        self.encoding = encoding
+        self.codec = None # made from the full state in the binary encoding
+
     async def send_json(self, data):
         await self.websocket.send(json.dumps(data))
 
@@ -84,6 +101,45 @@ class Client:
         message = await self.websocket.recv()
         return json.loads(message)
 
+    async def send_message(self, data):
+        if self.encoding == "binary":
+            await self.websocket.send(packb(data))
+        else:
+            await self.send_json(data)
+
+    async def recv_message(self):
+        if self.encoding != "binary":
+            return await self.recv_json()
+
+        message = await self.websocket.recv()
+        return self.codec.decode(message) if self.codec is not None else unpackb(message)
+
+    async def recv_initial_state(self):
+        state = await self.recv_message()
+        if self.encoding == "binary":
+            self.codec = StateCodec.from_state(state)
+        return state
+
+    async def recv_state(self):
+        """The next timestep state, rebuilt from a keyframe or delta in delta mode"""
+        message = await self.recv_message()
+        if self.decoder is None:
+            return message
+
+        requested_keyframe = False
+        while True:
+            try:
+                return self.decoder.decode(message)
+            except KeyError:
+                # the base of the delta is gone: ask for a keyframe and drop every delta until it arrives,
+                # the strategy only ever gets states that were rebuilt
+                if not requested_keyframe:
+                    logger.warning("Could not rebuild the state, waiting for a keyframe")
+                    self.decoder = DeltaDecoder()
+                    await self.send_message({"request": "keyframe"})
+                    requested_keyframe = True
+            message = await self.recv_message()
+
     def play(self):        
         asyncio.run(self.async_play())
 
@@ -97,7 +153,9 @@ class Client:
             player_info = {
                 "player_id": self.player_id,
                 "player_name": self.player_name,
-                "password": "123"
+                "password": "123",
+                "delta": self.delta,
+                "encoding": self.encoding,
             }
 
             self.strategy.player_id = self.player_id
@@ -108,18 +166,18 @@ class Client:
             print("waiting on playerinit state")
 
             # get initial states
-            self.strategy.initial_state = await self.recv_json()
-            self.strategy.current_state = await self.recv_json()
+            self.strategy.initial_state = await self.recv_initial_state()
+            self.strategy.current_state = await self.recv_state()
             self.strategy.got_initial_state()
 
             # send ready 
             ready_msg = {"status": "ready"}
-            await self.send_json(ready_msg)
+            await self.send_message(ready_msg)
 
             print("waiting on game start")
 
             # wait for game to start
-            started_msg = await self.recv_json()
+            started_msg = await self.recv_message()
             if started_msg["status"] != "started":
                 raise Exception("Game not started")
 
@@ -129,10 +187,12 @@ class Client:
                 while True:                    
                     # get production plan and send
                     plan = self.strategy.get_production_plan_and_power_price()                    
-                    await self.send_json(plan)
+                    if self.decoder is not None:
+                        plan = dict(plan, ack=self.decoder.ack)
+                    await self.send_message(plan)
 
                     # get snapshot state
-                    snapshot = await self.recv_json()
+                    snapshot = await self.recv_state()
                     self.strategy.current_state = snapshot                                        
 
                     if snapshot["is_game_over"]:
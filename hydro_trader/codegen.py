@@ -0,0 +1,269 @@
+import random
+import time
+from array import array
+
+import numpy as np
+
+from hydro_trader.simulation import Simulation
+
+
+class StepProgram:
+    """
+    A step function generated for one concrete network, an alternative to Simulation.simulate_day.
+
+    The components are unrolled in the order of the compiled network, the static parameters (capacities, areas,
+    generator and river constants) are folded into the source as literals and the dynamic values are kept in
+    local variables during the day, so a day is a straight run of arithmetic without loops, method calls or
+    lookups of static attributes. The results are exactly the same as Simulation.simulate_day.
+
+    The program is generated once per network and bound to each player's copy of the simulation:
+
+        program = StepProgram(simulation)
+        step = program.bind(simulation.fork())
+        total_production, river_overflow_penalty = step({"Nyfjord", "Vestarne"})
+
+    The static parameters must not change after the program is generated, and the natural inflow must be
+    precomputed (Simulation.precompute_natural_inflow).
+    """
+
+    def __init__(self, simulation: Simulation):
+        self.network = simulation.get_network()
+        self.namespace = self._data_namespace(simulation)
+        self.source = generate_step_source(simulation)
+
+        exec(compile(self.source, "<hydro_trader step function>", "exec"), self.namespace)
+        self._bind = self.namespace["bind"]
+
+    @staticmethod
+    def _data_namespace(simulation):
+        """
+        The weather series as compact arrays, shared by every player. Indexing an array gives a python float,
+        the same value Reservoir and MontainWithSnow get from float() of the numpy series.
+        """
+        namespace = {"min": min, "sum": sum} # globals are found faster than builtins
+        for i, reservoir in enumerate(simulation.reservoirs):
+            if reservoir.natural_inflow_data is None:
+                raise ValueError("The natural inflow of {} is not precomputed".format(reservoir.id))
+            namespace["IS_RAINING_{}".format(i)] = array('b', np.asarray(reservoir.rain_data.is_raining, dtype=np.int8).tobytes())
+            namespace["FORECAST_{}".format(i)] = array('d', np.asarray(reservoir.rain_data.forecast_probability, dtype=np.float64).tobytes())
+            namespace["INFLOW_RAIN_{}".format(i)] = array('d', np.asarray(reservoir.natural_inflow_data.rain, dtype=np.float64).tobytes())
+            namespace["INFLOW_TOTAL_{}".format(i)] = array('d', np.asarray(reservoir.natural_inflow_data.total, dtype=np.float64).tobytes())
+
+        for j, mountain in enumerate(simulation.mountains):
+            if mountain.snow_melt_data is None:
+                raise ValueError("The snow melt of {} is not precomputed".format(mountain.id))
+            namespace["SNOW_HEIGHT_{}".format(j)] = array('d', np.asarray(mountain.data.snow_height, dtype=np.float64).tobytes())
+            namespace["TEMPERATURE_{}".format(j)] = array('d', np.asarray(mountain.data.temperature, dtype=np.float64).tobytes())
+
+        return namespace
+
+    def bind(self, simulation: Simulation):
+        """
+        Returns step(producing) for this simulation (a fork of the simulation the program was generated for),
+        producing is a set of the reservoir ids that produce today. Returns (total_production, river_overflow_penalty).
+        """
+        if simulation.get_network().shape != self.network.shape:
+            raise ValueError("The simulation does not have the network the step function was generated for")
+        return self._bind(simulation.reservoirs, simulation.rivers, simulation.mountains)
+
+
+def _unpack(names, values):
+    if not names:
+        return []
+    return ["{}, = {}".format(", ".join(names), values)]
+
+
+def generate_step_source(simulation: Simulation) -> str:
+    """
+    Python source of bind(reservoirs, rivers, mountains), which returns the step function for one simulation.
+    Mirrors MontainWithSnow, Reservoir and River.process_timestep with precomputed natural inflow.
+    """
+    network = simulation.get_network()
+    reservoirs = simulation.reservoirs
+    rivers = simulation.rivers
+    mountains = simulation.mountains
+
+    river_of = {id(river): k for k, river in enumerate(rivers)}
+
+    lines = ["def bind(reservoirs, rivers, mountains):"]
+    lines += ["    " + line for line in _unpack(["r{}".format(i) for i in range(len(reservoirs))], "reservoirs")]
+    lines += ["    " + line for line in _unpack(["k{}".format(k) for k in range(len(rivers))], "rivers")]
+    lines += ["    " + line for line in _unpack(["m{}".format(j) for j in range(len(mountains))], "mountains")]
+    lines += ["", "    def step(producing):"]
+
+    body = []
+    emit = body.append
+
+    # Mountains - the snow melt is part of the precomputed natural inflow
+    for j in network.mountain_order.tolist():
+        emit("t = m{}.timestep + 1".format(j))
+        emit("m{}.timestep = t".format(j))
+        emit("if t < {}:".format(len(mountains[j].data)))
+        emit("    m{0}.current_snow_height = SNOW_HEIGHT_{0}[t]".format(j))
+        emit("    m{0}.temperature = TEMPERATURE_{0}[t]".format(j))
+
+    # Reservoirs - rain, snow melt and production
+    emit("total_production = 0")
+    for i in network.reservoir_order.tolist():
+        reservoir = reservoirs[i]
+        if reservoir.water_area <= 0 or reservoir.capacity <= 0:
+            raise ValueError("Reservoir {} must have a positive water_area and capacity".format(reservoir.id))
+
+        capacity = repr(float(reservoir.capacity))
+        water_area = repr(float(reservoir.water_area))
+        max_water_height = repr(reservoir.capacity / reservoir.water_area)
+        max_generator_flow = repr(float(reservoir.max_generator_flow))
+        efficiency_rho_g = repr(reservoir.generator_efficiency * 1000 * 9.81)
+        out_rivers = [river_of[id(river)] for river in reservoir.out_rivers]
+
+        emit("# {}".format(reservoir.id))
+        emit("t = r{}.timestep + 1".format(i))
+        emit("r{}.timestep = t".format(i))
+        emit("if t < {}:".format(len(reservoir.rain_data)))
+        emit("    r{0}.is_raining = IS_RAINING_{0}[t] != 0".format(i))
+        emit("    r{0}.rain_forecast_probability = FORECAST_{0}[t]".format(i))
+        emit("ri{} = 0.0".format(i))
+        emit("r{}.river_outflow = 0.0".format(i))
+        emit("if t < {}:".format(len(reservoir.natural_inflow_data)))
+        emit("    ni{0} = INFLOW_RAIN_{0}[t]".format(i))
+        emit("    w{0} = min(r{0}.water_amount + INFLOW_TOTAL_{0}[t], {1})".format(i, capacity))
+        emit("else:")
+        emit("    ni{} = 0.0".format(i))
+        emit("    w{0} = r{0}.water_amount".format(i))
+
+        # overflow, only when the water was above the capacity before the day started
+        emit("if w{} >= {}:".format(i, capacity))
+        emit("    overflow = w{} - {}".format(i, capacity))
+        emit("    w{} = {}".format(i, capacity))
+        if out_rivers:
+            emit("    if overflow > 0:")
+            emit("        r{}.river_outflow = overflow".format(i))
+            emit("        per_river = overflow / {}".format(len(out_rivers)))
+            for k in out_rivers:
+                emit("        k{0}._queue[k{0}._head] += per_river".format(k))
+                emit("        k{}._total += per_river".format(k))
+
+        # Reservoir.calculate_production
+        emit("w_before = w{}".format(i))
+        emit("cp{} = 0.0".format(i))
+        emit("if {!r} not in producing or w{} / {} <= 0.1:".format(reservoir.id, i, capacity))
+        emit("    r{}.generator_flow = 0.0".format(i))
+        emit("else:")
+        emit("    r{}.generator_head_height = 50.0".format(i))
+        emit("    water_height = w{} / {}".format(i, water_area))
+        emit("    flow_factor = water_height / {}".format(max_water_height))
+        emit("    if flow_factor > 1.0:")
+        emit("        flow_factor = 1.0")
+        emit("    flow_rate = flow_factor * {}".format(max_generator_flow))
+        emit("    if water_height > 0:")
+        emit("        cp{} = ({} * flow_rate * 50.0 / 1000000) * 24".format(i, efficiency_rho_g))
+        emit("        w{0} -= min(w{0}, flow_rate * 86400)".format(i))
+        emit("    else:")
+        emit("        r{}.generator_flow = 0.0".format(i))
+        emit("total_production += cp{}".format(i))
+
+        if out_rivers:
+            emit("water_out = w_before - w{}".format(i))
+            emit("if water_out > 0:")
+            emit("    per_river = water_out / {}".format(len(out_rivers)))
+            for k in out_rivers:
+                emit("    k{0}._queue[k{0}._head] += per_river".format(k))
+                emit("    k{}._total += per_river".format(k))
+
+    # Rivers - River.process_timestep, get_max_flow_penalty is called twice a day (see BatchSimulation)
+    emit("river_overflow_penalty = 0")
+    for k in network.river_order.tolist():
+        river = rivers[k]
+        emit("# {}".format(river.id))
+        emit("flow = k{}._total".format(k))
+        emit("k{}.current_flow = flow".format(k))
+        emit("queue = k{}._queue".format(k))
+        emit("tail = k{0}._head - 1 if k{0}._head > 0 else {1}".format(k, len(river._queue) - 1))
+        emit("outflow = queue[tail]")
+        emit("queue[tail] = 0.0")
+        emit("k{}._head = tail".format(k))
+        emit("k{}._total = sum(queue) if tail == 0 else flow - outflow".format(k))
+        emit("if flow > {!r}:".format(float(river.max_flow)))
+        emit("    penalty = 1 + (1 + k{}.cumulative_penalty)".format(k))
+        emit("    k{}.cumulative_penalty = penalty".format(k))
+        emit("    k{}.consecutive_days_over_max += 1".format(k))
+        emit("    river_overflow_penalty += penalty")
+        emit("else:")
+        emit("    k{}.cumulative_penalty = 0.0".format(k))
+        emit("    k{}.consecutive_days_over_max = 0".format(k))
+        emit("    river_overflow_penalty += 0.0")
+
+        r = int(network.river_output[k])
+        if r >= 0:
+            emit("ri{} += outflow".format(r))
+            emit("w{0} = min(w{0} + outflow, {1})".format(r, repr(float(reservoirs[r].capacity))))
+
+    # Write the reservoirs back and turn them off
+    for i in range(len(reservoirs)):
+        emit("r{0}.water_amount = w{0}".format(i))
+        emit("r{0}.river_inflow = ri{0}".format(i))
+        emit("r{0}.natural_inflow = ni{0}".format(i))
+        emit("r{0}.current_production = cp{0}".format(i))
+        emit("r{}.is_producing = False".format(i))
+
+    emit("return total_production, river_overflow_penalty")
+
+    lines += ["        " + line for line in body]
+    lines += ["", "    return step", ""]
+    return "\n".join(lines)
+
+
+def check_step_equivalence(simulation: Simulation, n_days=365, seed=0, program: StepProgram = None):
+    """
+    Runs the generated step function and Simulation.simulate_day side by side with random production plans,
+    raises AssertionError at the first day where the results or the snapshots are not exactly the same.
+    """
+    program = program if program is not None else StepProgram(simulation)
+    generic = simulation.fork()
+    specialized = simulation.fork()
+    step = program.bind(specialized)
+
+    rng = random.Random(seed)
+    reservoir_ids = [r.id for r in simulation.reservoirs]
+    for day in range(n_days):
+        producing = set(r_id for r_id in reservoir_ids if rng.random() < 0.5)
+        for r_id in producing:
+            generic.set_production(r_id, True)
+
+        expected = generic.simulate_day()
+        result = step(producing)
+
+        if result != expected:
+            raise AssertionError("Day {}: step returned {}, simulate_day returned {}".format(day, result, expected))
+        if not np.array_equal(specialized.snapshot(), generic.snapshot()):
+            raise AssertionError("Day {}: the state differs from simulate_day".format(day))
+        if specialized.get_timestep_state() != generic.get_timestep_state():
+            raise AssertionError("Day {}: the timestep state differs from simulate_day".format(day))
+
+    return True
+
+
+if __name__ == "__main__":
+    from hydro_trader.synthetic import create_synthetic_game
+
+    simulations = {"norwegian": Simulation()}
+    simulations["norwegian"].create_norwegian_environment()
+    simulations["synthetic 256"] = create_synthetic_game(256).base_simulation
+
+    for name, simulation in simulations.items():
+        program = StepProgram(simulation)
+        check_step_equivalence(simulation, n_days=1000, program=program)
+
+        times = {}
+        for label, sim in (("generic", simulation.fork()), ("compiled", simulation.fork())):
+            step = program.bind(sim) if label == "compiled" else None
+            start_time = time.perf_counter()
+            for _ in range(1000):
+                if step is not None:
+                    step(set())
+                else:
+                    sim.simulate_day()
+            times[label] = (time.perf_counter() - start_time) / 1000 * 1e6
+
+        print("{}: equivalent for 1000 days, simulate_day {:.1f} us/day, compiled step {:.1f} us/day".format(
+            name, times["generic"], times["compiled"]))
@@ -0,0 +1,274 @@
+import csv
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+
+
+class SharedSeries:
+    """
+    A set of read-only arrays (one value per timestep) that never change during a game.
+
+    Every simulation that references the series shares the same arrays, deepcopy returns the
+    series itself so copying a Simulation for a new player only copies the mutable state.
+    """
+
+    def __init__(self, **arrays):
+        self._length = 0
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            values.setflags(write=False)
+            setattr(self, name, values)
+            self._length = len(values)
+
+    def __len__(self):
+        return self._length
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __copy__(self):
+        return self
+
+
+class ForcingDataStore:
+    """
+    Reads the weather and demand series from the data directory once and hands out shared, read-only
+    series to every Reservoir, MontainWithSnow and PowerMarked that asks for them.
+
+    Series are cached by file path, so all players of a game (and all games created with the same store)
+    reference the same arrays.
+
+    The csv files are converted once to a binary columnar cache in <data_dir>/.cache (one .npy file per
+    column and a manifest.json). A cached file is used as long as the size and modification time (or
+    the sha256 of the content) of the csv file matches the manifest, otherwise the csv is parsed again.
+
+    Cached columns are memory-mapped read-only and the series are zero-copy views of them, so every
+    process (uvicorn workers, game processes) using the same data directory shares one page-cache copy.
+    Cache files are replaced atomically, a process that still maps an old file keeps a valid view.
+    """
+
+    CACHE_DIR_NAME = ".cache"
+    CACHE_VERSION = 2
+
+    def __init__(self, data_dir="data", use_cache=True):
+        self.data_dir = data_dir
+        self.use_cache = use_cache
+        self.cache_dir = os.path.join(data_dir, self.CACHE_DIR_NAME)
+        self._series = {}
+        self._manifest = None
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def rain(self, path) -> SharedSeries:
+        """
+        Rain data for a reservoir: is_raining [bool] and forecast_probability [0,1] per timestep
+        """
+        key = ("rain", path)
+        if key not in self._series:
+            table = self._read_table(path)
+            n = self._n_rows(table)
+
+            # Parse Actual_Rain as boolean and Forecast as probability
+            actual_rain = table.get('Actual_Rain')
+            if actual_rain is None:
+                is_raining = np.zeros(n, dtype=np.bool_)
+            elif actual_rain.dtype == np.bool_:
+                is_raining = actual_rain
+            elif actual_rain.dtype.kind == 'f':
+                is_raining = actual_rain == 1.0
+            else:
+                is_raining = np.isin(np.char.lower(actual_rain), ['1', 'true', 'yes', 'y'])
+
+            forecast_probability = np.asarray(table.get('Forecast', np.zeros(n)), dtype=np.float64)  # [0,1]
+
+            self._series[key] = SharedSeries(is_raining=is_raining, forecast_probability=forecast_probability)
+        return self._series[key]
+
+    def snow(self, path) -> SharedSeries:
+        """
+        Snow data for a mountain: temperature [°C] and snow_height [m] per timestep
+        """
+        key = ("snow", path)
+        if key not in self._series:
+            table = self._read_table(path)
+            n = self._n_rows(table)
+
+            self._series[key] = SharedSeries(temperature=np.asarray(table.get('Temperature', np.zeros(n)), dtype=np.float64),
+                                             snow_height=np.asarray(table.get('SnowHeight', np.zeros(n)), dtype=np.float64))
+        return self._series[key]
+
+    def demand(self, path) -> SharedSeries:
+        """
+        Power demand per timestep (multiplied with the number of players by PowerMarked)
+        """
+        key = ("demand", path)
+        if key not in self._series:
+            table = self._read_table(path)
+            self._series[key] = SharedSeries(demand=np.asarray(table['demand'], dtype=np.float64))
+        return self._series[key]
+
+    def water_loss_factors(self, max_loss_water_factor, n=1000) -> SharedSeries:
+        """
+        Table of random factors used for snow melt water, the same seed is used for every mountain
+        """
+        key = ("water_loss", max_loss_water_factor, n)
+        if key not in self._series:
+            rng = random.Random(42)
+            factor = [rng.uniform(0, max_loss_water_factor) for _ in range(n)]
+            self._series[key] = SharedSeries(factor=np.array(factor, dtype=np.float64))
+        return self._series[key]
+
+    def build_cache(self):
+        """
+        Converts every csv file in the data directory to the binary cache, returns the number of files
+        """
+        csv_files = sorted(name for name in os.listdir(self.data_dir) if name.endswith(".csv"))
+        for name in csv_files:
+            self._read_table(os.path.join(self.data_dir, name))
+        return len(csv_files)
+
+    @staticmethod
+    def _n_rows(table):
+        return max([len(column) for column in table.values()] + [0])
+
+    def _read_table(self, path) -> dict:
+        """
+        Reads a csv file as columns (column name -> array), from the cache if it is up to date
+        """
+        if not self.use_cache:
+            return self._parse_csv(path)
+
+        key = os.path.relpath(path, self.data_dir)
+        stat = os.stat(path)
+        manifest = self._load_manifest()
+
+        entry = manifest["files"].get(key)
+        if entry is not None and self._is_valid(entry, path, stat):
+            try:
+                return {column: self._load_column(os.path.join(self.cache_dir, file_name))
+                        for column, file_name in entry["columns"].items()}
+            except (OSError, ValueError):
+                pass # broken cache file, parse the csv again
+
+        table = self._parse_csv(path)
+        self._write_cache_entry(key, path, stat, table)
+        return table
+
+    @staticmethod
+    def _load_column(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            return np.load(path) # empty columns can not be memory-mapped
+
+    @staticmethod
+    def _parse_csv(path) -> dict:
+        """
+        Every column where all values are numbers is stored as float64, columns with only true/false
+        as bool and other columns as strings
+        """
+        with open(path, 'r', newline='') as f:
+            rows = list(csv.reader(f))
+
+        if not rows:
+            return {}
+
+        header, rows = rows[0], rows[1:]
+        table = {}
+        for i, column in enumerate(header):
+            values = [row[i] if i < len(row) else '' for row in rows]
+            try:
+                table[column] = np.array(values, dtype=np.float64)
+            except ValueError:
+                lower_values = np.char.lower(np.array(values, dtype=np.str_))
+                if np.isin(lower_values, ['true', 'false']).all():
+                    table[column] = lower_values == 'true'
+                else:
+                    table[column] = np.array(values, dtype=np.str_)
+
+        return table
+
+    @staticmethod
+    def _sha256(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _is_valid(self, entry, path, stat):
+        if entry["size"] != stat.st_size:
+            return False
+
+        if entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        # the file was touched (e.g. by a git checkout), only rebuild if the content changed
+        if entry["sha256"] == self._sha256(path):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self._save_manifest()
+            return True
+
+        return False
+
+    def _load_manifest(self):
+        if self._manifest is None:
+            manifest = None
+            try:
+                with open(os.path.join(self.cache_dir, "manifest.json"), 'r') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            if not isinstance(manifest, dict) or manifest.get("version") != self.CACHE_VERSION:
+                manifest = {"version": self.CACHE_VERSION, "files": {}}
+            self._manifest = manifest
+
+        return self._manifest
+
+    def _save_manifest(self):
+        # keep the entries written by other stores (or processes) since the manifest was loaded
+        on_disk = self._manifest
+        self._manifest = None
+        self._load_manifest()["files"].update(on_disk["files"])
+
+        try:
+            self._atomic_write(os.path.join(self.cache_dir, "manifest.json"),
+                               lambda f: f.write(json.dumps(self._manifest, indent=4).encode("utf-8")))
+        except OSError:
+            pass # read only data directory, just run without the cache
+
+    def _write_cache_entry(self, key, path, stat, table):
+        file_prefix = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        columns = {}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for i, (column, values) in enumerate(table.items()):
+                file_name = "{}_{}.npy".format(file_prefix, i)
+                self._atomic_write(os.path.join(self.cache_dir, file_name), lambda f: np.save(f, values))
+                columns[column] = file_name
+        except OSError:
+            return # read only data directory, just run without the cache
+
+        self._manifest["files"][key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": self._sha256(path),
+            "columns": columns,
+        }
+        self._save_manifest()
+
+    @staticmethod
+    def _atomic_write(path, write):
+        """Writes to a temporary file first, so other processes never read a half written file"""
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    store = ForcingDataStore("data")
+    n_files = store.build_cache()
+    print(f"Converted {n_files} csv files to {store.cache_dir}")
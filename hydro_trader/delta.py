@@ -0,0 +1,192 @@
+MAX_SHIFT = 8 # longest shift of a list (like the flow of a river) that is sent as a shift
+STATIC_FIELDS = frozenset(["capacity"]) # values that never change during a game, they are in the keyframes only
+
+
+def diff_list(old, new):
+    """
+    A list that moved k places since old (values entering at one end, the same number dropping out at the other,
+    like the water queue of a river) as {"shift": k, "values": [entering values]}, k < 0 when the values enter at the end.
+    None when it is not a shift, the list is then sent as a whole.
+    """
+    n = len(new)
+    if len(old) != n:
+        return None
+    for k in range(1, min(n, MAX_SHIFT + 1)):
+        if new[k:] == old[:n - k]:
+            return {"shift": k, "values": new[:k]}
+        if new[:n - k] == old[k:]:
+            return {"shift": -k, "values": new[n - k:]}
+    return None
+
+
+def diff_state(old, new, static=STATIC_FIELDS):
+    """
+    The changes that turn the state old into new, as a nested dict with only the keys whose values changed.
+    Lists are sent as a shift (see diff_list) when possible, other values are replaced as a whole, the keys
+    in static are not compared. Returns None when the dicts do not have the same keys, a keyframe is needed then.
+    """
+    if old.keys() != new.keys():
+        return None
+
+    changes = {}
+    for key, value in new.items():
+        if key in static:
+            continue
+        old_value = old[key]
+        if isinstance(value, dict) or isinstance(old_value, dict):
+            if not (isinstance(value, dict) and isinstance(old_value, dict)):
+                return None
+            sub_changes = diff_state(old_value, value, static)
+            if sub_changes is None:
+                return None
+            if sub_changes:
+                changes[key] = sub_changes
+        elif value != old_value or type(value) is not type(old_value):
+            shift = diff_list(old_value, value) if isinstance(value, list) and isinstance(old_value, list) else None
+            changes[key] = shift if shift is not None else value
+    return changes
+
+
+def apply_delta(state, changes):
+    """
+    The state with the changes of diff_state applied, state is not modified (only the changed dicts are copied)
+    """
+    new_state = dict(state)
+    for key, value in changes.items():
+        old_value = state.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            new_state[key] = apply_delta(old_value, value)
+        elif isinstance(value, dict) and isinstance(old_value, list):
+            k = value["shift"]
+            if k > 0:
+                new_state[key] = value["values"] + old_value[:len(old_value) - k]
+            else:
+                new_state[key] = old_value[-k:] + value["values"]
+        else:
+            new_state[key] = value
+    return new_state
+
+
+class DeltaEncoder:
+    """
+    Server side of the delta protocol for one player.
+
+    Every timestep state gets a sequence number. The client acknowledges the last state it reconstructed
+    (the "ack" of its production plan), the next state is sent as the changes since that state:
+        {"type": "delta", "seq": seq, "base": acknowledged seq, "changes": {...}}
+    A full state is sent as a keyframe when nothing usable is acknowledged and every keyframe_interval states:
+        {"type": "keyframe", "seq": seq, "state": {...}}
+
+    The server diffs only the part of the state that belongs to the player here (encode_own), the changes of
+    the shared part are computed once by a SharedEncoder and added to the message.
+    """
+
+    def __init__(self, keyframe_interval=20, history=16):
+        self.keyframe_interval = keyframe_interval
+        self.history = history
+
+        self.seq = 0
+        self.sent = {} # seq -> (snapshot, state), the states the client may use as base
+        self.acknowledged = None # set from the event loop, read when encoding
+        self.since_keyframe = 0
+
+    def acknowledge(self, seq):
+        self.acknowledged = seq
+
+    def encode(self, state) -> dict:
+        return self.encode_own(state)[0]
+
+    def encode_own(self, state, snapshot=None):
+        """
+        The message for state and the snapshot (see SharedEncoder) of its base, None for a keyframe. The shared
+        part of the player's state at snapshot is recorded with the state, so the next delta can be based on it.
+        """
+        self.seq += 1
+        base = self.acknowledged
+
+        # the client can only have acknowledged a state that was sent, older states are not needed anymore
+        self.sent = {seq: s for seq, s in self.sent.items() if base is None or seq >= base}
+        while len(self.sent) >= self.history:
+            del self.sent[min(self.sent)]
+        self.sent[self.seq] = (snapshot, state)
+
+        changes = None
+        if base in self.sent and self.since_keyframe < self.keyframe_interval:
+            changes = diff_state(self.sent[base][1], state)
+
+        if changes is None:
+            self.since_keyframe = 0
+            return {"type": "keyframe", "seq": self.seq, "state": state}, None
+
+        self.since_keyframe += 1
+        return {"type": "delta", "seq": self.seq, "base": base, "changes": changes}, self.sent[base][0]
+
+
+class SharedEncoder:
+    """
+    Server side of the delta protocol for the part of the timestep states that every player gets: the shared
+    state and the summaries of the players in other_players.
+
+    Every time the states are encoded the shared part is kept as a new snapshot (for the last history snapshots).
+    The changes since a snapshot are computed once and used for every player whose base has that snapshot.
+    """
+
+    def __init__(self, history=32):
+        self.history = history
+        self.snapshot = 0
+        self.snapshots = {} # snapshot -> (shared state, player_id -> summary)
+
+    def add(self, shared, summaries) -> int:
+        """Keeps the current shared part, returns its snapshot"""
+        self.snapshot += 1
+        self.snapshots[self.snapshot] = (shared, summaries)
+        while len(self.snapshots) > self.history:
+            del self.snapshots[min(self.snapshots)]
+        return self.snapshot
+
+    def changes_since(self, snapshot):
+        """
+        The changes of the shared state since snapshot and the ids of the players whose summary changed,
+        None when the players are not the same anymore (every other_players list changed then).
+        A snapshot that is not kept anymore gives every value of the shared state as changed.
+        """
+        shared, summaries = self.snapshots[self.snapshot]
+        if snapshot not in self.snapshots:
+            return dict(shared), None
+
+        old_shared, old_summaries = self.snapshots[snapshot]
+        changes = diff_state(old_shared, shared)
+        if changes is None:
+            changes = dict(shared)
+        if list(old_summaries) != list(summaries):
+            return changes, None
+        return changes, {player_id for player_id, summary in summaries.items() if old_summaries[player_id] != summary}
+
+
+class DeltaDecoder:
+    """
+    Client side of the delta protocol, rebuilds the full states from the keyframes and deltas of a DeltaEncoder
+    """
+
+    def __init__(self, history=16):
+        self.history = history
+        self.states = {} # seq -> reconstructed state
+        self.last_seq = None
+
+    def decode(self, message) -> dict:
+        """The full state of a message, raises KeyError if the base of a delta is not known (ack None to get a keyframe)"""
+        if message["type"] == "keyframe":
+            state = message["state"]
+        else:
+            state = apply_delta(self.states[message["base"]], message["changes"])
+            self.states = {seq: s for seq, s in self.states.items() if seq >= message["base"]}
+
+        while len(self.states) >= self.history:
+            del self.states[min(self.states)]
+        self.states[message["seq"]] = state
+        self.last_seq = message["seq"]
+        return state
+
+    @property
+    def ack(self):
+        return self.last_seq
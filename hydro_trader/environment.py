@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from hydro_trader.data_store import ForcingDataStore
+from hydro_trader.network import CompiledNetwork, compile_network
+
+
+ENVIRONMENTS_DIR_NAME = "environments"
+COMPILED_VERSION = 3 # change when CompiledEnvironment or CompiledNetwork change
+
+# the arrays of a CompiledNetwork (the arguments of its constructor) stored in the compiled cache
+NETWORK_ARRAYS = ("out_river_ptr", "out_river_index", "in_river_ptr", "in_river_index", "river_output", "mountain_output",
+                  "reservoir_order", "river_order")
+
+# field name -> (type, required), float fields also accept integers
+RESERVOIR_FIELDS = {
+    "id": (str, True),
+    "rain_data": (str, True), # csv file in the data directory
+    "water_area": (float, True), # m²
+    "basin_area": (float, True), # m²
+    "capacity": (float, True), # m³
+    "initial_fill": (float, True), # fraction of the capacity at the start of the game
+    "generator_head_height": (float, True), # m
+    "max_generator_flow": (float, True), # m³/s
+    "generator_efficiency": (float, False),
+    "rain_height": (float, False), # m of rain over the basin when it rains
+    "out_rivers": (list, False), # river ids
+}
+
+RIVER_FIELDS = {
+    "id": (str, True),
+    "initial_water": (float, True), # m³, spread over the length of the river
+    "length_in_timesteps": (int, True),
+    "max_flow": (float, True),
+    "output_reservoir": (str, False), # reservoir id, null for the ocean
+}
+
+MOUNTAIN_FIELDS = {
+    "id": (str, True),
+    "snow_data": (str, True), # csv file in the data directory
+    "snow_area": (float, True), # m²
+    "output_reservoir": (str, True),
+}
+
+
+class CompiledEnvironment:
+    """
+    A validated environment definition together with its compiled network, ready to be built
+    into a Simulation with Simulation.build_environment.
+
+    reservoirs, rivers and mountains are lists of the validated dicts of the definition (optional fields that
+    are not given keep the defaults of the component classes), in the same order as the network indices.
+    """
+
+    def __init__(self, name, content_hash, reservoirs, rivers, mountains, network: CompiledNetwork):
+        self.name = name
+        self.content_hash = content_hash
+        self.reservoirs = reservoirs
+        self.rivers = rivers
+        self.mountains = mountains
+        self.network = network
+
+
+# compiled environments by content hash, so resetting a game does not read or compile anything
+_compiled = {}
+
+
+def environment_path(name, data_dir="data") -> str:
+    """
+    An environment is either the path of a json file, or the name of a file in <data_dir>/environments
+    """
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(data_dir, ENVIRONMENTS_DIR_NAME, name + ".json")
+
+
+def list_environments(data_dir="data") -> list:
+    try:
+        names = os.listdir(os.path.join(data_dir, ENVIRONMENTS_DIR_NAME))
+    except OSError:
+        return []
+    return sorted(name[:-len(".json")] for name in names if name.endswith(".json"))
+
+
+def load_environment(name="norwegian", data_dir="data", use_cache=True) -> CompiledEnvironment:
+    """
+    Reads, validates and compiles an environment definition.
+
+    The compiled environment is cached in memory and as a .npz file in <data_dir>/.cache, both keyed
+    by the sha256 of the definition, so an unchanged file is only validated and compiled once.
+    The cache file only holds the network arrays and the validated definition as json text, it is read
+    without pickle, so a file placed in the cache directory can not run code.
+    Raises ValueError if the definition is not valid.
+    """
+    path = environment_path(name, data_dir)
+    with open(path, 'rb') as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    if use_cache and content_hash in _compiled:
+        return _compiled[content_hash]
+
+    cache_path = os.path.join(data_dir, ForcingDataStore.CACHE_DIR_NAME, "environment_{}.npz".format(content_hash[:32]))
+    environment = _read_compiled(cache_path, content_hash) if use_cache else None
+
+    if environment is None:
+        try:
+            definition = json.loads(content.decode("utf-8"))
+        except ValueError as e:
+            raise ValueError("Environment {} is not valid json: {}".format(path, e))
+
+        environment = compile_environment(definition, content_hash=content_hash,
+                                          name=os.path.splitext(os.path.basename(path))[0])
+        if use_cache:
+            _write_compiled(cache_path, environment)
+
+    if use_cache:
+        _compiled[content_hash] = environment
+    return environment
+
+
+def _read_compiled(cache_path, content_hash):
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            arrays = {name: data[name] for name in NETWORK_ARRAYS}
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+    if not isinstance(header, dict) or header.get("version") != COMPILED_VERSION or header.get("content_hash") != content_hash:
+        return None
+
+    try:
+        network = CompiledNetwork(header["reservoir_ids"], header["river_ids"], header["mountain_ids"], **arrays)
+        return CompiledEnvironment(name=header["name"], content_hash=content_hash, reservoirs=header["reservoirs"],
+                                   rivers=header["rivers"], mountains=header["mountains"], network=network)
+    except (KeyError, TypeError, ValueError, IndexError):
+        return None
+
+
+def _write_compiled(cache_path, environment):
+    network = environment.network
+    header = {
+        "version": COMPILED_VERSION,
+        "content_hash": environment.content_hash,
+        "name": environment.name,
+        "reservoirs": environment.reservoirs,
+        "rivers": environment.rivers,
+        "mountains": environment.mountains,
+        "reservoir_ids": list(network.reservoir_ids),
+        "river_ids": list(network.river_ids),
+        "mountain_ids": list(network.mountain_ids),
+    }
+    arrays = {name: getattr(network, name) for name in NETWORK_ARRAYS}
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        ForcingDataStore._atomic_write(cache_path, lambda f: np.savez(f, header=np.array(json.dumps(header)), **arrays))
+    except OSError:
+        pass # read only data directory, just run without the cache
+
+
+def _validate_fields(kind, item, fields):
+    if not isinstance(item, dict):
+        raise ValueError("Every {} must be an object, got {!r}".format(kind, item))
+
+    unknown = sorted(set(item) - set(fields))
+    if unknown:
+        raise ValueError("Unknown fields for {} {}: {}".format(kind, item.get("id"), unknown))
+
+    values = {}
+    for field, (field_type, required) in fields.items():
+        value = item.get(field)
+        if value is None:
+            if required:
+                raise ValueError("{} {} is missing the field {}".format(kind.capitalize(), item.get("id"), field))
+            continue
+
+        if field_type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, field_type) or isinstance(value, bool):
+            raise ValueError("{}.{} of {} must be {}, got {!r}".format(kind, field, item.get("id"), field_type.__name__, value))
+
+        if field_type in (float, int) and value < 0:
+            raise ValueError("{}.{} of {} can not be negative, got {!r}".format(kind, field, item.get("id"), value))
+        values[field] = value
+
+    return values
+
+
+def compile_environment(definition, content_hash=None, name=None) -> CompiledEnvironment:
+    """
+    Validates a definition (the parsed json) and compiles its network, raises ValueError if it is not valid
+    """
+    if not isinstance(definition, dict):
+        raise ValueError("An environment must be a json object")
+
+    reservoirs = [_validate_fields("reservoir", r, RESERVOIR_FIELDS) for r in definition.get("reservoirs", [])]
+    rivers = [_validate_fields("river", r, RIVER_FIELDS) for r in definition.get("rivers", [])]
+    mountains = [_validate_fields("mountain", m, MOUNTAIN_FIELDS) for m in definition.get("mountains", [])]
+
+    if not reservoirs:
+        raise ValueError("An environment needs at least one reservoir")
+
+    for r in reservoirs:
+        if r["capacity"] <= 0 or r["water_area"] <= 0:
+            raise ValueError("Reservoir {} must have a positive capacity and water_area".format(r["id"]))
+        if r["initial_fill"] > 1.0:
+            raise ValueError("Reservoir {} has initial_fill {}, must be between 0 and 1".format(r["id"], r["initial_fill"]))
+    for r in rivers:
+        if r["length_in_timesteps"] < 1:
+            raise ValueError("River {} must be at least one timestep long".format(r["id"]))
+
+    # Validate the connections with the same compiler the simulation uses, on placeholder components
+    reservoir_nodes = [SimpleNamespace(id=r["id"], in_rivers=[], out_rivers=[]) for r in reservoirs]
+    river_nodes = [SimpleNamespace(id=r["id"], output_reservoir=None) for r in rivers]
+    reservoir_by_id = {node.id: node for node in reservoir_nodes}
+    river_by_id = {node.id: node for node in river_nodes}
+
+    def lookup(nodes, kind, node_id, owner):
+        if node_id not in nodes:
+            raise ValueError("{} refers to the unknown {} {}".format(owner, kind, node_id))
+        return nodes[node_id]
+
+    for r, node in zip(rivers, river_nodes):
+        if r.get("output_reservoir") is not None:
+            node.output_reservoir = lookup(reservoir_by_id, "reservoir", r["output_reservoir"], r["id"])
+    for r, node in zip(reservoirs, reservoir_nodes):
+        node.out_rivers = [lookup(river_by_id, "river", river_id, r["id"]) for river_id in r.get("out_rivers", [])]
+    mountain_nodes = [SimpleNamespace(id=m["id"], output_reservoir=lookup(reservoir_by_id, "reservoir", m["output_reservoir"], m["id"]))
+                      for m in mountains]
+
+    network = compile_network(reservoir_nodes, river_nodes, mountain_nodes)
+
+    return CompiledEnvironment(
+        name=name if name is not None else definition.get("name"),
+        content_hash=content_hash,
+        reservoirs=reservoirs,
+        rivers=rivers,
+        mountains=mountains,
+        network=network,
+    )
@@ -1,24 +1,24 @@
 import os
 import csv
 import json
+import pickle
+import datetime
 import random
 import asyncio
-from copy import deepcopy
 from typing import Dict, List, Set, Any
 from collections import defaultdict
 
 
-
-from copy import deepcopy
-
 from hydro_trader.simulation import Simulation
 from hydro_trader.reservoirs import Reservoir, River, MontainWithSnow
+from hydro_trader.batch import BatchSimulation
+from hydro_trader.codegen import StepProgram
+from hydro_trader.data_store import ForcingDataStore
 
 class PowerMarked:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, data_store:ForcingDataStore=None):
         self.data_dir = data_dir
-
-        
+        self.data_store = data_store if data_store is not None else ForcingDataStore(data_dir)
 
         self.marked_demand_data = []
 
@@ -45,16 +45,13 @@ class PowerMarked:
         if not os.path.isfile(marked_file):
             return False
 
-        with open(marked_file, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                self.marked_demand_data.append(float(row['demand']))
+        self.marked_demand_data = self.data_store.demand(marked_file).demand
 
         return True
 
     def get_production_demand(self):
         if self.timestep < len(self.marked_demand_data):
-            return self.marked_demand_data[self.timestep] * (self.n_players * self.player_scale_factor) * self.demand_factor
+            return float(self.marked_demand_data[self.timestep]) * (self.n_players * self.player_scale_factor) * self.demand_factor
         
         return 0.0
 
@@ -123,12 +120,49 @@ class PowerMarked:
 
     
 
+def create_game(data_dir="data", engine="object", data_store:ForcingDataStore=None, start_timestep=0, environment="norwegian"):
+    """
+    Creates a game on a reservoir system (default the norwegian one), with the power marked read from the same data directory
+
+    start_timestep: the day (since 2010-01-01) of the weather and marked data the game starts at
+    environment: a file in <data_dir>/environments or the path of an environment file, see hydro_trader.environment
+    """
+    if data_store is None:
+        data_store = ForcingDataStore(data_dir=data_dir)
+
+    sim = Simulation(data_dir=data_dir, data_store=data_store)
+    sim.create_environment(environment)
+    sim.set_timestep(start_timestep)
+
+    marked = PowerMarked(data_dir=data_dir, data_store=data_store)
+    marked.timestep = start_timestep
+
+    game = Game(sim, marked, engine=engine)
+    game.timestep = game.start_timestep = start_timestep
+    return game
+
+
 class Game:
-    def __init__(self, simulation:Simulation, power_marked:PowerMarked):
+    ENGINES = ("object", "batch", "compiled")
+
+    def __init__(self, simulation:Simulation, power_marked:PowerMarked, engine="object"):
+        """
+        engine: "object" gives each player a deep-copied Simulation, "batch" simulates all players
+                together in a BatchSimulation (faster with many players, same results), "compiled" gives each
+                player a copy like "object" but steps it with a step function generated for the network (see codegen)
+        """
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown simulation engine: {}, expected one of {}".format(engine, self.ENGINES))
+
         self.base_simulation = simulation
         self.power_marked = power_marked
         self.n_timesteps = -1        
 
+        self.engine = engine
+        self.batch_simulation = BatchSimulation(simulation) if engine == "batch" else None
+        self.step_program = StepProgram(simulation) if engine == "compiled" else None
+        self.steps = {} # player_id -> generated step function, for the compiled engine
+
         self.simulations = {} # player_id -> simulation
         self.names = {} # player_id -> player_name
         self.cash = defaultdict(float) # player_id -> cash
@@ -141,10 +175,34 @@ class Game:
 
         self.average_power_price = 0.0
 
+        # totals for the whole game
+        self.total_production = defaultdict(float) # player_id -> produced MWh
+        self.total_overflow_penalty = defaultdict(float) # player_id -> cash paid for river overflows
+
+        self.start_timestep = 0 # n_timesteps are played from here
         self.timestep = 0
+        self.verbose = True # print production and penalties for every player each timestep
+
+    def __getstate__(self):
+        # generated step functions can not be pickled, they are generated again when the game is loaded
+        state = self.__dict__.copy()
+        state["step_program"] = None
+        state["steps"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.engine == "compiled":
+            self.step_program = StepProgram(self.base_simulation)
+            self.steps = {player_id: self.step_program.bind(sim) for player_id, sim in self.simulations.items()}
 
     def add_player(self, player_id, player_name):
-        self.simulations[player_id] = deepcopy(self.base_simulation)
+        if self.batch_simulation is not None:
+            self.simulations[player_id] = self.batch_simulation.player_view(self.batch_simulation.add_player())
+        else:
+            self.simulations[player_id] = self.base_simulation.fork()
+            if self.step_program is not None:
+                self.steps[player_id] = self.step_program.bind(self.simulations[player_id])
         self.names[player_id] = player_name
         self.cash[player_id] = 0.0
         self.production[player_id] = set()
@@ -166,34 +224,72 @@ class Game:
         return state
     
     def get_timestep_state(self, player_id):
+        d = self.get_player_timestep_state(player_id)
+        d.update(self.get_shared_timestep_state())
+        d["other_players"] = [self.get_player_summary(other_player_id) for other_player_id in self.simulations if other_player_id != player_id]
+        return d
+
+    def get_player_timestep_state(self, player_id):
+        """The part of the timestep state that belongs to one player (everything but the shared part and other_players)"""
         d = self.simulations[player_id].get_timestep_state()
         d["cash"] = self.cash[player_id]
-        d["marked_demand"] = self.current_day_production_demand
-        d["sold_power"] = self.power_marked.accepted_bids
-        d["overflow_penalty"] = self.current_overflow_penalty
-        d["average_power_price"] = self.average_power_price
 
         earning_report = self.power_marked.earnings_report_by_player.get(player_id)
         if earning_report is None:
             earning_report = (0.0, 0.0)
 
         d["production_results"] = {"price": earning_report[0], "amount": earning_report[1]}
-        d["is_game_over"] = self.is_game_over()
-        d["timestep"] = self.timestep
-
-        d["other_players"] = []
-        for other_player_id, sim in self.simulations.items():
-            if other_player_id != player_id:
-                total_water_in_m3 = sim.get_total_water_in_m3()
-                d["other_players"].append({"name": self.names[other_player_id], "player_id": other_player_id, "cash": self.cash[other_player_id], "total_water_in_m3": total_water_in_m3})
-
         return d
 
+    def get_shared_timestep_state(self):
+        """The part of the timestep state that is the same for every player"""
+        return {
+            "marked_demand": self.current_day_production_demand,
+            "sold_power": self.power_marked.accepted_bids,
+            "overflow_penalty": self.current_overflow_penalty,
+            "average_power_price": self.average_power_price,
+            "is_game_over": self.is_game_over(),
+            "timestep": self.timestep,
+        }
+
+    def get_player_summary(self, player_id):
+        """What the other players see of a player, an entry of other_players in the timestep state"""
+        return {"name": self.names[player_id], "player_id": player_id, "cash": self.cash[player_id],
+                "total_water_in_m3": self.simulations[player_id].get_total_water_in_m3()}
+
+    def get_results(self):
+        """
+        Final (or current) standing of every player: cash, produced MWh and paid overflow penalties
+        """
+        return {
+            player_id: {
+                "name": name,
+                "cash": self.cash[player_id],
+                "production_mwh": self.total_production[player_id],
+                "overflow_penalty": self.total_overflow_penalty[player_id],
+            }
+            for player_id, name in self.names.items()
+        }
+
     def is_game_over(self):
-        return self.timestep >= self.n_timesteps - 1
+        return self.timestep - self.start_timestep >= self.n_timesteps - 1
     
-    def process_timestep(self):
+    def _simulate_players(self):
+        """
+        Simulates one day for every player, returns player_id -> (output in mwh, penalty for river overflow)
+        """
+        if self.batch_simulation is not None:
+            for player_id, sim in self.simulations.items():
+                sim.set_production_plan(self.production.get(player_id, []))
+
+            output_in_mwh, penalty_for_river_overflow = self.batch_simulation.simulate_day()
+            return {player_id: (float(output_in_mwh[sim.index]), float(penalty_for_river_overflow[sim.index]))
+                    for player_id, sim in self.simulations.items()}
 
+        if self.step_program is not None:
+            return {player_id: step(self.production.get(player_id, set())) for player_id, step in self.steps.items()}
+
+        results = {}
         for player_id, sim in self.simulations.items():
 
             for reservoir in sim.reservoirs:
@@ -203,15 +299,26 @@ class Game:
             for r_id in producing_reservoirs:
                 sim.set_production(r_id, True)
 
-            player_output_in_mwh, penalty_for_river_overflow = sim.simulate_day()
+            results[player_id] = sim.simulate_day()
+
+        return results
+
+    def process_timestep(self):
+
+        for player_id, (player_output_in_mwh, penalty_for_river_overflow) in self._simulate_players().items():
 
-            print("player_output_in_mwh:", player_output_in_mwh)
+            if self.verbose:
+                print("player_output_in_mwh:", player_output_in_mwh)
+
+            self.total_production[player_id] += player_output_in_mwh
 
             self.current_overflow_penalty = 0.0
             if penalty_for_river_overflow > 0:
-                print("negative river overflow penalty: {}".format(penalty_for_river_overflow))
+                if self.verbose:
+                    print("negative river overflow penalty: {}".format(penalty_for_river_overflow))
                 self.current_overflow_penalty = max(0, penalty_for_river_overflow * self.penalty_convertion_rate)
                 self.cash[player_id] -= self.current_overflow_penalty
+                self.total_overflow_penalty[player_id] += self.current_overflow_penalty
 
             if player_output_in_mwh > 0:
                 self.power_marked.add_player_bid(player_id, player_output_in_mwh, self.price_of_power[player_id])
@@ -231,4 +338,41 @@ class Game:
         # clear production
         self.production = {}
         self.price_of_power = {}
+
+
+def log_scoreboard_to_json(game: Game):
+    scores = {}
+    for player_id, cash in game.cash.items():
+        try:
+            name = game.names[player_id]
+            scores[name] = cash / 1_000_000
+        except KeyError:
+            continue
+
+    # sort scores
+    sorted_scores = dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
+    power_price = game.average_power_price / 1000.0
+    timestep = game.timestep
+
+    # convert timestep to date:
+    # timestep 0, is Jan1, year 2010    
+    timestep_date = datetime.datetime(2010, 1, 1) + datetime.timedelta(days=timestep)
+
+    # write the day out as weekday - month day - month name
+    timestep = "Timestep:{}, date: {}".format(timestep, timestep_date.strftime("%A, %B %d"))
+
+    out = {
+        "scores": sorted_scores,
+        "average_power_price": power_price,
+        "timestep": timestep,
+    }
     
+    # write out to file
+    if not os.path.exists("./scoreboards"):
+        os.makedirs("./scoreboards")
+
+    with open("./scoreboards/scoreboard_{}.json".format(game.timestep), "w") as fp:
+        json.dump(out, fp, indent=4)
+
+    with open("./scoreboards/gamestate_{}.pkl".format(game.timestep), "wb") as fp:
+        pickle.dump(game, fp, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,93 @@
+import argparse
+import time
+
+from hydro_trader.game import Game, create_game
+from hydro_trader.strategies import load_strategy
+
+
+class HeadlessRunner:
+    """
+    Plays a game without the server, for offline backtesting.
+
+    The strategies (same interface as client.Strategy) are called in-process in the same order as
+    client.Client calls them, and the game advances as fast as the CPU allows (no time_per_step).
+    """
+
+    def __init__(self, game: Game, verbose=False):
+        self.game = game
+        self.game.verbose = verbose
+        self.strategies = {} # player_id -> strategy
+
+    def add_player(self, player_id, player_name, strategy):
+        self.game.add_player(player_id, player_name)
+        strategy.player_id = player_id
+        self.strategies[player_id] = strategy
+
+    def run(self, n_timesteps) -> dict:
+        """
+        Plays the game until it is over, returns the results and the number of timesteps per second
+        """
+        game = self.game
+        game.n_timesteps = n_timesteps
+
+        for player_id, strategy in self.strategies.items():
+            strategy.initial_state = game.get_full_state(player_id)
+            strategy.current_state = game.get_timestep_state(player_id)
+            strategy.got_initial_state()
+
+        start_time = time.perf_counter()
+        start_timestep = game.timestep
+
+        while True:
+            # same order as the game loop of the server: the timestep where the game is over is still processed
+            is_game_over = game.is_game_over()
+
+            for player_id, strategy in self.strategies.items():
+                plan = strategy.get_production_plan_and_power_price()
+                game.set_production(player_id, plan["reservoir_ids"], plan["power_price"])
+
+            game.process_timestep()
+
+            for player_id, strategy in self.strategies.items():
+                strategy.current_state = game.get_timestep_state(player_id)
+
+            if is_game_over:
+                break
+
+        elapsed = time.perf_counter() - start_time
+        for strategy in self.strategies.values():
+            strategy.game_over()
+
+        n_processed = game.timestep - start_timestep
+        return {
+            "n_timesteps": n_processed,
+            "elapsed": elapsed,
+            "timesteps_per_second": n_processed / elapsed if elapsed > 0 else float("inf"),
+            "players": game.get_results(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play a game without the server, as fast as possible')
+    parser.add_argument('--n_timesteps', '-n', type=int, default=200, help='Number of timesteps (default: 200)')
+    parser.add_argument('--players', '-p', type=int, default=4, help='Number of players (default: 4)')
+    parser.add_argument('--strategy', '-s', default='ProduceAllStrategy', help='Strategy for all players, "module:Class" or a class in hydro_trader.strategies (default: ProduceAllStrategy)')
+    parser.add_argument('--engine', default='object', choices=Game.ENGINES, help='Simulation engine (default: object)')
+    parser.add_argument('--environment', default='norwegian', help='Environment (map) in <data_dir>/environments or a json file (default: norwegian)')
+    parser.add_argument('--data_dir', default='data', help='Data directory (default: data)')
+    args = parser.parse_args()
+
+    runner = HeadlessRunner(create_game(data_dir=args.data_dir, engine=args.engine, environment=args.environment))
+    for i in range(args.players):
+        runner.add_player("player_{}".format(i), "player_{}".format(i), load_strategy(args.strategy))
+
+    results = runner.run(args.n_timesteps)
+
+    print("{} timesteps in {:.3f}s : {:.1f} timesteps/second".format(results["n_timesteps"], results["elapsed"], results["timesteps_per_second"]))
+    for player_id, result in sorted(results["players"].items(), key=lambda item: item[1]["cash"], reverse=True):
+        print("{:<12} cash: {:>14.2f}  production: {:>12.2f} MWh  overflow penalty: {:>12.2f}".format(
+            result["name"], result["cash"], result["production_mwh"], result["overflow_penalty"]))
+
+
+if __name__ == "__main__":
+    main()
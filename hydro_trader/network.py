@@ -0,0 +1,161 @@
+import heapq
+from collections import Counter
+
+import numpy as np
+
+
+class CompiledNetwork:
+    """
+    Index based description of a reservoir network, created by compile_network.
+
+    Reservoirs, rivers and mountains are referred to by their index in the lists given to compile_network
+    (the same order as Simulation.reservoirs/rivers/mountains, snapshots and BatchSimulation columns).
+    Adjacency is stored as CSR arrays: the out rivers of reservoir i are
+    out_river_index[out_river_ptr[i]:out_river_ptr[i+1]], and the same for in rivers.
+
+    The step plan runs in three phases: mountains (snow melt), reservoirs in reservoir_order (upstream
+    first) and rivers in river_order, rivers deliver their water after every reservoir has produced.
+
+    Routing is also given as sparse incidence lists (coordinate format), in the same order as the step plan:
+    outflow edge e moves 1/outflow_n_rivers[e] of the outflow of reservoir outflow_reservoir[e] into river
+    outflow_river[e], and delivery edge d moves the outflow of river delivery_river[d] into reservoir
+    delivery_reservoir[d]. With these the routing of a whole network is a couple of scatter-adds.
+    """
+
+    def __init__(self, reservoir_ids, river_ids, mountain_ids, out_river_ptr, out_river_index, in_river_ptr,
+                 in_river_index, river_output, mountain_output, reservoir_order, river_order):
+        self.reservoir_ids = reservoir_ids
+        self.river_ids = river_ids
+        self.mountain_ids = mountain_ids
+        self.reservoir_index = {r_id: i for i, r_id in enumerate(reservoir_ids)}
+        self.river_index = {r_id: k for k, r_id in enumerate(river_ids)}
+
+        self.out_river_ptr = out_river_ptr
+        self.out_river_index = out_river_index
+        self.in_river_ptr = in_river_ptr
+        self.in_river_index = in_river_index
+        self.n_out_rivers = np.diff(out_river_ptr)
+
+        self.river_output = river_output # -1 when the river runs into the ocean
+        self.mountain_output = mountain_output
+
+        self.reservoir_order = reservoir_order
+        self.river_order = river_order
+        self.mountain_order = np.arange(len(mountain_ids))
+
+        self.outflow_reservoir = np.repeat(reservoir_order, self.n_out_rivers[reservoir_order])
+        self.outflow_river = np.concatenate([self.out_rivers(i) for i in reservoir_order] + [np.zeros(0, dtype=np.int64)])
+        self.outflow_n_rivers = self.n_out_rivers[self.outflow_reservoir].astype(np.float64)
+
+        self.delivery_river = river_order[river_output[river_order] >= 0]
+        self.delivery_reservoir = river_output[self.delivery_river]
+
+    @property
+    def shape(self):
+        return len(self.reservoir_ids), len(self.river_ids), len(self.mountain_ids)
+
+    def out_rivers(self, i):
+        return self.out_river_index[self.out_river_ptr[i]:self.out_river_ptr[i + 1]]
+
+    def in_rivers(self, i):
+        return self.in_river_index[self.in_river_ptr[i]:self.in_river_ptr[i + 1]]
+
+
+def _csr(lists):
+    ptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(values) for values in lists])
+    index = np.array([value for values in lists for value in values], dtype=np.int64)
+    return ptr, index
+
+
+def compile_network(reservoirs, rivers, mountains) -> CompiledNetwork:
+    """
+    Validates a reservoir/river/mountain graph and compiles it to an index based step plan.
+
+    Raises ValueError if ids are not unique, if a component refers to a reservoir or river that is not part of
+    the network, or if the rivers make a cycle (water must always flow downstream).
+    """
+    for name, components in (("reservoir", reservoirs), ("river", rivers), ("mountain", mountains)):
+        duplicates = sorted(i for i, n in Counter(c.id for c in components).items() if n > 1)
+        if duplicates:
+            raise ValueError("Duplicate {} ids: {}".format(name, duplicates))
+
+    reservoir_index = {id(r): i for i, r in enumerate(reservoirs)}
+    river_index = {id(r): k for k, r in enumerate(rivers)}
+
+    river_output = np.full(len(rivers), -1, dtype=np.int64)
+    for k, river in enumerate(rivers):
+        if river.output_reservoir is not None:
+            if id(river.output_reservoir) not in reservoir_index:
+                raise ValueError("River {} flows into {}, which is not part of the network".format(river.id, river.output_reservoir.id))
+            river_output[k] = reservoir_index[id(river.output_reservoir)]
+
+    mountain_output = np.zeros(len(mountains), dtype=np.int64)
+    for j, mountain in enumerate(mountains):
+        if mountain.output_reservoir is None or id(mountain.output_reservoir) not in reservoir_index:
+            raise ValueError("Mountain {} does not melt into a reservoir of the network".format(mountain.id))
+        mountain_output[j] = reservoir_index[id(mountain.output_reservoir)]
+
+    out_rivers = []
+    in_rivers = [[] for _ in reservoirs]
+    for i, reservoir in enumerate(reservoirs):
+        indices = []
+        for river in reservoir.out_rivers:
+            if id(river) not in river_index:
+                raise ValueError("Reservoir {} flows into river {}, which is not part of the network".format(reservoir.id, river.id))
+            indices.append(river_index[id(river)])
+        out_rivers.append(indices)
+
+        for river in reservoir.in_rivers:
+            if id(river) not in river_index or river_output[river_index[id(river)]] != i:
+                raise ValueError("River {} is an in river of {}, but does not flow into it".format(river.id, reservoir.id))
+
+    for k, r in enumerate(river_output):
+        if r >= 0:
+            in_rivers[r].append(k)
+
+    # Topological order of the reservoirs (Kahn), ties are kept in list order
+    downstream = [sorted(set(int(river_output[k]) for k in indices if river_output[k] >= 0)) for indices in out_rivers]
+    n_upstream = [0] * len(reservoirs)
+    for targets in downstream:
+        for r in targets:
+            n_upstream[r] += 1
+
+    reservoir_order = []
+    ready = [i for i, n in enumerate(n_upstream) if n == 0]
+    while ready:
+        i = heapq.heappop(ready)
+        reservoir_order.append(i)
+        for r in downstream[i]:
+            n_upstream[r] -= 1
+            if n_upstream[r] == 0:
+                heapq.heappush(ready, r)
+
+    if len(reservoir_order) != len(reservoirs):
+        in_cycle = [reservoirs[i].id for i, n in enumerate(n_upstream) if n > 0]
+        raise ValueError("The river network has a cycle, involving: {}".format(in_cycle))
+
+    # Rivers are processed in the order of the first reservoir flowing into them, rivers without a source last
+    rank = {i: n for n, i in enumerate(reservoir_order)}
+    river_rank = [len(reservoirs)] * len(rivers)
+    for i, indices in enumerate(out_rivers):
+        for k in indices:
+            river_rank[k] = min(river_rank[k], rank[i])
+    river_order = sorted(range(len(rivers)), key=lambda k: (river_rank[k], k))
+
+    out_river_ptr, out_river_index = _csr(out_rivers)
+    in_river_ptr, in_river_index = _csr(in_rivers)
+
+    return CompiledNetwork(
+        reservoir_ids=[r.id for r in reservoirs],
+        river_ids=[r.id for r in rivers],
+        mountain_ids=[m.id for m in mountains],
+        out_river_ptr=out_river_ptr,
+        out_river_index=out_river_index,
+        in_river_ptr=in_river_ptr,
+        in_river_index=in_river_index,
+        river_output=river_output,
+        mountain_output=mountain_output,
+        reservoir_order=np.array(reservoir_order, dtype=np.int64),
+        river_order=np.array(river_order, dtype=np.int64),
+    )
@@ -5,11 +5,16 @@ norwegian_reservoirs = [
     "Nyfjord",
     "Tesselvannet"
 ]
-import csv
 import os
-import random
+from array import array
+
+from hydro_trader.data_store import ForcingDataStore, SharedSeries
 
 class River:
+    # components are copied for every player, slots keep them small and attribute access fast
+    __slots__ = ("id", "_queue", "_head", "_total", "length_in_timesteps", "max_flow", "output_reservoir",
+                 "current_flow", "consecutive_days_over_max", "cumulative_penalty")
+
     def __init__(self, id, initial_water, length_in_timesteps, max_flow, output_reservoir:"Reservoir"):
         """
         The River class is used to model the water flow between reservoirs.
@@ -18,9 +23,14 @@ class River:
         length_in_timesteps: int
         max_flow: float [m3/s]
         output_reservoir: Reservoir # the reservoir that receives the water
+
+        The queue is a fixed size ring buffer with a running total, so adding inflow and advancing
+        the river does not depend on the length of the river.
         """
         self.id = id
-        self.water_queue = [initial_water / length_in_timesteps] * length_in_timesteps
+        self._queue = array('d', [initial_water / length_in_timesteps] * length_in_timesteps)
+        self._head = 0  # position of the beginning of the queue in the ring buffer
+        self._total = sum(self._queue)  # sum of all water in the queue
         self.length_in_timesteps = length_in_timesteps
         self.max_flow = max_flow
         self.output_reservoir = output_reservoir
@@ -28,22 +38,37 @@ class River:
         self.consecutive_days_over_max = 0  # count of consecutive days over max flow
         self.cumulative_penalty = 0.0  # track the total cumulative penalty
 
+    @property
+    def water_queue(self) -> list:
+        """The water in the river [m3] from the beginning to the end of the queue"""
+        return (self._queue[self._head:] + self._queue[:self._head]).tolist()
+
     def add_inflow(self, water_volume):
         """Add water to the river at the beginning of the queue"""
-        self.water_queue[0] += water_volume
+        self._queue[self._head] += water_volume
+        self._total += water_volume
         
     def process_timestep(self):
         """
         Process the river for the next timestep
         """
 
-        self.current_flow = sum(self.water_queue)
+        self.current_flow = self._total
 
         # get overflow water
         overflow_penalty =  self.get_max_flow_penalty()
 
-        # Get water at the end of the queue
-        outflow_water = self.water_queue.pop()        
+        # Get water at the end of the queue, the emptied slot becomes the new beginning of the queue
+        tail = self._head - 1 if self._head > 0 else len(self._queue) - 1
+        outflow_water = self._queue[tail]
+        self._queue[tail] = 0.0
+        self._head = tail
+
+        if tail == 0:
+            # resum once per round so rounding errors in the running total does not build up
+            self._total = sum(self._queue)
+        else:
+            self._total -= outflow_water
         
         # Check if we exceed the maximum flow
         if self.current_flow > self.max_flow:
@@ -56,12 +81,25 @@ class River:
         # Add water to the output reservoir (capped at max_flow)
         if self.output_reservoir:
             self.output_reservoir.add_inflow_river(outflow_water)
-            
-        # Add new empty slot at the beginning of queue
-        self.water_queue.insert(0, 0.0)
         
         return self.current_flow, overflow_penalty
         
+    def get_state(self) -> list:
+        """Dynamic state as floats: the queue (beginning first), current flow and the penalty counters"""
+        return self.water_queue + [self.current_flow, float(self.consecutive_days_over_max), self.cumulative_penalty]
+
+    def set_state(self, values):
+        """Restores a state from get_state"""
+        n = len(self._queue)
+        self._queue = array('d', values[:n])
+        self._head = 0
+        self._total = sum(self._queue)
+        self.current_flow, consecutive_days_over_max, self.cumulative_penalty = values[n:n + 3]
+        self.consecutive_days_over_max = int(consecutive_days_over_max)
+
+    def state_size(self):
+        return len(self._queue) + 3
+
     def get_max_flow_penalty(self):
         """
         Calculate the penalty for exceeding the maximum flow rate.
@@ -92,7 +130,10 @@ class River:
 
 
 class MontainWithSnow:
-    def __init__(self, id, output_reservoir:"Reservoir", in_file_csv:str):
+    __slots__ = ("id", "output_reservoir", "current_snow_height", "temperature", "snow_area", "timestep",
+                 "max_loss_water_factor", "water_loss_in_transporation", "snow_melt_data", "data")
+
+    def __init__(self, id, output_reservoir:"Reservoir", in_file_csv:str, data_store:ForcingDataStore=None):
         """
         Reads the Temperature and Snow height from the in_file
         current_snow_height: float [m] - height of the snow
@@ -100,39 +141,51 @@ class MontainWithSnow:
         snow_area: float [m2] - area of the mountain snow, used to calculate the snow melt
 
         Read the csv file to get the temperature and snow height for each timestep, use the delta to calculate any potential snow melt
+        The data is read through data_store, so mountains created with the same store share the data.
         """
+        if data_store is None:
+            data_store = ForcingDataStore(os.path.dirname(in_file_csv))
+
         self.id = id
         self.output_reservoir = output_reservoir
         self.current_snow_height = 0.0  # m
         self.temperature = 0.0  # °C
         self.snow_area = 1000000.0  # m2 (default 1 km²)
         self.timestep = 0
-        self.data = []
 
         self.max_loss_water_factor = 0.05
-        self.water_loss_in_transporation = []
+        self.water_loss_in_transporation = data_store.water_loss_factors(self.max_loss_water_factor)
+        self.snow_melt_data = None # precomputed snow melt per timestep, see Simulation.precompute_natural_inflow
 
-        random.seed(42)
-        for _ in range(1000):
-            self.water_loss_in_transporation.append(random.uniform(0,self.max_loss_water_factor))
-
-        
         # Read the CSV file
         if os.path.exists(in_file_csv):
-            with open(in_file_csv, 'r') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    self.data.append({
-                        'temperature': float(row.get('Temperature', 0)),
-                        'snow_height': float(row.get('SnowHeight', 0))
-                    })
+            self.data = data_store.snow(in_file_csv)
         else:
             raise ValueError(f"Warning: Snow data file {in_file_csv} not found!")
             
         # Initialize with first data point if available
-        if self.data:
-            self.current_snow_height = self.data[0]['snow_height']
-            self.temperature = self.data[0]['temperature']
+        if len(self.data) > 0:
+            self.current_snow_height = float(self.data.snow_height[0])
+            self.temperature = float(self.data.temperature[0])
+
+    def set_timestep(self, timestep):
+        """Moves the mountain to *timestep* without melting any snow (e.g. to start a game at another date)"""
+        self.timestep = timestep
+        if timestep < len(self.data):
+            self.current_snow_height = float(self.data.snow_height[timestep])
+            self.temperature = float(self.data.temperature[timestep])
+
+    def get_state(self) -> list:
+        """Dynamic state as floats: timestep, snow height and temperature"""
+        return [float(self.timestep), self.current_snow_height, self.temperature]
+
+    def set_state(self, values):
+        """Restores a state from get_state"""
+        timestep, self.current_snow_height, self.temperature = values
+        self.timestep = int(timestep)
+
+    def state_size(self):
+        return 3
 
     def process_timestep(self):
             """
@@ -145,14 +198,18 @@ class MontainWithSnow:
             if self.timestep < len(self.data):
                 # Calculate snow melt from previous to current timestep
                 prev_snow_height = self.current_snow_height
-                self.current_snow_height = self.data[self.timestep]['snow_height']
-                self.temperature = self.data[self.timestep]['temperature']
+                self.current_snow_height = float(self.data.snow_height[self.timestep])
+                self.temperature = float(self.data.temperature[self.timestep])
+
+                if self.snow_melt_data is not None:
+                    # the melt water is already part of the reservoirs precomputed natural inflow
+                    return float(self.snow_melt_data.snow_melt[self.timestep])
                 
                 # Only melt snow if temperature is above 0°C and snow height has decreased
                 snow_melt = 0.0
                 if self.temperature > 0 and prev_snow_height > self.current_snow_height:
                     # Calculate snow melt in m³
-                    f = self.water_loss_in_transporation[self.timestep % 1000] 
+                    f = self.water_loss_in_transporation.factor[self.timestep % len(self.water_loss_in_transporation)]
                     snow_melt = (prev_snow_height - self.current_snow_height) * self.snow_area * f
                     # Add melt water to the reservoir - add direcly to the reservoir to make the task a bit easier (no delay)
                     self.output_reservoir.add_inflow_snow_melt(snow_melt)
@@ -165,11 +222,17 @@ class MontainWithSnow:
 
 
 class Reservoir:
-    def __init__(self, id, rain_data_csv:str):
+    __slots__ = ("id", "water_amount", "water_area", "basin_area", "capacity", "river_inflow", "natural_inflow",
+                 "river_outflow", "generator_head_height", "generator_efficiency", "is_producing", "current_production",
+                 "generator_flow", "max_generator_flow", "is_raining", "rain_forecast_probability", "timestep",
+                 "rain_height", "natural_inflow_data", "in_rivers", "out_rivers", "rain_data")
+
+    def __init__(self, id, rain_data_csv:str, data_store:ForcingDataStore=None):
         """
         Initialize a reservoir with its properties.
         
         rain_data_csv: str - a file to read the forcast and and rain data from
+        data_store: ForcingDataStore - reads and shares the rain data (a private store is used if None)
 
         water amount: float [m3]
         water_area: float [m2]
@@ -218,35 +281,55 @@ class Reservoir:
         # Rain properties
         self.is_raining = False
         self.rain_forecast_probability = 0.0
-        self.rain_data = []
         self.timestep = 0
         # Rain height in meters - constant value when it rains (in meters)
         self.rain_height = 0.01  # Default: 1 cm of rain
+        # precomputed rain and snow melt per timestep, see Simulation.precompute_natural_inflow
+        self.natural_inflow_data = None
         
         # River connections
         self.in_rivers = []
         self.out_rivers = []
         
         # Load rain data if available
+        if data_store is None:
+            data_store = ForcingDataStore(os.path.dirname(rain_data_csv))
+
         if os.path.exists(rain_data_csv):
-            with open(rain_data_csv, 'r') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    # Parse Actual_Rain as boolean and Forecast as probability
-                    is_raining = row.get('Actual_Rain', '0').lower() in ['1', 'true', 'True', 'yes', 'y']
-                    forecast_prob = float(row.get('Forecast', 0))  # [0,1]
-                    
-                    self.rain_data.append({
-                        'is_raining': is_raining,
-                        'forecast_probability': forecast_prob
-                    })
+            self.rain_data = data_store.rain(rain_data_csv)
         else:
             print(f"Warning: Rain data file {rain_data_csv} not found!")
+            self.rain_data = SharedSeries(is_raining=[], forecast_probability=[])
         
         # Initial rain status
-        if self.rain_data:
-            self.is_raining = self.rain_data[0]['is_raining']    
-            self.rain_forecast_probability = self.rain_data[0]['forecast_probability']
+        if len(self.rain_data) > 0:
+            self.is_raining = bool(self.rain_data.is_raining[0])
+            self.rain_forecast_probability = float(self.rain_data.forecast_probability[0])
+
+    def set_timestep(self, timestep):
+        """Moves the rain data to *timestep* without adding any rain (e.g. to start a game at another date)"""
+        self.timestep = timestep
+        if timestep < len(self.rain_data):
+            self.is_raining = bool(self.rain_data.is_raining[timestep])
+            self.rain_forecast_probability = float(self.rain_data.forecast_probability[timestep])
+
+    def get_state(self) -> list:
+        """Dynamic state as floats: water, flows, production and rain status"""
+        return [self.water_amount, self.river_inflow, self.natural_inflow, self.river_outflow,
+                self.generator_head_height, self.generator_flow, float(self.is_producing), self.current_production,
+                float(self.is_raining), self.rain_forecast_probability, float(self.timestep)]
+
+    def set_state(self, values):
+        """Restores a state from get_state"""
+        (self.water_amount, self.river_inflow, self.natural_inflow, self.river_outflow,
+         self.generator_head_height, self.generator_flow, is_producing, self.current_production,
+         is_raining, self.rain_forecast_probability, timestep) = values
+        self.is_producing = bool(is_producing)
+        self.is_raining = bool(is_raining)
+        self.timestep = int(timestep)
+
+    def state_size(self):
+        return 11
 
     def fill(self):
         self.water_amount = self.capacity
@@ -392,13 +475,17 @@ class Reservoir:
         # Process rain data for current timestep
         self.timestep += 1
         if self.timestep < len(self.rain_data):
-            rain_data = self.rain_data[self.timestep]
-            self.is_raining = rain_data['is_raining']
-            self.rain_forecast_probability = rain_data['forecast_probability']
+            self.is_raining = bool(self.rain_data.is_raining[self.timestep])
+            self.rain_forecast_probability = float(self.rain_data.forecast_probability[self.timestep])
             
             # Process rainfall - use the constant rain_height when it's raining
-            if self.is_raining:
+            if self.is_raining and self.natural_inflow_data is None:
                 self.add_inflow_rain(self.rain_height)
+
+        if self.natural_inflow_data is not None and self.timestep < len(self.natural_inflow_data):
+            # Snow melt arrives before the flow counters are reset, so only the rain counts as natural inflow
+            self.natural_inflow = float(self.natural_inflow_data.rain[self.timestep])
+            self.water_amount = min(self.water_amount + float(self.natural_inflow_data.total[self.timestep]), self.capacity)
         
         # Handle overflow case - check if we're at capacity
         overflow_amount = 0.0
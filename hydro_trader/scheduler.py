@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+logger = logging.getLogger("hydro_trader.scheduler")
+
+
+class TickScheduler:
+    """
+    Runs the game loop on absolute tick boundaries of the monotonic clock (start + n * period), so the time spent
+    processing a tick does not add up to the period and the tick rate does not drift as the work grows.
+
+    The slack of a tick is the time left until its deadline when the work is done (negative when the work
+    overran the deadline). When the work falls more than a whole period behind, the missed boundaries are
+    skipped instead of running the next ticks back to back.
+    """
+
+    def __init__(self, period=1.0, history=100, clock=time.monotonic):
+        self.period = period
+        self.clock = clock
+        self.deadline = None
+        self.n_ticks = 0
+        self.n_overruns = 0
+        self.n_skipped = 0
+        self.last_slack = None
+        self.slack_history = deque(maxlen=history)
+
+    def start(self):
+        """The first deadline is one period from now"""
+        self.deadline = self.clock() + self.period
+
+    async def wait(self, ready: asyncio.Event = None) -> bool:
+        """
+        Waits until the deadline of the current tick, or until *ready* is set. Returns True if woken by ready,
+        the next tick is then scheduled one period from now.
+        """
+        if self.deadline is None:
+            self.start()
+
+        slack = self.deadline - self.clock()
+        self.last_slack = slack
+        self.slack_history.append(slack)
+        self.n_ticks += 1
+
+        woken = False
+        if slack < 0:
+            self.n_overruns += 1
+            logger.warning("Tick %d overran its deadline by %.1f ms", self.n_ticks, -slack * 1000)
+        elif ready is not None:
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=slack)
+                woken = True
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(slack)
+
+        now = self.clock()
+        if woken:
+            self.deadline = now + self.period
+        else:
+            self.deadline += self.period
+            if self.deadline <= now:
+                missed = int((now - self.deadline) // self.period) + 1
+                self.n_skipped += missed
+                self.deadline += missed * self.period
+        return woken
+
+    def stats(self) -> dict:
+        slack = list(self.slack_history)
+        return {
+            "period": self.period,
+            "ticks": self.n_ticks,
+            "overruns": self.n_overruns,
+            "skipped": self.n_skipped,
+            "last_slack_ms": self.last_slack * 1000 if self.last_slack is not None else None,
+            "min_slack_ms": min(slack) * 1000 if slack else None,
+            "mean_slack_ms": sum(slack) / len(slack) * 1000 if slack else None,
+        }
+
+
+class TickNotifier:
+    """
+    Wakes every handler waiting for the next tick, with a generation counter instead of an event per player.
+
+    notify sets one event shared by all waiters of the tick and replaces it for the next tick, so the game loop
+    does not touch the players. A cancelled waiter only leaves the event, the other waiters keep waiting. A handler
+    keeps the generation it has seen and waits with it, so a tick that happened while it was busy is never lost,
+    and the returned generation tells how many ticks it missed.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._event = None # created in the running loop by the first waiter of a tick
+
+    def notify(self):
+        self.generation += 1
+        event, self._event = self._event, None
+        if event is not None:
+            event.set()
+
+    async def wait(self, seen: int) -> int:
+        """Waits for a generation newer than *seen* and returns it (more than seen + 1 if ticks were missed)"""
+        while self.generation <= seen:
+            if self._event is None:
+                self._event = asyncio.Event()
+            await self._event.wait()
+        return self.generation
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Set, Any, List
 from contextlib import asynccontextmanager
 from copy import deepcopy
@@ -19,66 +20,162 @@ from starlette.middleware.sessions import SessionMiddleware
 
 
 # Local imports
-from hydro_trader.game import Game, PowerMarked
+from hydro_trader.game import Game, PowerMarked, create_game, log_scoreboard_to_json
 from hydro_trader.reservoirs import Reservoir, River, MontainWithSnow
 from hydro_trader.simulation import Simulation
-
-
+from hydro_trader.data_store import ForcingDataStore
+from hydro_trader.environment import list_environments, load_environment
+from hydro_trader.broadcast import Broadcaster
+from hydro_trader.delta import DeltaEncoder, SharedEncoder
+from hydro_trader.scheduler import TickNotifier, TickScheduler
+from hydro_trader.wire import ENCODINGS, StateCodec, array_header, map_header, pack_items, packb, unpackb
+from hydro_trader.worker import SimulationProcess
 
 
 logger = logging.getLogger("hydro_trader.server")
 logging.basicConfig(level=logging.INFO)
 
 
-def log_scoreboard_to_json(game: Game):
-    scores = {}
-    for player_id, cash in game.cash.items():
-        try:
-            name = game.names[player_id]
-            scores[name] = cash / 1_000_000
-        except KeyError:
-            continue
-
-    # sort scores
-    sorted_scores = dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
-    power_price = game.average_power_price / 1000.0
-    timestep = game.timestep
-
-    # convert timestep to date:
-    # timestep 0, is Jan1, year 2010    
-    timestep_date = datetime.datetime(2010, 1, 1) + datetime.timedelta(days=timestep)
-
-    # write the day out as weekday - month day - month name
-    timestep = "Timestep:{}, date: {}".format(timestep, timestep_date.strftime("%A, %B %d"))
-
-    out = {
-        "scores": sorted_scores,
-        "average_power_price": power_price,
-        "timestep": timestep,
-    }
-    
-    # write out to file
-    if not os.path.exists("./scoreboards"):
-        os.makedirs("./scoreboards")
-
-    with open("./scoreboards/scoreboard_{}.json".format(game.timestep), "w") as fp:
-        json.dump(out, fp, indent=4)
-
-    with open("./scoreboards/gamestate_{}.pkl".format(game.timestep), "wb") as fp:
-        pickle.dump(game, fp, protocol=pickle.HIGHEST_PROTOCOL)
-
+def encode_state(state) -> str:
+    """Same json encoding as WebSocket.send_json, so a state can be encoded once and sent with send_text"""
+    return json.dumps(state, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_timestep_states(game: Game, player_ids) -> Dict[str, str]:
+    """
+    The encoded timestep state of every player in player_ids, the same json as encode_state(game.get_timestep_state(player_id)).
+
+    The part that is the same for every player (marked demand, sold power, ...) is encoded once, and the
+    entry of every player in other_players once, the payloads are stitched together from the encoded parts.
+    """
+    shared = encode_state(game.get_shared_timestep_state())[1:-1]
+    summaries = {player_id: encode_state(game.get_player_summary(player_id)) for player_id in game.names}
+
+    payloads = {}
+    for player_id in player_ids:
+        own = encode_state(game.get_player_timestep_state(player_id))[1:-1]
+        others = ",".join(summary for other_player_id, summary in summaries.items() if other_player_id != player_id)
+        payloads[player_id] = "{" + own + "," + shared + ',"other_players":[' + others + "]}"
+    return payloads
+
+
+def encode_binary_timestep_states(game: Game, player_ids, codec: StateCodec) -> Dict[str, bytes]:
+    """encode_timestep_states for players using the binary encoding, the same bytes as codec.encode(game.get_timestep_state(player_id))"""
+    shared = game.get_shared_timestep_state()
+    shared_items = pack_items(shared)
+    summaries = {player_id: packb(game.get_player_summary(player_id)) for player_id in game.names}
+    other_players_key = packb("other_players")
+
+    payloads = {}
+    for player_id in player_ids:
+        own = codec.compact(game.get_player_timestep_state(player_id))
+        others = [summary for other_player_id, summary in summaries.items() if other_player_id != player_id]
+        payloads[player_id] = b"".join([map_header(len(own) + len(shared) + 1), pack_items(own), shared_items,
+                                        other_players_key, array_header(len(others))] + others)
+    return payloads
+
+
+def encode_delta_timestep_states(game: Game, delta_encoders, codecs, shared_encoder: SharedEncoder) -> Dict[str, object]:
+    """
+    The keyframe or delta (see hydro_trader.delta) of every player in delta_encoders, json or binary for the players
+    in codecs, the same payloads as encoding delta_encoders[player_id].encode(game.get_timestep_state(player_id)).
+
+    Only the part of the player is diffed per player. The changes of the shared part and the summaries in
+    other_players are computed and encoded once for every base snapshot, and stitched in like encode_timestep_states.
+    """
+    shared = game.get_shared_timestep_state()
+    summaries = {player_id: game.get_player_summary(player_id) for player_id in game.names}
+    snapshot = shared_encoder.add(shared, summaries)
+
+    changes_since = {} # base snapshot -> (changes of the shared state, players whose summary changed)
+    shared_items = {} # (base snapshot, binary) -> encoded items of the changes, (None, binary) for the whole shared state
+    encoded_summaries = {} # (player_id, binary) -> encoded summary
+
+    def encode_items(d, binary):
+        return pack_items(d) if binary else encode_state(d)[1:-1]
+
+    def encode_summary(player_id, binary):
+        if (player_id, binary) not in encoded_summaries:
+            encoded_summaries[player_id, binary] = packb(summaries[player_id]) if binary else encode_state(summaries[player_id])
+        return encoded_summaries[player_id, binary]
+
+    payloads = {}
+    for player_id, encoder in delta_encoders.items():
+        binary = player_id in codecs
+        message, base_snapshot = encoder.encode_own(game.get_player_timestep_state(player_id), snapshot)
+        others = [other_player_id for other_player_id in summaries if other_player_id != player_id]
+
+        if message["type"] == "keyframe":
+            key, own, shared_part, with_others = "state", message["state"], shared, True
+        else:
+            if base_snapshot not in changes_since:
+                changes_since[base_snapshot] = shared_encoder.changes_since(base_snapshot)
+            shared_part, changed_summaries = changes_since[base_snapshot]
+            key, own = "changes", message["changes"]
+            with_others = changed_summaries is None or any(other_player_id in changed_summaries for other_player_id in others)
+
+        if (base_snapshot, binary) not in shared_items:
+            shared_items[base_snapshot, binary] = encode_items(shared_part, binary)
+        head = {k: v for k, v in message.items() if k != key}
+
+        if binary:
+            own = codecs[player_id].compact(own)
+            parts = [map_header(len(head) + 1), pack_items(head), packb(key),
+                     map_header(len(own) + len(shared_part) + int(with_others)), pack_items(own), shared_items[base_snapshot, binary]]
+            if with_others:
+                parts += [packb("other_players"), array_header(len(others))] + [encode_summary(other_player_id, True) for other_player_id in others]
+            payloads[player_id] = b"".join(parts)
+        else:
+            parts = [encode_items(own, False), shared_items[base_snapshot, binary]]
+            if with_others:
+                parts.append('"other_players":[' + ",".join(encode_summary(other_player_id, False) for other_player_id in others) + "]")
+            payloads[player_id] = encode_state(head)[:-1] + "," + encode_state(key) + ":{" + ",".join(part for part in parts if part) + "}}"
+    return payloads
 
 
 class Server:
-    def __init__(self, game_id:str = "game1"):        
+    def __init__(self, game_id:str = "game1", engine:str = "object", environment:str = "norwegian", simulation_process:bool = False,
+                 send_policy:str = "latest", send_queue_size:int = 8):        
+        self.engine = engine # simulation engine used by the game, see Game.ENGINES
+        self.environment = environment # the map, a file in data/environments
+        self.data_store = ForcingDataStore(data_dir="data") # kept between games, so a reset does not read the data again
+
+        # optionally run the game in its own process (see hydro_trader.worker), self.game is then a RemoteGame
+        self.simulation_process = SimulationProcess() if simulation_process else None
         self.game : Game = self._create_game()
         self.password = "123"
         self.admin_password = "1234"
-        self.time_per_step = 1.0
+        self.time_per_step = 1.0 # seconds, with advance_when_ready the deadline for players that are slow to submit
+        self.advance_when_ready = False # process the timestep as soon as every connected player has sent a plan
 
         self._players : Set[str] = set()
         self._sockets : Dict[str, WebSocket] = {}
-        self.update_events = {}
+        self.tick_notifier = TickNotifier() # the player handlers wait on it for the next timestep
+
+        # Everything sent to the players goes through a bounded queue per connection, written by its own task.
+        # A player gets the state of a timestep when its plan was part of it, or right away when it sends a plan
+        # after missing a timestep. Slow players skip to the latest state (send_policy "latest") or are dropped ("drop").
+        self.broadcaster = Broadcaster(max_queue=send_queue_size, policy=send_policy)
+        self._tick_count = 0
+        self._last_sent_tick = {} # player_id -> _tick_count of the last state queued for the player
+
+        # The timestep is processed in a dedicated thread, so the event loop keeps reading and writing websockets.
+        # The lock is held while the thread works on the game, anything else that uses the game goes through _call_game.
+        self._tick_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hydro_trader_tick")
+        self._tick_lock = asyncio.Lock()
+        self._pending_production = {} # player_id -> (reservoir_ids, power_price), handed to the thread each timestep
+        self._all_submitted = asyncio.Event() # set when every connected player has a pending plan
+        self.scheduler = TickScheduler(self.time_per_step) # replaced when a game starts, see stats() for the slack per tick
+        self._payloads = {} # player_id -> encoded timestep state, built by the thread after each timestep
+
+        # players that asked for delta updates get only the changes since the last state they acknowledged
+        self.keyframe_interval = 20 # a full state at least every keyframe_interval timesteps
+        self._delta_encoders : Dict[str, DeltaEncoder] = {}
+        self._shared_encoder = SharedEncoder() # the shared part of their states, diffed once per timestep
+
+        # players that asked for the binary encoding (see hydro_trader.wire), the codec is made from the first full state
+        self._binary_players : Set[str] = set()
+        self._codec : StateCodec = None
 
         self.game_id = game_id
         self.is_active = False
@@ -86,14 +183,9 @@ class Server:
 
 
     def _create_game(self):
-        
-        sim = Simulation(data_dir="data")
-        sim.create_norwegian_environment()
-        
-        marked = PowerMarked(data_dir="data")
-        game = Game(sim, marked)
-        
-        return game
+        if self.simulation_process is not None:
+            return self.simulation_process.new_game(data_dir="data", engine=self.engine, environment=self.environment)
+        return create_game(data_dir="data", engine=self.engine, data_store=self.data_store, environment=self.environment)
     
     @asynccontextmanager
     async def game_loop_task(self, app: FastAPI):
@@ -117,6 +209,9 @@ class Server:
                     await self._task
                 except asyncio.CancelledError:                    
                     logger.info("Game loop task cancelled")
+            self._tick_executor.shutdown(wait=False)
+            if self.simulation_process is not None:
+                self.simulation_process.close()
 
     async def _run_game_loop(self):
     
@@ -125,58 +220,198 @@ class Server:
             if self.is_active:                                
 
                 if first_timestep_wait:
-                    await asyncio.sleep(self.time_per_step) # first sleep -> extra first round
+                    self.scheduler = TickScheduler(self.time_per_step) # tick boundaries from the start of the game
+                    await self._wait_for_next_timestep() # first wait -> extra first round
                     first_timestep_wait = False
 
                 print("timestep: ", self.game.timestep)
 
                 if self.game.is_game_over():
                     logger.info("Game over")
+                    logger.info("Tick timing: %s", self.scheduler.stats())
                     print("game over: ", self.game.is_game_over())
                     self.is_active = False
                     first_timestep_wait = True
 
 
-                    for player_id in self._players:
-                        self.update_events[player_id].set()
-                        break
-
-
                 # process the productions - if not first timestep
-                self.game.process_timestep()
+                await self._process_timestep()
 
-                # set all events
-                for player_id in self._players:
-                    self.update_events[player_id].set()
+                # wake all player handlers
+                self.tick_notifier.notify()
                 
-                await asyncio.sleep(self.time_per_step) # first sleep 
+                await self._wait_for_next_timestep()
 
 
             else:
                 await asyncio.sleep(0.1)
 
     
-    async def reset_game(self):
+    async def _wait_for_next_timestep(self):
+        """
+        Waits until the next tick boundary (every time_per_step, whatever the tick itself took), or with
+        advance_when_ready only until every connected player has submitted a plan for the next timestep
+        (the boundary is then the deadline for the stragglers)
+        """
+        self.scheduler.period = self.time_per_step
+        await self.scheduler.wait(self._all_submitted if self.advance_when_ready else None)
+
+    def _check_submissions(self):
+        if self._players and self._players.issubset(self._pending_production):
+            self._all_submitted.set()
+
+    async def _process_timestep(self):
+        """
+        Hands the production plans received since the last timestep to the tick thread, which processes the
+        timestep, writes the scoreboard and builds the state for every player
+        """
+        async with self._tick_lock:
+            plans, self._pending_production = self._pending_production, {}
+            self._all_submitted.clear()
+            player_ids = list(self._players)
+            loop = asyncio.get_running_loop()
+            self._payloads = await loop.run_in_executor(self._tick_executor, self._tick, self.game, plans, player_ids, *self._encoders(player_ids))
+            self._tick_count += 1
+
+            if self.is_active:
+                recipients = [player_id for player_id in plans if player_id in self._players and player_id in self._payloads]
+                self.broadcaster.publish({player_id: self._payloads[player_id] for player_id in recipients})
+                for player_id in recipients:
+                    self._last_sent_tick[player_id] = self._tick_count
+
+    def _encoders(self, player_ids):
+        delta_encoders = {player_id: self._delta_encoders[player_id] for player_id in player_ids if player_id in self._delta_encoders}
+        codecs = {player_id: self._codec for player_id in player_ids if player_id in self._binary_players}
+        return delta_encoders, codecs, self._shared_encoder
+
+    @staticmethod
+    def _tick(game: Game, plans, player_ids, delta_encoders, codecs, shared_encoder):
+        """Runs in the tick thread, with a RemoteGame the timestep itself runs in the simulation process"""
+        for player_id, (reservoir_ids, power_price) in plans.items():
+            game.set_production(player_id, reservoir_ids, power_price)
+
+        game.process_timestep()
+
+        # save gamestate, once per timestep (the simulation process does this itself)
+        if isinstance(game, Game):
+            log_scoreboard_to_json(game)
+
+        return Server._encode_payloads(game, player_ids, delta_encoders, codecs, shared_encoder)
+
+    @staticmethod
+    def _encode_payloads(game: Game, player_ids, delta_encoders, codecs, shared_encoder):
+        """The timestep state of every player encoded for its connection: json or binary, full states or deltas"""
+        full_ids = [player_id for player_id in player_ids if player_id not in delta_encoders]
+        payloads = encode_timestep_states(game, [player_id for player_id in full_ids if player_id not in codecs])
+
+        binary_ids = [player_id for player_id in full_ids if player_id in codecs]
+        if binary_ids:
+            payloads.update(encode_binary_timestep_states(game, binary_ids, codecs[binary_ids[0]]))
+
+        if delta_encoders:
+            payloads.update(encode_delta_timestep_states(game, delta_encoders, codecs, shared_encoder))
+        return payloads
+
+    def submit_production(self, player_id, reservoir_ids, power_price):
+        """The production plan of a player for the next timestep"""
+        self._pending_production[player_id] = (reservoir_ids, power_price)
+        self._check_submissions()
+
+        # the player was still thinking when the last timestep was processed, give it that state now
+        if self._last_sent_tick.get(player_id, -1) < self._tick_count and player_id in self._payloads:
+            self._send_state(player_id)
+
+    def _send_state(self, player_id):
+        self.broadcaster.send(player_id, self._payloads[player_id], is_state=True)
+        self._last_sent_tick[player_id] = self._tick_count
+
+    def acknowledge(self, player_id, seq):
+        """The last timestep state a delta player has reconstructed, the next delta is relative to it"""
+        encoder = self._delta_encoders.get(player_id)
+        if encoder is not None:
+            encoder.acknowledge(seq)
+
+    async def _call_game(self, fn, *args):
+        """
+        Runs fn(game, *args) in the tick thread between two timesteps. Everything outside the timestep that reads or
+        changes the game goes through here, with a RemoteGame these are round trips to the simulation process.
+        """
+        async with self._tick_lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._tick_executor, fn, self.game, *args)
+
+    async def set_n_timesteps(self, n_timesteps):
+        await self._call_game(self._set_n_timesteps, n_timesteps)
+
+    @staticmethod
+    def _set_n_timesteps(game: Game, n_timesteps):
+        game.n_timesteps = n_timesteps
+
+    async def send_keyframe(self, player_id):
+        """The current timestep state as a keyframe, for a delta player that could not rebuild its state"""
+        encoder = self._delta_encoders.get(player_id)
+        if encoder is None:
+            return
+        encoder.acknowledge(None) # the client acknowledges nothing until it gets the keyframe
+        payload = (await self._call_game(self._encode_payloads, [player_id], *self._encoders([player_id])))[player_id]
+        self.broadcaster.send(player_id, payload, is_state=True)
+
+    async def game_info(self) -> dict:
+        """The progress of the game, read between two timesteps so the values belong to the same timestep"""
+        return await self._call_game(self._game_info)
+
+    @staticmethod
+    def _game_info(game: Game) -> dict:
+        return {"is_game_over": game.is_game_over(), "n_timesteps": game.n_timesteps, "current_timestep": game.timestep}
+
+    async def scoreboard(self) -> dict:
+        """The cash of the connected players (in millions), read between two timesteps like game_info"""
+        return await self._call_game(self._scoreboard, list(self._players))
+
+    @staticmethod
+    def _scoreboard(game: Game, player_ids) -> dict:
+        cash = game.cash
+        scores = {game.names[player_id]: cash[player_id] / 1_000_000 for player_id in player_ids}
+        return {"scores": scores, "average_power_price": game.average_power_price / 1000.0, "timestep": game.timestep}
+
+    async def reset_game(self, environment:str = None):
+        if environment is not None:
+            load_environment(environment, data_dir="data") # raises before the running game is stopped if the map is not valid
+            self.environment = environment
+
         self.is_active = False
         self.is_accepting_new_players = False
 
-        self.game = self._create_game()
+        async with self._tick_lock:
+            loop = asyncio.get_running_loop()
+            self.game = await loop.run_in_executor(self._tick_executor, self._create_game)
+            self._pending_production = {}
+            self._all_submitted.clear()
+            self._payloads = {}
+            self._delta_encoders = {}
+            self._shared_encoder = SharedEncoder()
+            self._binary_players = set()
+            self._codec = None
+            self._last_sent_tick = {}
 
         self.is_accepting_new_players = True
-        for player_id in self._players:
-            self.update_events[player_id].set()
-            break
+        self.tick_notifier.notify() # the handlers of the old game see that it is not active anymore and stop
 
         self._players = set()
         self._sockets = {}
-        self.update_events = {}
+        self.broadcaster.disconnect_all()
 
         
 
 
 
-    async def setup_player(self, websocket: WebSocket, player_id: str, player_name:str):
-        """Accept a websocket connection from *player_id*."""
+    async def setup_player(self, websocket: WebSocket, player_id: str, player_name:str, delta:bool = False, encoding:str = "json"):
+        """
+        Accept a websocket connection from *player_id*, with delta the timestep states are sent as changes (see hydro_trader.delta),
+        encoding is json (text frames) or binary (see hydro_trader.wire)
+        """
+        if encoding not in ENCODINGS:
+            raise HTTPException(status_code=400, detail="Unknown encoding, expected one of {}".format(ENCODINGS))
                 
         if player_id in self._players:            
             
@@ -190,16 +425,32 @@ class Server:
         else:
 
             logger.info("Player %s connected (%d total)", player_id, len(self._sockets))
-            self.game.add_player(player_id, player_name)        
+            await self._call_game(lambda game: game.add_player(player_id, player_name))
+
+        # a new connection starts from a keyframe
+        self._payloads.pop(player_id, None)
+        if delta:
+            self._delta_encoders[player_id] = DeltaEncoder(keyframe_interval=self.keyframe_interval)
+        else:
+            self._delta_encoders.pop(player_id, None)
+
+        if encoding == "binary":
+            if self._codec is None:
+                # the same ids and order as the full state the client makes its codec from
+                self._codec = StateCodec.from_state(await self._call_game(lambda game: game.get_full_state(player_id)))
+            self._binary_players.add(player_id)
+        else:
+            self._binary_players.discard(player_id)
 
         self._sockets[player_id] = websocket
+        self.broadcaster.connect(player_id, websocket)
         self._players.add(player_id)
-        self.update_events[player_id] = asyncio.Event()
 
 
     async def disconnect(self, player_id):
         
         if player_id in self._players:
+            await self.broadcaster.flush_and_disconnect(player_id)
             try:
                 await self._sockets[player_id].close()
             except Exception:
@@ -208,6 +459,7 @@ class Server:
             del self._sockets[player_id] #            
             logger.info("Player %s disconnected", player_id)
             self._players.remove(player_id)
+            self._check_submissions() # do not wait for a player that left
         
        
     async def send_initial_state(self, player_id: str):    
@@ -215,8 +467,8 @@ class Server:
         if player_id not in self._players:
             raise HTTPException(status_code=400, detail="Invalid player ID")
         
-        state = self.game.get_full_state(player_id)
-        await self._sockets[player_id].send_json(state)
+        state = await self._call_game(lambda game: game.get_full_state(player_id))
+        await self.send_message(player_id, state)
 
         logger.info("Initial state sent to player %s", player_id)
 
@@ -225,8 +477,22 @@ class Server:
         if player_id not in self._players:
             raise HTTPException(status_code=400, detail="Invalid player ID")
         
-        state = self.game.get_timestep_state(player_id)        
-        await self._sockets[player_id].send_json(state)
+        # the state built by the tick thread, a new player gets its first state before any timestep is processed
+        payload = self._payloads.get(player_id)
+        if payload is None:
+            payload = (await self._call_game(self._encode_payloads, [player_id], *self._encoders([player_id])))[player_id]
+
+        self.broadcaster.send(player_id, payload, is_state=True)
+        self._last_sent_tick[player_id] = self._tick_count
+
+    async def send_message(self, player_id: str, message):
+        """Sends any other message in the encoding of the player"""
+        self.broadcaster.send(player_id, packb(message) if player_id in self._binary_players else encode_state(message))
+
+    async def receive_message(self, player_id: str):
+        if player_id in self._binary_players:
+            return unpackb(await self._sockets[player_id].receive_bytes())
+        return await self._sockets[player_id].receive_json()
 
         # logger.info("Timestep state sent to player %s", player_id)
 
@@ -238,7 +504,12 @@ class Server:
 templates = Jinja2Templates(directory="templates")
 
 
-game_server = Server()
+game_server = Server(engine=os.environ.get("HYDRO_TRADER_ENGINE", "object"),
+                     environment=os.environ.get("HYDRO_TRADER_ENVIRONMENT", "norwegian"),
+                     simulation_process=os.environ.get("HYDRO_TRADER_SIMULATION_PROCESS", "0") == "1",
+                     send_policy=os.environ.get("HYDRO_TRADER_SEND_POLICY", "latest"))
+game_server.time_per_step = float(os.environ.get("HYDRO_TRADER_TIME_PER_STEP", game_server.time_per_step))
+game_server.advance_when_ready = os.environ.get("HYDRO_TRADER_ADVANCE_WHEN_READY", "0") == "1"
 app = FastAPI(title="Hydro-Trader Game-Server",
               lifespan=game_server.game_loop_task)
 
@@ -261,21 +532,35 @@ async def root():
     return {"status": "Hydro Trader server is running"}
 
 @app.post("/reset")
-async def reset_game(pwd: str):
+async def reset_game(pwd: str, environment: str = None):
     if pwd != game_server.admin_password:
         raise HTTPException(status_code=403, detail="Invalid password")
-    
-    await game_server.reset_game()
-    return {"status": "Game reset"}
+
+    if environment is not None and environment not in list_environments("data"):
+        raise HTTPException(status_code=400, detail="Unknown environment, expected one of {}".format(list_environments("data")))
+
+    try:
+        await game_server.reset_game(environment)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid environment: {}".format(e))
+
+    return {"status": "Game reset", "environment": game_server.environment}
 
 @app.post("/start")
-async def start_game(pwd: str, num_timesteps:int):
+async def start_game(pwd: str, num_timesteps:int, time_per_step: float = None, advance_when_ready: bool = None):
     
     if pwd != game_server.admin_password:
         raise HTTPException(status_code=403, detail="Invalid password")
+
+    if time_per_step is not None:
+        if time_per_step <= 0:
+            raise HTTPException(status_code=400, detail="time_per_step must be positive")
+        game_server.time_per_step = time_per_step
+    if advance_when_ready is not None:
+        game_server.advance_when_ready = advance_when_ready
     
+    await game_server.set_n_timesteps(num_timesteps)
     game_server.is_active = True
-    game_server.game.n_timesteps = num_timesteps
 
     logger.info("Game started : for {} timesteps".format(num_timesteps))
 
@@ -303,12 +588,14 @@ async def handle_player_interaction(websocket: WebSocket, game_id: str, player_i
         if player_id != player_id_copy:
             raise HTTPException(status_code=400, detail="Invalid player ID")
 
-        await game_server.setup_player(websocket, player_id, player_name)        
+        await game_server.setup_player(websocket, player_id, player_name, delta=bool(player_info.get("delta", False)),
+                                       encoding=player_info.get("encoding", "json"))        
+        seen_tick = game_server.tick_notifier.generation
         await game_server.send_initial_state(player_id)
         await game_server.send_timestep_state(player_id)
 
         # get ready message        
-        ready_msg = await websocket.receive_json()
+        ready_msg = await game_server.receive_message(player_id)
         if ready_msg["status"] != "ready":
             raise HTTPException(status_code=400, detail="Invalid ready message")
         
@@ -317,24 +604,26 @@ async def handle_player_interaction(websocket: WebSocket, game_id: str, player_i
             await asyncio.sleep(0.1)
 
         start_game_event = {"status": "started"}
-        await websocket.send_json(start_game_event)
+        await game_server.send_message(player_id, start_game_event)
         
         while game_server.is_active:            
 
-            input_t = await websocket.receive_json()            
+            input_t = await game_server.receive_message(player_id)            
+            if input_t.get("request") == "keyframe":
+                # a delta player lost the base of its deltas, it sends its plan again when it has the keyframe
+                await game_server.send_keyframe(player_id)
+                continue
+
             production_plan = input_t["reservoir_ids"]
             power_price = input_t["power_price"]
 
-            game_server.game.set_production(player_id, production_plan, power_price)
-            await game_server.update_events[player_id].wait()           
-            if game_server.is_active:
-                await game_server.send_timestep_state(player_id)            
-
-            game_server.update_events[player_id].clear()
-            
-
-            # save gamestate
-            log_scoreboard_to_json(game_server.game)
+            game_server.acknowledge(player_id, input_t.get("ack"))
+            game_server.submit_production(player_id, production_plan, power_price)
+            # the state of the timestep is sent by the broadcaster
+            tick = await game_server.tick_notifier.wait(seen_tick)
+            if tick > seen_tick + 1:
+                logger.debug("Player %s missed %d timesteps", player_id, tick - seen_tick - 1)
+            seen_tick = tick
             await asyncio.sleep(0.01)        
 
         print("<game done>")
@@ -363,7 +652,7 @@ async def admin_post(request: Request, password: str = Form(...)):
         # add info for authenticated users
         n_players = len(game_server._players)
         game_id = game_server.game_id
-        is_game_over = game_server.game.is_game_over()
+        is_game_over = (await game_server.game_info())["is_game_over"]
 
         variables = {"n_players": n_players, "is_game_over": is_game_over, "game_id": game_id}
         variables["request"] = request
@@ -387,7 +676,7 @@ async def admin_start(request: Request, num_timesteps: int = Form(20)):
         # Add info for authenticated users
         n_players = len(game_server._players)
         game_id = game_server.game_id
-        is_game_over = game_server.game.is_game_over()
+        is_game_over = (await game_server.game_info())["is_game_over"]
         
         variables = {
             "request": request, 
@@ -411,18 +700,18 @@ async def admin_game_info(request: Request):
     
     n_players = len(game_server._players)
     game_id = game_server.game_id
-    is_game_over = game_server.game.is_game_over()
-    n_timesteps = game_server.game.n_timesteps
-    current_timestep = game_server.game.timestep
+    info = await game_server.game_info()
     is_active = game_server.is_active
     
     return {
         "n_players": n_players,
         "game_id": game_id,
-        "is_game_over": is_game_over,
-        "n_timesteps": n_timesteps,
-        "current_timestep": current_timestep,
-        "is_active": is_active
+        "is_game_over": info["is_game_over"],
+        "n_timesteps": info["n_timesteps"],
+        "current_timestep": info["current_timestep"],
+        "is_active": is_active,
+        "ticks": game_server.scheduler.stats(),
+        "connections": game_server.broadcaster.stats(),
     }
 
 
@@ -439,9 +728,7 @@ async def admin_reset(request: Request):
         # Add info for authenticated users
         n_players = len(game_server._players)
         game_id = game_server.game_id
-        is_game_over = game_server.game.is_game_over()
-        n_timesteps = game_server.game.n_timesteps
-        current_timestep = game_server.game.timestep
+        info = await game_server.game_info()
         is_active = game_server.is_active
         
         variables = {
@@ -450,9 +737,9 @@ async def admin_reset(request: Request):
             "message": message,
             "n_players": n_players,
             "game_id": game_id,
-            "is_game_over": is_game_over,
-            "n_timesteps": n_timesteps,
-            "current_timestep": current_timestep,
+            "is_game_over": info["is_game_over"],
+            "n_timesteps": info["n_timesteps"],
+            "current_timestep": info["current_timestep"],
             "is_active": is_active
         }
         
@@ -467,15 +754,13 @@ async def admin_reset(request: Request):
 @app.get("/scoreboard")
 async def scoreboard_get(request: Request):
 
-    scores = {}
-    for player_id in game_server._players:
-        name = game_server.game.names[player_id]
-        scores[name] = game_server.game.cash[player_id] / 1_000_000
+    # read between two timesteps, so the scores are all from the same timestep
+    scoreboard = await game_server.scoreboard()
 
     # sort scores
-    sorted_scores = dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
-    power_price = game_server.game.average_power_price / 1000.0
-    timestep = game_server.game.timestep
+    sorted_scores = dict(sorted(scoreboard["scores"].items(), key=lambda item: item[1], reverse=True))
+    power_price = scoreboard["average_power_price"]
+    timestep = scoreboard["timestep"]
 
     # convert timestep to date:
     # timestep 0, is Jan1, year 2010    
@@ -1,17 +1,228 @@
 
 
 import os
+from copy import copy
 from re import I
+
+import numpy as np
+
 from hydro_trader.reservoirs import Reservoir, River, MontainWithSnow
+from hydro_trader.data_store import ForcingDataStore, SharedSeries
+from hydro_trader.network import CompiledNetwork, compile_network
+from hydro_trader.environment import CompiledEnvironment, load_environment
+
+
+def compute_natural_inflow(reservoirs, mountains):
+    """
+    Computes the snow melt and rain (m³) that reaches each reservoir for every timestep.
+    Neither depend on what the players do, only on the data files and the timestep.
+
+    Returns (total, rain, snow_melt) with shapes (timesteps x reservoirs), (timesteps x reservoirs)
+    and (timesteps x mountains), total is the sum of the rain and the snow melt of each reservoir.
+    """
+    n_timesteps = max([len(r.rain_data) for r in reservoirs] + [len(m.data) for m in mountains] + [1])
+    reservoir_index = {id(r): i for i, r in enumerate(reservoirs)}
+
+    # Same as MontainWithSnow.process_timestep : melt when it is above 0°C and the snow height decreased,
+    # the previous snow height of a mountain is always the value of the previous timestep
+    snow_melt = np.zeros((n_timesteps, len(mountains)), dtype=np.float64)
+    for j, mountain in enumerate(mountains):
+        snow_height = mountain.data.snow_height
+        temperature = mountain.data.temperature
+        n = len(mountain.data)
+        if n < 2:
+            continue
+
+        loss_factor = mountain.water_loss_in_transporation.factor
+        f = loss_factor[np.arange(1, n) % len(loss_factor)]
+        is_melting = (temperature[1:] > 0) & (snow_height[:-1] > snow_height[1:])
+        snow_melt[1:n, j] = np.where(is_melting, (snow_height[:-1] - snow_height[1:]) * mountain.snow_area * f, 0.0)
+
+    # Same as Reservoir.process_timestep : rain_height over the basin when it rains
+    rain = np.zeros((n_timesteps, len(reservoirs)), dtype=np.float64)
+    for i, reservoir in enumerate(reservoirs):
+        n = len(reservoir.rain_data)
+        rain[:n, i] = np.where(reservoir.rain_data.is_raining, reservoir.rain_height * reservoir.basin_area, 0.0)
+
+    total = np.zeros((n_timesteps, len(reservoirs)), dtype=np.float64)
+    for j, mountain in enumerate(mountains):
+        total[:, reservoir_index[id(mountain.output_reservoir)]] += snow_melt[:, j]
+    total += rain
+
+    return total, rain, snow_melt
+
 
 class Simulation:
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", data_store:ForcingDataStore=None):
         self.reservoirs = []
         self.rivers = []
         self.mountains = []
 
         self.data_dir = data_dir
 
+        # weather data is read once and shared (not copied) between all copies of the simulation
+        self.data_store = data_store if data_store is not None else ForcingDataStore(data_dir)
+
+        # index based step plan, see compile_network (shared by every fork, it only holds indices)
+        self.network = None
+
+        # (network, natural inflow series, BatchSimulation) used by rollout, built on first use and shared by every fork
+        self._rollout_batch = None
+
+    def compile_network(self) -> CompiledNetwork:
+        """
+        Validates the reservoir/river/mountain graph and compiles the step plan used by simulate_day.
+        Raises ValueError for cycles and references to components that are not part of the simulation.
+        Must be called again if connections are changed, it is called automatically when components are added.
+        """
+        self.network = compile_network(self.reservoirs, self.rivers, self.mountains)
+        return self.network
+
+    def get_network(self) -> CompiledNetwork:
+        network = self.network
+        if network is None or network.shape != (len(self.reservoirs), len(self.rivers), len(self.mountains)):
+            network = self.compile_network()
+        return network
+
+    def precompute_natural_inflow(self):
+        """
+        Computes the rain and snow melt for every reservoir and timestep once, simulate_day then only
+        looks up the inflow. The series are shared by every copy of the simulation.
+        Must be called again if the reservoirs, mountains or their areas are changed.
+        """
+        total, rain, snow_melt = compute_natural_inflow(self.reservoirs, self.mountains)
+
+        for i, reservoir in enumerate(self.reservoirs):
+            reservoir.natural_inflow_data = SharedSeries(total=total[:, i].copy(), rain=rain[:, i].copy())
+
+        for j, mountain in enumerate(self.mountains):
+            mountain.snow_melt_data = SharedSeries(snow_melt=snow_melt[:, j].copy())
+
+    def _components(self):
+        return self.reservoirs + self.rivers + self.mountains
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Captures the dynamic state (water amounts, river queues, mountain snow, counters and timesteps) as a
+        small flat float64 array. The layout only depends on the network, so a snapshot can be restored in
+        any simulation with the same reservoirs, rivers and mountains.
+        """
+        state = []
+        for component in self._components():
+            state += component.get_state()
+
+        return np.array(state, dtype=np.float64)
+
+    def restore(self, snapshot):
+        """Restores the dynamic state from snapshot()"""
+        values = np.asarray(snapshot, dtype=np.float64).tolist()
+        components = self._components()
+
+        if len(values) != sum(c.state_size() for c in components):
+            raise ValueError("Snapshot does not match the simulation, got {} values".format(len(values)))
+
+        i = 0
+        for component in components:
+            n = component.state_size()
+            component.set_state(values[i:i + n])
+            i += n
+
+    def fork(self, snapshot=None) -> "Simulation":
+        """
+        Returns a copy of the simulation with its own dynamic state (from snapshot if given), the
+        static data and data series are shared. Much cheaper than deepcopy.
+        """
+        clone = copy(self)
+        reservoirs = {id(r): copy(r) for r in self.reservoirs}
+        rivers = {id(r): copy(r) for r in self.rivers}
+        mountains = [copy(m) for m in self.mountains]
+
+        for river in rivers.values():
+            river.set_state(river.get_state()) # own queue
+            if river.output_reservoir is not None:
+                river.output_reservoir = reservoirs.get(id(river.output_reservoir), river.output_reservoir)
+
+        for reservoir in reservoirs.values():
+            reservoir.in_rivers = [rivers.get(id(r), r) for r in reservoir.in_rivers]
+            reservoir.out_rivers = [rivers.get(id(r), r) for r in reservoir.out_rivers]
+
+        for mountain in mountains:
+            mountain.output_reservoir = reservoirs.get(id(mountain.output_reservoir), mountain.output_reservoir)
+
+        clone.reservoirs = list(reservoirs.values())
+        clone.rivers = list(rivers.values())
+        clone.mountains = mountains
+
+        if snapshot is not None:
+            clone.restore(snapshot)
+
+        return clone
+
+    def rollout(self, plans, horizon=None) -> dict:
+        """
+        Evaluates a batch of production plans over the next days from the current state, without changing
+        the simulation. All plans are simulated together in one vectorized pass (see BatchSimulation).
+
+        plans: a list of reservoir id lists (produce with the same reservoirs every day), or a bool array
+               (n_plans x reservoirs) or (n_plans x horizon x reservoirs) in the order of self.reservoirs
+        horizon: number of days, required unless the plans are given per day
+
+        Returns a dict with
+            reservoir_ids: the order of the reservoirs in water_amount
+            production_mwh: (n_plans,) total production
+            overflow_penalty: (n_plans,) total river overflow penalty, same unit as simulate_day
+            water_amount: (n_plans x reservoirs) water at the end of the horizon
+        """
+        from hydro_trader.batch import BatchSimulation # batch imports this module
+
+        # The static arrays and padded weather series of the batch only depend on the network and the series, the
+        # batch is built again when the network is compiled again or the natural inflow is precomputed again
+        network = self.get_network()
+        inflow = [r.natural_inflow_data for r in self.reservoirs]
+        cached = getattr(self, "_rollout_batch", None)
+        if cached is None or cached[0] is not network or any(a is not b for a, b in zip(cached[1], inflow)):
+            cached = self._rollout_batch = (network, inflow, BatchSimulation(self))
+
+        batch = cached[2]
+        return batch._rollout(batch._row_from_simulation(self), 0, plans, horizon)
+
+    def apply_timestep_state(self, state, timestep=None):
+        """
+        Sets the water, river flows, snow and weather from a timestep state (Simulation.get_timestep_state or
+        the state a player receives), so a client can keep a local simulation in sync, e.g. for rollout.
+        The river penalty counters are not part of the state and are left as they are.
+
+        timestep: the timestep of the simulation, defaults to state["timestep"] if present
+        """
+        if timestep is None:
+            timestep = state.get("timestep")
+        if timestep is not None:
+            self.set_timestep(timestep)
+
+        for reservoir in self.reservoirs:
+            r_state = state["reservoirs"][reservoir.id]
+            reservoir.water_amount = r_state["water_amount"]
+            reservoir.is_raining = r_state["did_rain"]
+            reservoir.rain_forecast_probability = r_state["forecast_probability"]
+
+        for river in self.rivers:
+            river.set_state(list(state["rivers"][river.id]["flow"]) + river.get_state()[-3:])
+
+        for mountain in self.mountains:
+            m_state = state["mountains"][mountain.id]
+            mountain.current_snow_height = m_state["snow_height"]
+            mountain.temperature = m_state["temperature"]
+
+    def set_timestep(self, timestep):
+        """
+        Moves the weather of every reservoir and mountain to *timestep* (days since 2010-01-01),
+        used to start a game at another date. The water amounts are not changed.
+        """
+        for reservoir in self.reservoirs:
+            reservoir.set_timestep(timestep)
+
+        for mountain in self.mountains:
+            mountain.set_timestep(timestep)
 
     def fill_all_reservoirs(self):
         for reservoir in self.reservoirs:
@@ -126,169 +337,98 @@ class Simulation:
         - Vestarne: Largest reservoir
         - Østarne: Small reservoir
         - Tesselvannet: Medium reservoir
+
+        The parameters are in data/environments/norwegian.json
         """
-        # Ensure data directory exists
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        # Use actual rain data files from data/rain_csv
-        rain_data_path = {
-            "nyfjord": os.path.join(self.data_dir, "nyfjord_rain_data.csv"),
-            "vestarne": os.path.join(self.data_dir, "vestarne_rain_data.csv"),
-            "ostarne": os.path.join(self.data_dir, "østarne_rain_data.csv"),
-            "tesselvannet": os.path.join(self.data_dir,  "tesselvannet_rain_data.csv")
-        }
-        
-        # Verify that all rain data files exist
-        for name, path in rain_data_path.items():
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"Rain data file not found: {path}")
-        
-        # Use existing snow data files from the data/snow_csv directory
-        snow_data_paths = {
-            "kolasnuten": os.path.join(self.data_dir, "Kølasnuten_snow_data.csv"),
-            "bastihoyden_ost": os.path.join(self.data_dir, "Bastihøyden-Øst_snow_data.csv"),
-            "bastihoyden_vest": os.path.join(self.data_dir, "Bastihøyden-Vest_snow_data.csv"),
-            "tobikammen_nord": os.path.join(self.data_dir, "Tobikammen-Nord_snow_data.csv"),
-            "tobikammen_sor": os.path.join(self.data_dir,  "Tobikammen-Sør_snow_data.csv")
-        }
-        
-        # Verify that all snow data files exist
-        for name, path in snow_data_paths.items():
-            if not os.path.exists(path):
-                raise FileNotFoundError(f"Snow data file not found: {path}")
-        
-        # Create the reservoirs
-        # Tesselvannet (Medium)
-        tesselvannet = Reservoir(
-            id="Tesselvannet",
-            rain_data_csv=rain_data_path["tesselvannet"]
-        )
-        tesselvannet.water_area = 5_000_000.0  # 5 km²
-        tesselvannet.basin_area = 15_000_000.0  # 15 km²
-        tesselvannet.capacity = 60_000_000.0  # 60 million m³
-        tesselvannet.water_amount = tesselvannet.capacity * 0.5  # Initial water: 50% full (buffer for overflow)
-        tesselvannet.generator_head_height = 45.0  # 45m head height
-        tesselvannet.max_generator_flow = 55.0  # m³/s (= 9,504,000 m³/day)
-
-        # Østarne (Small)
-        ostarne = Reservoir(
-            id="Østarne",
-            rain_data_csv=rain_data_path["ostarne"]
-        )
-        ostarne.water_area = 2_000_000.0  # 2 km²
-        ostarne.basin_area = 10_000_000.0  # 10 km²
-        ostarne.capacity = 18_000_000.0  # 18 million m³
-        ostarne.water_amount = ostarne.capacity * 0.6  # Initial water: 80% full (immediate opportunity)
-        ostarne.generator_head_height = 35.0  # 35m head height
-        ostarne.max_generator_flow = 25.0  # m³/s (= 3,888,000 m³/day)    
-        
-        # Vestarne (Largest)
-        vestarne = Reservoir(
-            id="Vestarne",
-            rain_data_csv=rain_data_path["vestarne"]
-        )
-        vestarne.water_area = 8_000_000.0  # 8 km²
-        vestarne.basin_area = 28_000_000.0  # 28 km²
-        vestarne.capacity = 120_000_000.0  # 120 million m³
-        vestarne.water_amount = vestarne.capacity * 0.2  # Initial water: 60% full (needs time to fill)
-        vestarne.generator_head_height = 65.0  # 65m head height
-        vestarne.max_generator_flow = 90.0  # m³/s (= 15,552,000 m³/day)
-        
-        # Nyfjord (Small reservoir, large basin)
-        nyfjord = Reservoir(
-            id="Nyfjord",
-            rain_data_csv=rain_data_path["nyfjord"]
-        )
-        nyfjord.water_area = 3_000_000.0  # 3 km²
-        nyfjord.basin_area = 40_000_000.0  # 35 km² (large catchment area)
-        nyfjord.capacity = 30_000_000.0  # 25 million m³
-        nyfjord.water_amount = nyfjord.capacity * 0.8  # Initial water: 70% full (balanced start)
-        nyfjord.generator_head_height = 35.0  # 30m head height
-        nyfjord.max_generator_flow = 30.0  # m³/s (= 5,184,000 m³/day)
-        
-        # Create rivers
-        # Nyfjord -> Vestarne (medium river, 2 days travel time)
-        nyfjord_vestarne_river = River(
-            id="Nyfjord-Vestarne",
-            initial_water=2_000_000.0,  # More realistic initial water
-            length_in_timesteps=20,
-            max_flow=16_000_000.0, 
-            output_reservoir=vestarne
-        )
-        
-        # Both Arne -> Tesselvannet (long river, 3 day travel time)
-        arne_tesselvannet_river = River(
-            id="Arne-Tesselvannet",
-            initial_water=2_200_000.0,  # More realistic initial water
-            length_in_timesteps=6,
-            max_flow=7_500_000.0,
-            output_reservoir=tesselvannet
-        )
-        
-        # Tesselvannet -> Ocean (outlet river, no output reservoir)
-        tesselvannet_ocean_river = River(
-            id="Tesselvannet-Ocean",
-            initial_water=4_000_000.0,  # More realistic initial water
-            length_in_timesteps=4,
-            max_flow=10_000_000.0,  # Can handle most incoming water but will overflow with persistent max production
-            output_reservoir=None  # No reservoir at the end (ocean)
-        )
-        
+        self.create_environment("norwegian")
+
+    def create_environment(self, name="norwegian"):
+        """
+        Creates the reservoir system described by an environment file, name is a file in
+        <data_dir>/environments (without .json) or the path of a json file, see hydro_trader.environment
+        """
+        self.build_environment(load_environment(name, data_dir=self.data_dir))
+
+    def build_environment(self, environment: CompiledEnvironment):
+        """
+        Adds the reservoirs, rivers and mountains of a compiled environment to the simulation
+        """
+        # Verify that all rain and snow data files exist
+        data_paths = {}
+        for item in environment.reservoirs + environment.mountains:
+            for field in ("rain_data", "snow_data"):
+                if field in item:
+                    path = os.path.join(self.data_dir, item[field])
+                    if not os.path.exists(path):
+                        raise FileNotFoundError(f"{field.replace('_', ' ').capitalize()} file not found: {path}")
+                    data_paths[field, item["id"]] = path
+
+        reservoirs = {}
+        for r in environment.reservoirs:
+            reservoir = Reservoir(id=r["id"], rain_data_csv=data_paths["rain_data", r["id"]], data_store=self.data_store)
+            reservoir.water_area = r["water_area"]
+            reservoir.basin_area = r["basin_area"]
+            reservoir.capacity = r["capacity"]
+            reservoir.water_amount = reservoir.capacity * r["initial_fill"]
+            reservoir.generator_head_height = r["generator_head_height"]
+            reservoir.max_generator_flow = r["max_generator_flow"]
+            if "generator_efficiency" in r:
+                reservoir.generator_efficiency = r["generator_efficiency"]
+            if "rain_height" in r:
+                reservoir.rain_height = r["rain_height"]
+            reservoirs[reservoir.id] = reservoir
+
+        rivers = {}
+        for r in environment.rivers:
+            output_reservoir = r.get("output_reservoir")
+            rivers[r["id"]] = River(
+                id=r["id"],
+                initial_water=r["initial_water"],
+                length_in_timesteps=r["length_in_timesteps"],
+                max_flow=r["max_flow"],
+                output_reservoir=reservoirs[output_reservoir] if output_reservoir is not None else None # None is the ocean
+            )
+
         # Connect the reservoirs with their outflow rivers
-        nyfjord.add_outflow_river(nyfjord_vestarne_river)
-        vestarne.add_outflow_river(arne_tesselvannet_river)
-        ostarne.add_outflow_river(arne_tesselvannet_river)
-        tesselvannet.add_outflow_river(tesselvannet_ocean_river)
-        
-        # Add mountains with snow melting according to the specified connections
-        # 1. Kølasnuten -> Nyfjord
-        kolasnuten = MontainWithSnow(
-            id="Kølasnuten",
-            output_reservoir=nyfjord,
-            in_file_csv=snow_data_paths["kolasnuten"]
-        )
-        kolasnuten.snow_area = 3500000.0  # 3.5 km²
-        
-        # 2. Bastihøyden mountains -> Both Østarne and Vestarne
-        bastihoyden_ost = MontainWithSnow(
-            id="Bastihøyden-Øst",
-            output_reservoir=ostarne,
-            in_file_csv=snow_data_paths["bastihoyden_ost"]
-        )
-        bastihoyden_ost.snow_area = 1800000.0  # 1.8 km²
-        
-        bastihoyden_vest = MontainWithSnow(
-            id="Bastihøyden-Vest",
-            output_reservoir=vestarne,
-            in_file_csv=snow_data_paths["bastihoyden_vest"]
-        )
-        bastihoyden_vest.snow_area = 2200000.0  # 2.2 km²
-        
-        # 3. Tobikammen mountains -> Vestarne
-        tobikammen_nord = MontainWithSnow(
-            id="Tobikammen-Nord",
-            output_reservoir=vestarne,
-            in_file_csv=snow_data_paths["tobikammen_nord"]
-        )
-        tobikammen_nord.snow_area = 3000000.0  # 3 km²
-        
-        tobikammen_sor = MontainWithSnow(
-            id="Tobikammen-Sør",
-            output_reservoir=vestarne,
-            in_file_csv=snow_data_paths["tobikammen_sor"]
-        )
-        tobikammen_sor.snow_area = 2800000.0  # 2.8 km²
-        
+        for r in environment.reservoirs:
+            for river_id in r.get("out_rivers", []):
+                reservoirs[r["id"]].add_outflow_river(rivers[river_id])
+
+        mountains = []
+        for m in environment.mountains:
+            mountain = MontainWithSnow(
+                id=m["id"],
+                output_reservoir=reservoirs[m["output_reservoir"]],
+                in_file_csv=data_paths["snow_data", m["id"]],
+                data_store=self.data_store
+            )
+            mountain.snow_area = m["snow_area"]
+            mountains.append(mountain)
+
         # Add all components to the simulation
-        self.reservoirs.extend([nyfjord, ostarne, vestarne, tesselvannet])
-        self.rivers.extend([nyfjord_vestarne_river,arne_tesselvannet_river, tesselvannet_ocean_river])
-        self.mountains.extend([kolasnuten, bastihoyden_ost, bastihoyden_vest, tobikammen_nord, tobikammen_sor])
+        is_empty = not (self.reservoirs or self.rivers or self.mountains)
+        self.reservoirs.extend(reservoirs.values())
+        self.rivers.extend(rivers.values())
+        self.mountains.extend(mountains)
+
+        if is_empty:
+            self.network = environment.network # already compiled
+        else:
+            self.compile_network()
+        self.precompute_natural_inflow()
 
 
     def simulate_day(self, verbose=False):
+        # the compiled plan processes reservoirs upstream first, whatever order they were added in
+        network = self.get_network()
+        reservoirs = self.reservoirs
+        rivers = self.rivers
+        mountains = self.mountains
+
         if verbose:
             print("Processing mountains...")
-        for mountain in self.mountains:
+        for j in network.mountain_order.tolist():
+            mountain = mountains[j]
             snow_melt = mountain.process_timestep()
             if verbose and snow_melt > 0:
                 print(f"  {mountain.id}: {snow_melt:.2f} m³ snow melt at {mountain.temperature:.1f}°C")
@@ -298,13 +438,15 @@ class Simulation:
             print("Processing reservoirs...")
         total_production = 0
         
-        for reservoir in self.reservoirs:
+        for i in network.reservoir_order.tolist():
+            reservoir = reservoirs[i]
             reservoir.process_timestep()
             total_production += reservoir.current_production
             
 
         river_overflow_penalty = 0
-        for river in self.rivers:
+        for k in network.river_order.tolist():
+            river = rivers[k]
             flow, rop = river.process_timestep()
             river_overflow_penalty += river.get_max_flow_penalty()            
 
@@ -312,7 +454,7 @@ class Simulation:
                 print(f"  {river.id}: {flow:.2f} m³/s flow")
 
         # turn off all reservoirs
-        for reservoir in self.reservoirs:
+        for reservoir in reservoirs:
             reservoir.is_producing = False
 
         return total_production, river_overflow_penalty
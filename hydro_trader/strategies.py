@@ -0,0 +1,122 @@
+import importlib
+import itertools
+
+import numpy as np
+
+from hydro_trader.simulation import Simulation
+
+
+class Strategy:
+    """
+    Base class for strategies that play in-process (headless runner and backtests).
+    Same interface as client.Strategy, but without any printing or websocket dependencies.
+
+    # full initial state: self.initial_state
+    # full current state: self.current_state
+    """
+
+    def __init__(self):
+        self.player_id = None
+        self.initial_state = None
+        self.current_state = None
+
+        self.reservoir_ids = []
+
+    def got_initial_state(self):
+        self.reservoir_ids = list(self.initial_state["reservoirs"].keys())
+
+    def get_production_plan_and_power_price(self):
+        """
+        Returns a list of reservoirs to produce and the power price
+        """
+        return {
+            "reservoir_ids": [], # the names of the reservoirs that should produce power
+            "power_price": 0 # the power price
+        }
+
+    def game_over(self):
+        pass
+
+
+class ProduceAllStrategy(Strategy):
+    """
+    Produces with every reservoir every day at a fixed power price (same as the example client)
+    """
+
+    def __init__(self, power_price=2.99):
+        super().__init__()
+        self.power_price = power_price
+
+    def get_production_plan_and_power_price(self):
+        return {"reservoir_ids": list(self.reservoir_ids), "power_price": self.power_price}
+
+
+class FillLevelStrategy(Strategy):
+    """
+    Produces with the reservoirs that are more than min_fill full at a fixed power price
+    """
+
+    def __init__(self, power_price=2.99, min_fill=0.5):
+        super().__init__()
+        self.power_price = power_price
+        self.min_fill = min_fill
+
+    def get_production_plan_and_power_price(self):
+        reservoirs = self.current_state["reservoirs"]
+        reservoir_ids = [r_id for r_id in self.reservoir_ids
+                         if reservoirs[r_id]["water_amount"] > self.min_fill * reservoirs[r_id]["capacity"]]
+
+        return {"reservoir_ids": reservoir_ids, "power_price": self.power_price}
+
+
+class RolloutStrategy(Strategy):
+    """
+    Keeps a local simulation in sync with current_state and uses Simulation.rollout to try every combination
+    of reservoirs for the next *horizon* days, then produces with the combination with the best expected
+    earnings (production at power_price minus overflow penalties).
+
+    Only needs the data directory, so it works both in the headless runner and with client.Client.
+    The timestep of the states is the timestep of the weather data, environment is the map of the game.
+    """
+
+    def __init__(self, power_price=2.99, horizon=7, data_dir="data", penalty_convertion_rate=1_000_000.0,
+                 environment="norwegian"):
+        super().__init__()
+        self.power_price = power_price
+        self.horizon = horizon
+        self.data_dir = data_dir
+        self.penalty_convertion_rate = penalty_convertion_rate
+        self.environment = environment
+
+        self.simulation = None
+        self.plans = []
+
+    def got_initial_state(self):
+        super().got_initial_state()
+
+        self.simulation = Simulation(data_dir=self.data_dir)
+        self.simulation.create_environment(self.environment)
+        self.plans = [list(plan) for n in range(len(self.reservoir_ids) + 1)
+                      for plan in itertools.combinations(self.reservoir_ids, n)]
+
+    def get_production_plan_and_power_price(self):
+        self.simulation.apply_timestep_state(self.current_state)
+
+        result = self.simulation.rollout(self.plans, self.horizon)
+        earnings = result["production_mwh"] * self.power_price * 1000.0 - result["overflow_penalty"] * self.penalty_convertion_rate
+
+        return {"reservoir_ids": self.plans[int(np.argmax(earnings))], "power_price": self.power_price}
+
+
+def load_strategy(name, **kwargs):
+    """
+    Creates a strategy from "module:ClassName" (or just the class name of a strategy in this module),
+    kwargs are passed to the constructor
+    """
+    if ":" in name:
+        module_name, class_name = name.split(":", 1)
+        strategy_class = getattr(importlib.import_module(module_name), class_name)
+    else:
+        strategy_class = globals()[name]
+
+    return strategy_class(**kwargs)
@@ -0,0 +1,216 @@
+import argparse
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from hydro_trader.data_store import ForcingDataStore
+from hydro_trader.environment import compile_environment
+from hydro_trader.game import Game, PowerMarked
+from hydro_trader.simulation import Simulation
+
+
+def generate_environment(n_reservoirs, data_dir="data", seed=0, mountains_per_reservoir=1.0, shared_river_probability=0.2,
+                         max_river_length=30) -> dict:
+    """
+    Generates a random but valid reservoir cascade as an environment definition (same format as the files in
+    data/environments), for scale testing the simulation.
+
+    Reservoirs are created from upstream to downstream, each one flows into a river that ends in a reservoir
+    further down (or in the ocean), so the network is always a set of trees that drain into the ocean.
+    With shared_river_probability a reservoir joins the out river of another reservoir instead (like
+    Vestarne and Østarne share Arne-Tesselvannet). The rain and snow data files in data_dir are reused as forcing.
+    """
+    rng = random.Random(seed)
+
+    data_files = sorted(os.listdir(data_dir))
+    rain_files = [name for name in data_files if name.endswith("_rain_data.csv")]
+    snow_files = [name for name in data_files if name.endswith("_snow_data.csv")]
+    if not rain_files:
+        raise FileNotFoundError("No rain data files found in {}".format(data_dir))
+
+    reservoirs = []
+    for i in range(n_reservoirs):
+        capacity = rng.uniform(10_000_000.0, 120_000_000.0)
+        reservoirs.append({
+            "id": "R{}".format(i),
+            "rain_data": rain_files[i % len(rain_files)],
+            "water_area": capacity / rng.uniform(10.0, 20.0), # 10-20m deep
+            "basin_area": rng.uniform(5_000_000.0, 40_000_000.0),
+            "capacity": capacity,
+            "initial_fill": round(rng.uniform(0.2, 0.8), 2),
+            "generator_head_height": rng.uniform(30.0, 70.0),
+            "max_generator_flow": rng.uniform(20.0, 90.0),
+            "out_rivers": [],
+        })
+
+    # Reservoir i drains into a reservoir with a higher index, the last reservoirs drain into the ocean
+    rivers = []
+    river_of_target = {} # downstream reservoir index (-1 for the ocean) -> rivers ending there
+    for i, reservoir in enumerate(reservoirs):
+        target = rng.randrange(i + 1, n_reservoirs) if i < n_reservoirs - 1 and rng.random() > 0.05 else -1
+
+        if river_of_target.get(target) and rng.random() < shared_river_probability:
+            river = rng.choice(river_of_target[target])
+        else:
+            length = rng.randint(1, max_river_length)
+            river = {
+                "id": "{}-{}".format(reservoir["id"], reservoirs[target]["id"] if target >= 0 else "Ocean"),
+                "initial_water": rng.uniform(0.0, 4_000_000.0),
+                "length_in_timesteps": length,
+                # the flow of a river is all the water on its way, so a longer river can hold more
+                "max_flow": length * rng.uniform(1.0, 3.0) * reservoir["max_generator_flow"] * 86400 / 4,
+                "output_reservoir": reservoirs[target]["id"] if target >= 0 else None,
+            }
+            rivers.append(river)
+            river_of_target.setdefault(target, []).append(river)
+
+        reservoir["out_rivers"].append(river["id"])
+
+    mountains = []
+    if snow_files:
+        for j in range(int(round(n_reservoirs * mountains_per_reservoir))):
+            mountains.append({
+                "id": "M{}".format(j),
+                "snow_data": snow_files[j % len(snow_files)],
+                "snow_area": rng.uniform(1_000_000.0, 4_000_000.0),
+                "output_reservoir": reservoirs[rng.randrange(n_reservoirs)]["id"],
+            })
+
+    return {
+        "name": "Synthetic cascade with {} reservoirs (seed {})".format(n_reservoirs, seed),
+        "reservoirs": reservoirs,
+        "rivers": rivers,
+        "mountains": mountains,
+    }
+
+
+def create_synthetic_game(n_reservoirs, data_dir="data", seed=0, engine="object", data_store:ForcingDataStore=None, **kwargs) -> Game:
+    """
+    Creates a game on a generated network, kwargs are passed to generate_environment
+    """
+    if data_store is None:
+        data_store = ForcingDataStore(data_dir=data_dir)
+
+    environment = compile_environment(generate_environment(n_reservoirs, data_dir=data_dir, seed=seed, **kwargs),
+                                      name="synthetic_{}".format(n_reservoirs))
+    sim = Simulation(data_dir=data_dir, data_store=data_store)
+    sim.build_environment(environment)
+
+    return Game(sim, PowerMarked(data_dir=data_dir, data_store=data_store), engine=engine)
+
+
+def benchmark(n_reservoirs, n_players=4, n_timesteps=20, engine="object", data_dir="data", seed=0) -> dict:
+    """
+    Measures the cost of one game tick (simulation, market and the timestep state of every player, like the
+    server does) and the size of the json payloads on a generated network
+    """
+    data_store = ForcingDataStore(data_dir=data_dir)
+
+    start_time = time.perf_counter()
+    game = create_synthetic_game(n_reservoirs, data_dir=data_dir, seed=seed, engine=engine, data_store=data_store)
+    game.verbose = False
+    game.n_timesteps = n_timesteps + 1
+    for i in range(n_players):
+        game.add_player("player_{}".format(i), "player_{}".format(i))
+    setup_time = time.perf_counter() - start_time
+
+    full_state_bytes = len(json.dumps(game.get_full_state("player_0")))
+
+    rng = random.Random(seed)
+    reservoir_ids = [r.id for r in game.base_simulation.reservoirs]
+
+    simulate_time = 0.0
+    state_time = 0.0
+    timestep_state_bytes = 0
+    for _ in range(n_timesteps):
+        for player_id in game.names:
+            game.set_production(player_id, [r_id for r_id in reservoir_ids if rng.random() < 0.5], 3.0)
+
+        start_time = time.perf_counter()
+        game.process_timestep()
+        simulate_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        states = [game.get_timestep_state(player_id) for player_id in game.names]
+        state_time += time.perf_counter() - start_time
+
+        timestep_state_bytes = len(json.dumps(states[0]))
+
+    n = max(1, n_timesteps)
+    return {
+        "n_reservoirs": n_reservoirs,
+        "n_rivers": len(game.base_simulation.rivers),
+        "n_mountains": len(game.base_simulation.mountains),
+        "n_players": n_players,
+        "engine": engine,
+        "setup_ms": setup_time * 1000,
+        "simulate_ms_per_tick": simulate_time / n * 1000,
+        "state_ms_per_tick": state_time / n * 1000,
+        "full_state_bytes": full_state_bytes,
+        "timestep_state_bytes": timestep_state_bytes,
+    }
+
+
+def memory_per_player(game: Game, n_players=50) -> float:
+    """
+    Bytes allocated for each player added to the game (the player's copy of the dynamic state)
+    """
+    gc.collect()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n_players):
+        game.add_player("memory_{}".format(i), "memory_{}".format(i))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+
+    if not was_tracing:
+        tracemalloc.stop()
+    return (after - before) / n_players
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate large synthetic reservoir networks and measure the cost per tick')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[4, 32, 256, 1024], help='Number of reservoirs (default: 4 32 256 1024)')
+    parser.add_argument('--players', '-p', type=int, default=4, help='Number of players (default: 4)')
+    parser.add_argument('--n_timesteps', '-n', type=int, default=20, help='Number of timesteps per size (default: 20)')
+    parser.add_argument('--engine', nargs='+', default=['object', 'batch'], choices=Game.ENGINES, help='Simulation engines (default: object batch)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--data_dir', default='data', help='Data directory (default: data)')
+    parser.add_argument('--memory', action='store_true', help='Measure the memory per player instead of the time per tick')
+    parser.add_argument('--memory_players', type=int, default=50, help='Number of players added to measure the memory per player (default: 50)')
+    parser.add_argument('--output', '-o', default=None, help='Only write the environment of the first size to this json file, e.g. data/environments/large.json')
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(generate_environment(args.sizes[0], data_dir=args.data_dir, seed=args.seed), f, indent=4, ensure_ascii=False)
+        print("Wrote {}".format(args.output))
+        return
+
+    if args.memory:
+        print("{:>10} {:>7} {:>16}".format("reservoirs", "engine", "bytes/player"))
+        for n_reservoirs in args.sizes:
+            for engine in args.engine:
+                game = create_synthetic_game(n_reservoirs, data_dir=args.data_dir, seed=args.seed, engine=engine)
+                print("{:>10} {:>7} {:>16.0f}".format(n_reservoirs, engine, memory_per_player(game, n_players=args.memory_players)))
+        return
+
+    print("{:>10} {:>7} {:>10} {:>7} {:>10} {:>12} {:>12} {:>14} {:>14}".format(
+        "reservoirs", "rivers", "mountains", "engine", "setup ms", "sim ms/tick", "state ms/tick", "full state kB", "timestep kB"))
+    for n_reservoirs in args.sizes:
+        for engine in args.engine:
+            r = benchmark(n_reservoirs, n_players=args.players, n_timesteps=args.n_timesteps, engine=engine,
+                          data_dir=args.data_dir, seed=args.seed)
+            print("{:>10} {:>7} {:>10} {:>7} {:>10.1f} {:>12.2f} {:>12.2f} {:>14.1f} {:>14.1f}".format(
+                r["n_reservoirs"], r["n_rivers"], r["n_mountains"], r["engine"], r["setup_ms"], r["simulate_ms_per_tick"],
+                r["state_ms_per_tick"], r["full_state_bytes"] / 1000, r["timestep_state_bytes"] / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import struct
+import sys
+from array import array
+
+
+ENCODINGS = ("json", "binary")
+
+FLOAT_ARRAY_EXT = 1 # MessagePack ext type of a float64 array (little endian), used for lists of floats
+COMPONENT_GROUPS = ("reservoirs", "rivers", "mountains")
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+_pack_double = struct.Struct(">d").pack
+_unpack_double = struct.Struct(">d").unpack_from
+
+
+# ---- MessagePack encoding -------------------------------------------------------------------------------------------
+
+def map_header(n) -> bytes:
+    if n < 16:
+        return bytes((0x80 | n,))
+    if n < 0x10000:
+        return b"\xde" + struct.pack(">H", n)
+    return b"\xdf" + struct.pack(">I", n)
+
+
+def array_header(n) -> bytes:
+    if n < 16:
+        return bytes((0x90 | n,))
+    if n < 0x10000:
+        return b"\xdc" + struct.pack(">H", n)
+    return b"\xdd" + struct.pack(">I", n)
+
+
+def _pack_int(value, out):
+    if 0 <= value < 128:
+        out.append(bytes((value,)))
+    elif -32 <= value < 0:
+        out.append(struct.pack("b", value))
+    elif -2**63 <= value < 2**63:
+        out.append(b"\xd3" + struct.pack(">q", value))
+    elif 0 <= value < 2**64:
+        out.append(b"\xcf" + struct.pack(">Q", value))
+    else:
+        raise ValueError("Integer {} is too large for the binary encoding".format(value))
+
+
+def _pack_str(value, out):
+    data = value.encode("utf-8")
+    n = len(data)
+    if n < 32:
+        out.append(bytes((0xa0 | n,)))
+    elif n < 256:
+        out.append(b"\xd9" + bytes((n,)))
+    elif n < 0x10000:
+        out.append(b"\xda" + struct.pack(">H", n))
+    else:
+        out.append(b"\xdb" + struct.pack(">I", n))
+    out.append(data)
+
+
+def _pack_ext(ext_type, data, out):
+    n = len(data)
+    if n < 256:
+        out.append(b"\xc7" + bytes((n, ext_type)))
+    elif n < 0x10000:
+        out.append(b"\xc8" + struct.pack(">Hb", n, ext_type))
+    else:
+        out.append(b"\xc9" + struct.pack(">Ib", n, ext_type))
+    out.append(data)
+
+
+def _pack(value, out):
+    t = type(value)
+    if t is float:
+        out.append(b"\xcb" + _pack_double(value))
+    elif t is str:
+        _pack_str(value, out)
+    elif t is dict:
+        out.append(map_header(len(value)))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    elif t is list or t is tuple:
+        if len(value) > 1 and all(type(v) is float for v in value):
+            # a float series (like the flow of a river) is packed as one block
+            data = array("d", value)
+            if not _LITTLE_ENDIAN:
+                data.byteswap()
+            _pack_ext(FLOAT_ARRAY_EXT, data.tobytes(), out)
+        else:
+            out.append(array_header(len(value)))
+            for item in value:
+                _pack(item, out)
+    elif t is bool:
+        out.append(b"\xc3" if value else b"\xc2")
+    elif t is int:
+        _pack_int(value, out)
+    elif value is None:
+        out.append(b"\xc0")
+    elif t is bytes:
+        n = len(value)
+        out.append((b"\xc4" + bytes((n,))) if n < 256 else (b"\xc5" + struct.pack(">H", n)) if n < 0x10000 else (b"\xc6" + struct.pack(">I", n)))
+        out.append(value)
+    # subclasses, like numpy floats or a defaultdict
+    elif isinstance(value, bool):
+        _pack(bool(value), out)
+    elif isinstance(value, int):
+        _pack(int(value), out)
+    elif isinstance(value, float):
+        _pack(float(value), out)
+    elif isinstance(value, dict):
+        _pack(dict(value), out)
+    elif isinstance(value, (list, tuple)):
+        _pack(list(value), out)
+    else:
+        raise TypeError("Can not encode {!r} in the binary encoding".format(value))
+
+
+def packb(value) -> bytes:
+    """MessagePack encoding of json like values, lists of floats are packed as float64 arrays (ext type 1)"""
+    out = []
+    _pack(value, out)
+    return b"".join(out)
+
+
+def pack_items(d: dict) -> bytes:
+    """The key value pairs of a map without its header, for stitching maps together"""
+    out = []
+    for key, item in d.items():
+        _pack(key, out)
+        _pack(item, out)
+    return b"".join(out)
+
+
+# ---- MessagePack decoding -------------------------------------------------------------------------------------------
+
+def _unpack(data, pos):
+    b = data[pos]
+    pos += 1
+
+    if b < 0x80:
+        return b, pos
+    if b >= 0xe0:
+        return b - 0x100, pos
+    if 0xa0 <= b < 0xc0:
+        n = b & 0x1f
+        return bytes(data[pos:pos + n]).decode("utf-8"), pos + n
+    if 0x80 <= b < 0x90:
+        return _unpack_map(data, pos, b & 0x0f)
+    if 0x90 <= b < 0xa0:
+        return _unpack_array(data, pos, b & 0x0f)
+
+    if b == 0xcb:
+        return _unpack_double(data, pos)[0], pos + 8
+    if b == 0xc0:
+        return None, pos
+    if b == 0xc2:
+        return False, pos
+    if b == 0xc3:
+        return True, pos
+    if b in _FIXED:
+        fmt, size = _FIXED[b]
+        return struct.unpack_from(fmt, data, pos)[0], pos + size
+    if b in (0xd9, 0xda, 0xdb):
+        fmt, size = _LENGTHS[b]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += size
+        return bytes(data[pos:pos + n]).decode("utf-8"), pos + n
+    if b in (0xc4, 0xc5, 0xc6):
+        fmt, size = _LENGTHS[b]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += size
+        return bytes(data[pos:pos + n]), pos + n
+    if b in (0xdc, 0xdd):
+        fmt, size = _LENGTHS[b]
+        return _unpack_array(data, pos + size, struct.unpack_from(fmt, data, pos)[0])
+    if b in (0xde, 0xdf):
+        fmt, size = _LENGTHS[b]
+        return _unpack_map(data, pos + size, struct.unpack_from(fmt, data, pos)[0])
+    if b in (0xc7, 0xc8, 0xc9):
+        fmt, size = _LENGTHS[b]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        ext_type = struct.unpack_from("b", data, pos + size)[0]
+        pos += size + 1
+        if ext_type != FLOAT_ARRAY_EXT:
+            raise ValueError("Unknown ext type {} in the binary encoding".format(ext_type))
+        values = array("d")
+        values.frombytes(data[pos:pos + n])
+        if not _LITTLE_ENDIAN:
+            values.byteswap()
+        return values.tolist(), pos + n
+
+    raise ValueError("Unsupported type byte 0x{:02x} in the binary encoding".format(b))
+
+
+_FIXED = {0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+          0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8), 0xca: (">f", 4)}
+_LENGTHS = {0xd9: (">B", 1), 0xda: (">H", 2), 0xdb: (">I", 4), 0xc4: (">B", 1), 0xc5: (">H", 2), 0xc6: (">I", 4),
+            0xdc: (">H", 2), 0xdd: (">I", 4), 0xde: (">H", 2), 0xdf: (">I", 4), 0xc7: (">B", 1), 0xc8: (">H", 2), 0xc9: (">I", 4)}
+
+
+def _unpack_array(data, pos, n):
+    values = []
+    for _ in range(n):
+        value, pos = _unpack(data, pos)
+        values.append(value)
+    return values, pos
+
+
+def _unpack_map(data, pos, n):
+    d = {}
+    for _ in range(n):
+        key, pos = _unpack(data, pos)
+        d[key], pos = _unpack(data, pos)
+    return d, pos
+
+
+def unpackb(data):
+    data = memoryview(data)
+    value, pos = _unpack(data, 0)
+    if pos != len(data):
+        raise ValueError("{} bytes left after the message".format(len(data) - pos))
+    return value
+
+
+# ---- Game states ----------------------------------------------------------------------------------------------------
+
+class StateCodec:
+    """
+    Binary encoding of the messages of a game, with the reservoirs, rivers and mountains referred to by their
+    index instead of their id.
+
+    Both sides create the codec from the full state sent when a player connects (which is sent as is, so the
+    client learns the ids and their order). In the timestep states (and the keyframes and deltas of
+    hydro_trader.delta) a group with every component is sent as columns, [[field, ...], column, ...] with one
+    value per component in that order, and a group with only some of the components as a map from index to values.
+    """
+
+    def __init__(self, reservoir_ids, river_ids, mountain_ids):
+        self.ids = {"reservoirs": list(reservoir_ids), "rivers": list(river_ids), "mountains": list(mountain_ids)}
+        self.index = {group: {c_id: i for i, c_id in enumerate(ids)} for group, ids in self.ids.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(*(list(state.get(group, {})) for group in COMPONENT_GROUPS))
+
+    def compact(self, state) -> dict:
+        """The state with its component groups by index"""
+        state = dict(state)
+        for group in COMPONENT_GROUPS:
+            components = state.get(group)
+            if isinstance(components, dict):
+                state[group] = self._compact_group(group, components)
+        return state
+
+    def _compact_group(self, group, components):
+        ids = self.ids[group]
+        values = list(components.values())
+        if len(components) == len(ids) and list(components) == ids and values and all(isinstance(v, dict) for v in values):
+            fields = list(values[0])
+            if all(list(v) == fields for v in values):
+                return [fields] + [[v[field] for v in values] for field in fields]
+
+        index = self.index[group]
+        return {index[c_id]: value for c_id, value in components.items()}
+
+    def expand(self, state) -> dict:
+        """The state with its component groups by id again"""
+        state = dict(state)
+        for group in COMPONENT_GROUPS:
+            components = state.get(group)
+            ids = self.ids[group]
+            if isinstance(components, list):
+                fields, columns = components[0], components[1:]
+                state[group] = {c_id: {field: column[i] for field, column in zip(fields, columns)} for i, c_id in enumerate(ids)}
+            elif isinstance(components, dict):
+                state[group] = {ids[i]: value for i, value in components.items()}
+        return state
+
+    def encode(self, message) -> bytes:
+        return packb(self.compact_message(message))
+
+    def decode(self, data):
+        return self.expand_message(unpackb(data))
+
+    def compact_message(self, message):
+        if not isinstance(message, dict):
+            return message
+        if message.get("type") == "keyframe":
+            return dict(message, state=self.compact(message["state"]))
+        if message.get("type") == "delta":
+            return dict(message, changes=self.compact(message["changes"]))
+        return self.compact(message)
+
+    def expand_message(self, message):
+        if not isinstance(message, dict):
+            return message
+        if message.get("type") == "keyframe":
+            return dict(message, state=self.expand(message["state"]))
+        if message.get("type") == "delta":
+            return dict(message, changes=self.expand(message["changes"]))
+        return self.expand(message)
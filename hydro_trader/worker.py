@@ -0,0 +1,381 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from hydro_trader.batch import BatchPlayerView
+from hydro_trader.data_store import ForcingDataStore
+from hydro_trader.game import Game, create_game, log_scoreboard_to_json
+
+
+class StateLayout:
+    """
+    Positions of the per-player timestep values in a row of the shared state buffer (float64).
+
+    Each row is a set of blocks: water_amount, forecast_probability and did_rain per reservoir, the flow profile
+    of every river (in River.water_queue order), snow_height and temperature per mountain, and the cash,
+    production results and total water of the player.
+    """
+
+    def __init__(self, reservoirs, rivers, mountains):
+        """reservoirs: [(id, capacity)], rivers: [(id, length_in_timesteps)], mountains: [id]"""
+        self.reservoirs = [tuple(r) for r in reservoirs]
+        self.rivers = [tuple(r) for r in rivers]
+        self.mountains = list(mountains)
+
+        n_reservoirs = len(self.reservoirs)
+        n_mountains = len(self.mountains)
+
+        offset = 0
+        blocks = {}
+        for name, size in (("water_amount", n_reservoirs), ("forecast_probability", n_reservoirs), ("did_rain", n_reservoirs),
+                           ("flow", sum(length for _, length in self.rivers)), ("snow_height", n_mountains),
+                           ("temperature", n_mountains), ("cash", 1), ("production_price", 1), ("production_amount", 1),
+                           ("total_water_in_m3", 1)):
+            blocks[name] = slice(offset, offset + size)
+            offset += size
+
+        self.blocks = blocks
+        self.row_size = max(offset, 1)
+
+        self.river_slices = []
+        offset = blocks["flow"].start
+        for _, length in self.rivers:
+            self.river_slices.append(slice(offset, offset + length))
+            offset += length
+
+    @classmethod
+    def from_simulation(cls, simulation):
+        return cls([(r.id, float(r.capacity)) for r in simulation.reservoirs],
+                   [(r.id, r.length_in_timesteps) for r in simulation.rivers],
+                   [m.id for m in simulation.mountains])
+
+    def to_tuple(self):
+        return self.reservoirs, self.rivers, self.mountains
+
+    def write_rows(self, rows, game: Game, player_ids, indices):
+        """Writes the timestep values of the players to rows[indices] (runs in the simulation process)"""
+        if not player_ids:
+            return
+
+        b = self.blocks
+        views = [game.simulations[player_id] for player_id in player_ids]
+        if game.batch_simulation is not None and all(isinstance(v, BatchPlayerView) for v in views):
+            # all players at once from the batch arrays
+            batch = game.batch_simulation
+            index = np.array([v.index for v in views], dtype=np.int64)
+            s = batch.state
+            rows[indices, b["water_amount"]] = s["water_amount"][index]
+            rows[indices, b["forecast_probability"]] = s["rain_forecast_probability"][index]
+            rows[indices, b["did_rain"]] = s["is_raining"][index]
+            for k, river_slice in enumerate(self.river_slices):
+                slots = (batch.river_head + np.arange(river_slice.stop - river_slice.start)) % batch.max_length
+                rows[indices, river_slice] = s["water_queue"][index[:, np.newaxis], k, slots]
+            rows[indices, b["snow_height"]] = s["current_snow_height"][index]
+            rows[indices, b["temperature"]] = s["temperature"][index]
+        else:
+            for row_index, sim in zip(indices, views):
+                row = rows[row_index]
+                row[b["water_amount"]] = [r.water_amount for r in sim.reservoirs]
+                row[b["forecast_probability"]] = [r.rain_forecast_probability for r in sim.reservoirs]
+                row[b["did_rain"]] = [r.is_raining for r in sim.reservoirs]
+                for river, river_slice in zip(sim.rivers, self.river_slices):
+                    row[river_slice] = river.water_queue
+                row[b["snow_height"]] = [m.current_snow_height for m in sim.mountains]
+                row[b["temperature"]] = [m.temperature for m in sim.mountains]
+
+        for row_index, player_id, sim in zip(indices, player_ids, views):
+            row = rows[row_index]
+            price, amount = game.power_marked.earnings_report_by_player.get(player_id) or (0.0, 0.0)
+            row[b["cash"]] = game.cash[player_id]
+            row[b["production_price"]] = price
+            row[b["production_amount"]] = amount
+            row[b["total_water_in_m3"]] = sim.get_total_water_in_m3()
+
+    def read_state(self, row) -> dict:
+        """
+        The reservoirs, rivers and mountains of a timestep state from a row (same layout as
+        Simulation.get_timestep_state), read directly from the shared buffer
+        """
+        b = self.blocks
+        water_amount = row[b["water_amount"]].tolist()
+        forecast_probability = row[b["forecast_probability"]].tolist()
+        did_rain = row[b["did_rain"]].tolist()
+        snow_height = row[b["snow_height"]].tolist()
+        temperature = row[b["temperature"]].tolist()
+
+        return {
+            "reservoirs": {
+                r_id: {
+                    "water_amount": water_amount[i],
+                    "capacity": capacity,
+                    "forecast_probability": forecast_probability[i],
+                    "did_rain": did_rain[i] != 0.0,
+                }
+                for i, (r_id, capacity) in enumerate(self.reservoirs)
+            },
+            "rivers": {
+                r_id: {
+                    "flow": row[river_slice].tolist(),
+                }
+                for (r_id, _), river_slice in zip(self.rivers, self.river_slices)
+            },
+            "mountains": {
+                m_id: {
+                    "snow_height": snow_height[j],
+                    "temperature": temperature[j],
+                }
+                for j, m_id in enumerate(self.mountains)
+            },
+            }
+
+
+def _simulation_main(conn):
+    """
+    The simulation process: owns the Game, answers the commands of SimulationProcess and publishes the
+    timestep state of every player into the shared buffer after each change
+    """
+    game = None
+    layout = None
+    shm = None
+    rows = None
+    player_ids = []
+    data_stores = {} # data_dir -> ForcingDataStore, kept between games like the data store of the server
+
+    def publish(players=None):
+        players = player_ids if players is None else players
+        if rows is not None and players:
+            layout.write_rows(rows, game, players, [player_ids.index(p) for p in players])
+
+        return {
+            "timestep": game.timestep,
+            "is_game_over": game.is_game_over(),
+            "marked_demand": game.current_day_production_demand,
+            "sold_power": game.power_marked.accepted_bids,
+            "overflow_penalty": game.current_overflow_penalty,
+            "average_power_price": game.average_power_price,
+        }
+
+    while True:
+        try:
+            command, *args = conn.recv()
+        except EOFError:
+            break
+
+        try:
+            if command == "stop":
+                conn.send(("ok", None))
+                break
+
+            elif command == "new_game":
+                kwargs = dict(args[0])
+                data_dir = kwargs.get("data_dir", "data")
+                if data_dir not in data_stores:
+                    data_stores[data_dir] = ForcingDataStore(data_dir=data_dir)
+                kwargs.setdefault("data_store", data_stores[data_dir])
+                game = create_game(**kwargs)
+                layout = StateLayout.from_simulation(game.base_simulation)
+                player_ids = []
+                result = {"layout": layout.to_tuple(), "n_timesteps": game.n_timesteps, "globals": publish()}
+
+            elif command == "attach":
+                name, capacity = args
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name) # owned (and unlinked) by the web process
+                rows = np.ndarray((capacity, layout.row_size), dtype=np.float64, buffer=shm.buf)
+                result = publish()
+
+            elif command == "add_player":
+                player_id, player_name = args
+                game.add_player(player_id, player_name)
+                if player_id not in player_ids:
+                    player_ids.append(player_id)
+                result = publish()
+
+            elif command == "tick":
+                for player_id, (reservoir_ids, power_price) in args[0].items():
+                    game.set_production(player_id, reservoir_ids, power_price)
+                game.process_timestep()
+                log_scoreboard_to_json(game)
+                result = publish()
+
+            elif command == "full_state":
+                result = game.get_full_state(args[0])
+
+            elif command == "set_n_timesteps":
+                game.n_timesteps = args[0]
+                result = publish([])
+
+            else:
+                raise ValueError("Unknown command: {}".format(command))
+
+            conn.send(("ok", result))
+
+        except Exception as e:
+            conn.send(("error", "{}: {}".format(type(e).__name__, e)))
+
+    if shm is not None:
+        rows = None
+        shm.close()
+
+
+class SimulationProcess:
+    """
+    Runs the Game in a separate process, so the simulation does not share the GIL with json encoding and
+    websocket I/O in the web process.
+
+    Commands and production plans are sent over a pipe, the timestep state of every player is published into a
+    multiprocessing.shared_memory buffer (one float64 row per player, see StateLayout) that the web process
+    reads directly when it builds the player states. The web process owns the buffer.
+    """
+
+    def __init__(self, capacity=64):
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_simulation_main, args=(child_conn,), daemon=True, name="hydro_trader_simulation")
+        self.process.start()
+        child_conn.close()
+
+        self._call_lock = threading.Lock() # a command and its reply are one round trip on the pipe
+        self.initial_capacity = capacity
+        self.capacity = 0
+        self.shm = None
+        self.rows = None
+        self.layout = None
+
+    def call(self, command, *args):
+        with self._call_lock:
+            self._conn.send((command, *args))
+            status, result = self._conn.recv()
+        if status != "ok":
+            raise RuntimeError("Simulation process: {}".format(result))
+        return result
+
+    def new_game(self, **kwargs) -> "RemoteGame":
+        """Creates a game in the simulation process, kwargs are passed to create_game"""
+        result = self.call("new_game", kwargs)
+        self.layout = StateLayout(*result["layout"])
+        self.allocate(self.initial_capacity)
+        return RemoteGame(self, result["n_timesteps"], result["globals"])
+
+    def allocate(self, capacity):
+        """(Re)allocates the shared buffer for *capacity* players and lets the simulation process attach to it"""
+        old_shm = self.shm
+
+        self.rows = None
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity * self.layout.row_size * 8)
+        self.rows = np.ndarray((capacity, self.layout.row_size), dtype=np.float64, buffer=self.shm.buf)
+        self.capacity = capacity
+        globals_ = self.call("attach", self.shm.name, capacity)
+
+        if old_shm is not None:
+            old_shm.close()
+            old_shm.unlink()
+        return globals_
+
+    def close(self):
+        try:
+            if self.process.is_alive():
+                self.call("stop")
+        except (OSError, EOFError, RuntimeError):
+            pass
+        self.process.join(timeout=5)
+
+        self.rows = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class RemoteGame:
+    """
+    Stand-in for a Game that lives in a SimulationProcess, with the part of the Game interface the server uses.
+    Timestep states are built from the shared buffer, without asking the simulation process.
+    """
+
+    def __init__(self, process: SimulationProcess, n_timesteps, globals_):
+        self.process = process
+        self._n_timesteps = n_timesteps
+        self._globals = globals_
+
+        self.names = {} # player_id -> player_name, in the order of the rows
+        self._rows = {} # player_id -> row index
+        self._production = {}
+
+    @property
+    def timestep(self):
+        return self._globals["timestep"]
+
+    @property
+    def n_timesteps(self):
+        return self._n_timesteps
+
+    @n_timesteps.setter
+    def n_timesteps(self, value):
+        self._globals = self.process.call("set_n_timesteps", value)
+        self._n_timesteps = value
+
+    @property
+    def average_power_price(self):
+        return self._globals["average_power_price"]
+
+    @property
+    def cash(self):
+        cash_block = self.process.layout.blocks["cash"].start
+        return {player_id: float(self.process.rows[row, cash_block]) for player_id, row in self._rows.items()}
+
+    def is_game_over(self):
+        return self._globals["is_game_over"]
+
+    def add_player(self, player_id, player_name):
+        if player_id not in self._rows and len(self._rows) >= self.process.capacity:
+            self.process.allocate(self.process.capacity * 2)
+
+        self._globals = self.process.call("add_player", player_id, player_name)
+        self.names[player_id] = player_name
+        self._rows.setdefault(player_id, len(self._rows))
+
+    def set_production(self, player_id, reservoir_ids, price_of_power):
+        self._production[player_id] = (list(reservoir_ids), price_of_power)
+
+    def process_timestep(self):
+        plans, self._production = self._production, {}
+        self._globals = self.process.call("tick", plans)
+
+    def get_full_state(self, player_id):
+        return self.process.call("full_state", player_id)
+
+    def get_timestep_state(self, player_id):
+        d = self.get_player_timestep_state(player_id)
+        d.update(self.get_shared_timestep_state())
+        d["other_players"] = [self.get_player_summary(other_player_id) for other_player_id in self._rows if other_player_id != player_id]
+        return d
+
+    def get_player_timestep_state(self, player_id):
+        b = self.process.layout.blocks
+        row = self.process.rows[self._rows[player_id]]
+
+        d = self.process.layout.read_state(row)
+        d["cash"] = float(row[b["cash"].start])
+        d["production_results"] = {"price": float(row[b["production_price"].start]), "amount": float(row[b["production_amount"].start])}
+        return d
+
+    def get_shared_timestep_state(self):
+        g = self._globals
+        return {
+            "marked_demand": g["marked_demand"],
+            "sold_power": g["sold_power"],
+            "overflow_penalty": g["overflow_penalty"],
+            "average_power_price": g["average_power_price"],
+            "is_game_over": g["is_game_over"],
+            "timestep": g["timestep"],
+        }
+
+    def get_player_summary(self, player_id):
+        b = self.process.layout.blocks
+        row = self.process.rows[self._rows[player_id]]
+        return {"name": self.names[player_id], "player_id": player_id, "cash": float(row[b["cash"].start]),
+                "total_water_in_m3": float(row[b["total_water_in_m3"].start])}
@@ -7,6 +7,8 @@ def main():
     parser.add_argument('--password', '-p', required=True, help='Password for authentication')
     parser.add_argument('--host', default='http://localhost:8000', help='Server host (default: http://localhost:8000)')    
     parser.add_argument('--n_timesteps', '-n', type=int, default=20, help='Number of timesteps (default: 20)')
+    parser.add_argument('--time_per_step', '-t', type=float, default=None, help='Seconds per timestep (default: the server setting)')
+    parser.add_argument('--advance_when_ready', action='store_true', help='Advance as soon as every player has submitted, time_per_step is then the deadline')
     
     # Parse arguments
     args = parser.parse_args()
@@ -14,6 +16,10 @@ def main():
     # Prepare the request
     url = f"{args.host}/start"
     params = {"pwd": args.password, "num_timesteps": args.n_timesteps}  # Changed from JSON body to query parameter
+    if args.time_per_step is not None:
+        params["time_per_step"] = args.time_per_step
+    if args.advance_when_ready:
+        params["advance_when_ready"] = True
     
     try:
         # Call the /start endpoint
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from hydro_trader.broadcast import Broadcaster, Connection
+
+
+class SlowWebSocket:
+    """Blocks every send until released, records what was sent"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.release = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.release.wait()
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+class BrokenWebSocket(SlowWebSocket):
+    async def send_text(self, text):
+        raise RuntimeError("connection reset")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def test_latest_policy_skips_to_the_latest_state():
+    async def main():
+        broadcaster = Broadcaster(max_queue=3, policy="latest")
+        websocket = SlowWebSocket()
+        connection = broadcaster.connect("p1", websocket)
+
+        broadcaster.send("p1", "started")
+        await asyncio.sleep(0) # the writer takes "started" and waits on the socket
+        broadcaster.send("p1", "full state")
+        broadcaster.publish({"p1": "state 1", "unknown": "ignored"})
+        broadcaster.publish({"p1": "state 2"})
+        broadcaster.publish({"p1": "state 3"})
+        broadcaster.send("p1", b"binary state", is_state=True)
+
+        # only the newest state is queued, the other message is never replaced
+        assert [payload for payload, _ in connection.queue] == ["full state", b"binary state"]
+        assert connection.n_skipped == 3
+
+        websocket.release.set()
+        await connection.flush()
+        assert websocket.sent == ["started", "full state", b"binary state"]
+        assert broadcaster.stats() == {"policy": "latest", "max_queue": 3, "connections": 1, "queued": 0, "sent": 3,
+                                       "skipped": 3, "dropped": 0, "closed": 0}
+        broadcaster.disconnect_all()
+
+    run(main)
+
+
+def test_drop_policy_drops_a_slow_player():
+    async def main():
+        broadcaster = Broadcaster(max_queue=2, policy="drop")
+        slow, fast = SlowWebSocket(), SlowWebSocket()
+        fast.release.set()
+        broadcaster.connect("slow", slow)
+        broadcaster.connect("fast", fast)
+
+        sent = []
+        for i in range(4):
+            broadcaster.publish({"slow": "state {}".format(i), "fast": "state {}".format(i)})
+            sent.append(broadcaster.send("slow", "ping"))
+            await asyncio.sleep(0)
+
+        # the writer holds state 0, state 0's ping and state 1 fill the queue, the next message drops the player
+        assert sent == [True, False, False, False]
+        assert "slow" not in broadcaster.connections
+        await asyncio.sleep(0)
+        assert slow.closed and slow.sent == []
+
+        assert fast.sent == ["state 0", "state 1", "state 2", "state 3"]
+        stats = broadcaster.stats()
+        assert (stats["connections"], stats["dropped"], stats["closed"], stats["skipped"]) == (1, 1, 0, 0)
+        broadcaster.disconnect_all()
+
+    run(main)
+
+
+def test_closed_socket_is_not_counted_as_dropped():
+    async def main():
+        broadcaster = Broadcaster(max_queue=2, policy="drop")
+        broadcaster.connect("p1", BrokenWebSocket())
+
+        assert broadcaster.send("p1", "state", is_state=True)
+        await asyncio.sleep(0) # the writer fails on the socket and closes the connection
+        assert not broadcaster.send("p1", "next state", is_state=True)
+
+        stats = broadcaster.stats()
+        assert (stats["connections"], stats["dropped"], stats["closed"]) == (0, 0, 1)
+
+    run(main)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Broadcaster(policy="block")
+    with pytest.raises(ValueError):
+        asyncio.run(_connection_with_policy("block"))
+
+
+async def _connection_with_policy(policy):
+    return Connection(SlowWebSocket(), policy=policy)
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from hydro_trader.client import Client
+from hydro_trader.delta import DeltaEncoder
+
+
+class FakeWebSocket:
+    """Replays the given messages and records what the client sends"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def recv(self):
+        return json.dumps(self.messages.pop(0))
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def _state(timestep):
+    return {"timestep": timestep, "cash": 10.0 * timestep, "is_game_over": False, "reservoirs": {"r1": {"water_amount": 1.0 + timestep}}}
+
+
+def test_lost_delta_base_waits_for_a_keyframe():
+    encoder = DeltaEncoder()
+    encoder.encode(_state(0)) # keyframe seq 1
+    encoder.acknowledge(1)
+    lost_delta = encoder.encode(_state(1)) # seq 2, relative to seq 1 that the client does not have
+    encoder.acknowledge(2)
+    next_delta = encoder.encode(_state(2)) # still on the way when the client asks for a keyframe
+    encoder.acknowledge(None) # the server got the request
+    keyframe = encoder.encode(_state(2))
+
+    client = Client(strategy=None, uri="ws://test", player_name="test", game_id="game1", delta=True)
+    client.websocket = FakeWebSocket([lost_delta, next_delta, keyframe])
+
+    state = asyncio.run(client.recv_state())
+
+    assert state == _state(2)
+    assert client.websocket.sent == [{"request": "keyframe"}]
+    assert client.decoder.ack == keyframe["seq"]
+
+    # the next delta is relative to the keyframe again
+    encoder.acknowledge(client.decoder.ack)
+    after_keyframe = encoder.encode(_state(3))
+    assert after_keyframe["type"] == "delta"
+    client.websocket.messages.append(after_keyframe)
+    assert asyncio.run(client.recv_state()) == _state(3)
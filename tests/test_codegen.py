@@ -0,0 +1,56 @@
+import os
+import pickle
+import random
+
+from hydro_trader.codegen import StepProgram, check_step_equivalence
+from hydro_trader.game import create_game
+from hydro_trader.simulation import Simulation
+from hydro_trader.synthetic import create_synthetic_game
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def _norwegian():
+    simulation = Simulation(data_dir=DATA_DIR)
+    simulation.create_environment("norwegian")
+    return simulation
+
+
+def test_step_equivalence_norwegian():
+    assert check_step_equivalence(_norwegian(), n_days=400)
+
+
+def test_step_equivalence_synthetic():
+    simulation = create_synthetic_game(24, data_dir=DATA_DIR, seed=3).base_simulation
+    assert check_step_equivalence(simulation, n_days=200, seed=1)
+
+
+def test_step_program_is_reusable():
+    simulation = _norwegian()
+    program = StepProgram(simulation)
+    assert check_step_equivalence(simulation, n_days=50, seed=1, program=program)
+    assert check_step_equivalence(simulation, n_days=50, seed=2, program=program)
+
+
+def test_compiled_game_matches_object_game():
+    """The compiled engine plays a whole game like the object engine, also after a pickle round trip"""
+    games = {engine: create_game(data_dir=DATA_DIR, engine=engine) for engine in ("object", "compiled")}
+    rng = random.Random(0)
+    reservoir_ids = [r.id for r in games["object"].base_simulation.reservoirs]
+
+    for game in games.values():
+        game.verbose = False
+        game.add_player("player_0", "player_0")
+
+    for timestep in range(60):
+        if timestep == 30:
+            games["compiled"] = pickle.loads(pickle.dumps(games["compiled"]))
+
+        plan = [r_id for r_id in reservoir_ids if rng.random() < 0.5]
+        for game in games.values():
+            game.set_production("player_0", plan, 2.5)
+            game.process_timestep()
+
+        assert games["compiled"].get_timestep_state("player_0") == games["object"].get_timestep_state("player_0")
+    assert games["compiled"].cash == games["object"].cash
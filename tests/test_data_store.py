@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+
+from hydro_trader.data_store import ForcingDataStore
+
+
+def _write_snow(path, temperatures, mtime_ns):
+    with open(path, "w") as f:
+        f.write("Temperature,SnowHeight\n")
+        for i, temperature in enumerate(temperatures):
+            f.write("{},{}\n".format(temperature, float(i)))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _cache_files(store):
+    with open(os.path.join(store.cache_dir, "manifest.json")) as f:
+        entry = json.load(f)["files"]["snow.csv"]
+    return [os.path.join(store.cache_dir, name) for name in entry["columns"].values()]
+
+
+def test_cache_is_memory_mapped(tmp_path):
+    path = str(tmp_path / "snow.csv")
+    _write_snow(path, [1.5, -2.0, 3.25], 1_000_000_000)
+
+    assert ForcingDataStore(str(tmp_path)).build_cache() == 1
+
+    series = ForcingDataStore(str(tmp_path)).snow(path)
+    assert isinstance(series.temperature.base, np.memmap)
+    assert series.temperature.tolist() == [1.5, -2.0, 3.25]
+    assert series.snow_height.tolist() == [0.0, 1.0, 2.0]
+    assert not series.temperature.flags.writeable
+
+
+def test_changed_csv_is_rebuilt(tmp_path):
+    path = str(tmp_path / "snow.csv")
+    _write_snow(path, [1.5, -2.0, 3.25], 1_000_000_000)
+    old_series = ForcingDataStore(str(tmp_path)).snow(path)
+
+    # same size, only the content and the modification time differ
+    _write_snow(path, [7.5, -4.0, 1.25], 2_000_000_000)
+    series = ForcingDataStore(str(tmp_path)).snow(path)
+
+    assert series.temperature.tolist() == [7.5, -4.0, 1.25]
+    assert ForcingDataStore(str(tmp_path)).snow(path).temperature.tolist() == [7.5, -4.0, 1.25]
+    # the cache files were replaced, not overwritten, so the old mapping still has the old values
+    assert old_series.temperature.tolist() == [1.5, -2.0, 3.25]
+
+    # a different size is rebuilt as well
+    _write_snow(path, [1.0, 2.0, 3.0, 4.0], 2_000_000_000)
+    assert ForcingDataStore(str(tmp_path)).snow(path).temperature.tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_touched_csv_is_not_rebuilt(tmp_path):
+    path = str(tmp_path / "snow.csv")
+    _write_snow(path, [1.5, -2.0, 3.25], 1_000_000_000)
+    store = ForcingDataStore(str(tmp_path))
+    store.build_cache()
+    cache_mtimes = [os.stat(p).st_mtime_ns for p in _cache_files(store)]
+
+    # same content with a new modification time (like after a git checkout): the sha256 still matches
+    os.utime(path, ns=(3_000_000_000, 3_000_000_000))
+    series = ForcingDataStore(str(tmp_path)).snow(path)
+
+    assert series.temperature.tolist() == [1.5, -2.0, 3.25]
+    assert [os.stat(p).st_mtime_ns for p in _cache_files(store)] == cache_mtimes
+    with open(os.path.join(store.cache_dir, "manifest.json")) as f:
+        assert json.load(f)["files"]["snow.csv"]["mtime_ns"] == 3_000_000_000
+
+
+def test_broken_cache_file_is_rebuilt(tmp_path):
+    path = str(tmp_path / "snow.csv")
+    _write_snow(path, [1.5, -2.0, 3.25], 1_000_000_000)
+    store = ForcingDataStore(str(tmp_path))
+    store.build_cache()
+
+    for cache_file in _cache_files(store):
+        with open(cache_file, "wb") as f:
+            f.write(b"not a npy file")
+
+    assert ForcingDataStore(str(tmp_path)).snow(path).temperature.tolist() == [1.5, -2.0, 3.25]
+    assert ForcingDataStore(str(tmp_path)).snow(path).temperature.tolist() == [1.5, -2.0, 3.25]
@@ -0,0 +1,158 @@
+import json
+import os
+
+from hydro_trader.delta import DeltaDecoder, DeltaEncoder, SharedEncoder, apply_delta, diff_list, diff_state
+from hydro_trader.game import create_game
+from hydro_trader.server import encode_delta_timestep_states, encode_state
+from hydro_trader.wire import StateCodec
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def test_diff_list_shifts():
+    old = [1.0, 2.0, 3.0, 4.0]
+
+    assert diff_list(old, [0.5, 1.0, 2.0, 3.0]) == {"shift": 1, "values": [0.5]}
+    assert diff_list(old, [7.0, 8.0, 1.0, 2.0]) == {"shift": 2, "values": [7.0, 8.0]}
+    assert diff_list(old, [2.0, 3.0, 4.0, 5.0]) == {"shift": -1, "values": [5.0]}
+    assert diff_list(old, [4.0, 5.0, 6.0, 7.0]) == {"shift": -3, "values": [5.0, 6.0, 7.0]}
+
+    assert diff_list(old, [1.0, 2.0, 9.0, 4.0]) is None
+    assert diff_list(old, [0.0, 1.0, 2.0]) is None # not the same length
+
+
+def test_apply_delta_round_trip():
+    old = {"timestep": 3, "cash": 1.5, "reservoirs": {"r1": {"water_amount": 10.0, "capacity": 100.0}, "r2": {"water_amount": 5.0, "capacity": 50.0}},
+           "rivers": {"river1": {"flow": [1.0, 2.0, 3.0, 4.0]}}, "sold_power": [[1.0, 2.0]]}
+    new = {"timestep": 4, "cash": 1.5, "reservoirs": {"r1": {"water_amount": 12.0, "capacity": 100.0}, "r2": {"water_amount": 5.0, "capacity": 50.0}},
+           "rivers": {"river1": {"flow": [0.5, 1.0, 2.0, 3.0]}}, "sold_power": []}
+
+    changes = diff_state(old, new)
+    assert changes == {"timestep": 4, "reservoirs": {"r1": {"water_amount": 12.0}},
+                       "rivers": {"river1": {"flow": {"shift": 1, "values": [0.5]}}}, "sold_power": []}
+    assert apply_delta(old, changes) == new
+    assert old["reservoirs"]["r1"]["water_amount"] == 10.0 # old is not modified
+
+    # a shift survives the json encoding
+    assert apply_delta(old, json.loads(json.dumps(changes))) == new
+
+    assert diff_state(old, dict(new, extra=1)) is None # other keys need a keyframe
+
+
+def test_static_fields_are_not_diffed():
+    old = {"reservoirs": {"r1": {"water_amount": 1.0, "capacity": 100.0}}}
+    new = {"reservoirs": {"r1": {"water_amount": 2.0, "capacity": 200.0}}}
+
+    assert diff_state(old, new) == {"reservoirs": {"r1": {"water_amount": 2.0}}}
+
+
+def _state(timestep):
+    return {"timestep": timestep, "cash": 10.0 * timestep, "reservoirs": {"r1": {"water_amount": 1.0 + timestep, "capacity": 100.0}},
+            "rivers": {"river1": {"flow": [float(timestep - i) for i in range(4)]}}}
+
+
+def test_keyframe_interval():
+    encoder = DeltaEncoder(keyframe_interval=3)
+    decoder = DeltaDecoder()
+
+    types = []
+    for timestep in range(9):
+        message = encoder.encode(_state(timestep))
+        types.append(message["type"])
+        assert decoder.decode(message) == _state(timestep)
+        encoder.acknowledge(decoder.ack)
+
+    assert types == ["keyframe", "delta", "delta", "delta"] * 2 + ["keyframe"]
+
+
+def test_delta_relative_to_the_acknowledged_state():
+    encoder = DeltaEncoder()
+    decoder = DeltaDecoder()
+
+    decoder.decode(encoder.encode(_state(0)))
+    encoder.acknowledge(decoder.ack)
+
+    # the client is slow, it still acknowledges seq 1 when the next states are encoded
+    skipped = encoder.encode(_state(1))
+    message = encoder.encode(_state(2))
+    assert skipped["base"] == message["base"] == 1
+    assert decoder.decode(message) == _state(2)
+
+    encoder.acknowledge(decoder.ack)
+    message = encoder.encode(_state(3))
+    assert message["base"] == 3
+    assert decoder.decode(message) == _state(3)
+
+
+def test_acknowledged_state_out_of_the_history_gives_a_keyframe():
+    encoder = DeltaEncoder(history=4)
+    decoder = DeltaDecoder()
+
+    decoder.decode(encoder.encode(_state(0)))
+    encoder.acknowledge(decoder.ack)
+
+    for timestep in range(1, 4):
+        assert encoder.encode(_state(timestep))["type"] == "delta"
+
+    # seq 1 is the oldest of the last 4 states, with the next state it is gone
+    message = encoder.encode(_state(4))
+    assert message["type"] == "keyframe"
+    assert decoder.decode(message) == _state(4)
+
+
+def test_decoder_history():
+    encoder = DeltaEncoder()
+    decoder = DeltaDecoder(history=2)
+
+    for timestep in range(3):
+        decoder.decode(encoder.encode(_state(timestep)))
+        encoder.acknowledge(decoder.ack)
+
+    assert sorted(decoder.states) == [2, 3]
+
+
+def _game(n_players=3):
+    game = create_game(data_dir=DATA_DIR)
+    game.verbose = False
+    for i in range(n_players):
+        game.add_player("player_{}".format(i), "player_{}".format(i))
+    return game
+
+
+def _play(game, timestep):
+    for i, player_id in enumerate(game.names):
+        reservoir_ids = list(game.get_timestep_state(player_id)["reservoirs"])[:i + timestep % 2]
+        game.set_production(player_id, reservoir_ids, 2.0 + i)
+    game.process_timestep()
+
+
+def test_stitched_deltas_match_the_full_states():
+    game = _game()
+    player_ids = list(game.names)
+    codec = StateCodec.from_state(game.get_full_state(player_ids[0]))
+    codecs = {player_ids[1]: codec} # one binary player, the others get json
+
+    stitched = {player_id: DeltaEncoder(keyframe_interval=5) for player_id in player_ids}
+    reference = {player_id: DeltaEncoder(keyframe_interval=5) for player_id in player_ids}
+    decoders = {player_id: DeltaDecoder() for player_id in player_ids}
+    shared_encoder = SharedEncoder()
+
+    for timestep in range(12):
+        payloads = encode_delta_timestep_states(game, stitched, codecs, shared_encoder)
+
+        for player_id in player_ids:
+            message = reference[player_id].encode(game.get_timestep_state(player_id))
+            expected = codec.encode(message) if player_id in codecs else encode_state(message)
+            assert payloads[player_id] == expected
+
+            decoded = codec.decode(payloads[player_id]) if player_id in codecs else json.loads(payloads[player_id])
+            state = decoders[player_id].decode(decoded)
+            assert state == json.loads(encode_state(game.get_timestep_state(player_id)))
+
+            # player_0 acknowledges every other state only, its deltas have older bases
+            if player_id != player_ids[0] or timestep % 2 == 0:
+                stitched[player_id].acknowledge(decoders[player_id].ack)
+                reference[player_id].acknowledge(decoders[player_id].ack)
+
+        _play(game, timestep)
@@ -0,0 +1,120 @@
+import copy
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from hydro_trader import environment
+from hydro_trader.environment import NETWORK_ARRAYS, compile_environment, load_environment
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+DEFINITION = {
+    "name": "two lakes",
+    "reservoirs": [
+        {"id": "Upper", "rain_data": "nyfjord_rain_data.csv", "water_area": 1000000.0, "basin_area": 2000000.0,
+         "capacity": 5000000, "initial_fill": 0.5, "generator_head_height": 20.0, "max_generator_flow": 10.0,
+         "out_rivers": ["Upper-Lower"]},
+        {"id": "Lower", "rain_data": "vestarne_rain_data.csv", "water_area": 1000000.0, "basin_area": 2000000.0,
+         "capacity": 5000000, "initial_fill": 0.5, "generator_head_height": 20.0, "max_generator_flow": 10.0,
+         "out_rivers": ["Lower-Ocean"]},
+    ],
+    "rivers": [
+        {"id": "Upper-Lower", "initial_water": 1000.0, "length_in_timesteps": 3, "max_flow": 100000.0, "output_reservoir": "Lower"},
+        {"id": "Lower-Ocean", "initial_water": 0.0, "length_in_timesteps": 1, "max_flow": 100000.0, "output_reservoir": None},
+    ],
+    "mountains": [
+        {"id": "Peak", "snow_data": "Kølasnuten_snow_data.csv", "snow_area": 100000.0, "output_reservoir": "Upper"},
+    ],
+}
+
+
+def _changed(change):
+    definition = copy.deepcopy(DEFINITION)
+    change(definition)
+    return definition
+
+
+@pytest.mark.parametrize("definition, message", [
+    ([], "must be a json object"),
+    (_changed(lambda d: d.update(reservoirs=[])), "at least one reservoir"),
+    (_changed(lambda d: d["reservoirs"][0].pop("capacity")), "missing the field capacity"),
+    (_changed(lambda d: d["reservoirs"][0].update(colour="blue")), "Unknown fields"),
+    (_changed(lambda d: d["reservoirs"][0].update(capacity="large")), "must be float"),
+    (_changed(lambda d: d["rivers"][0].update(length_in_timesteps=2.5)), "must be int"),
+    (_changed(lambda d: d["reservoirs"][0].update(water_area=True)), "must be float"),
+    (_changed(lambda d: d["rivers"][0].update(max_flow=-1.0)), "can not be negative"),
+    (_changed(lambda d: d["reservoirs"][0].update(capacity=0)), "positive capacity"),
+    (_changed(lambda d: d["reservoirs"][0].update(initial_fill=1.5)), "between 0 and 1"),
+    (_changed(lambda d: d["rivers"][0].update(length_in_timesteps=0)), "at least one timestep"),
+    (_changed(lambda d: d["rivers"][0].update(output_reservoir="Nowhere")), "unknown reservoir Nowhere"),
+    (_changed(lambda d: d["reservoirs"][1].update(out_rivers=["Missing"])), "unknown river Missing"),
+    (_changed(lambda d: d["mountains"][0].update(output_reservoir="Nowhere")), "unknown reservoir Nowhere"),
+    (_changed(lambda d: d["reservoirs"].append(dict(d["reservoirs"][0]))), "Duplicate reservoir ids"),
+    (_changed(lambda d: d["rivers"][1].update(output_reservoir="Upper")), "cycle"),
+    (_changed(lambda d: d["mountains"].append("Peak")), "must be an object"),
+])
+def test_invalid_definition_raises_value_error(definition, message):
+    with pytest.raises(ValueError, match=message):
+        compile_environment(definition)
+
+
+def test_invalid_json_raises_value_error(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text('{"reservoirs": [')
+    with pytest.raises(ValueError, match="not valid json"):
+        load_environment(str(path), data_dir=str(tmp_path))
+
+
+def test_compiled_cache_round_trip(tmp_path, monkeypatch):
+    path = tmp_path / "two_lakes.json"
+    path.write_text(json.dumps(DEFINITION))
+    monkeypatch.setattr(environment, "_compiled", {})
+
+    compiled = load_environment(str(path), data_dir=str(tmp_path))
+    cache_files = os.listdir(tmp_path / ".cache")
+    assert len(cache_files) == 1 and cache_files[0].endswith(".npz")
+
+    # a new process reads the .npz instead of compiling the definition again
+    monkeypatch.setattr(environment, "_compiled", {})
+    monkeypatch.setattr(environment, "compile_environment", None)
+    cached = load_environment(str(path), data_dir=str(tmp_path))
+
+    assert cached is not compiled
+    assert (cached.name, cached.content_hash) == ("two_lakes", compiled.content_hash)
+    assert (cached.reservoirs, cached.rivers, cached.mountains) == (compiled.reservoirs, compiled.rivers, compiled.mountains)
+    assert cached.network.shape == compiled.network.shape
+    assert cached.network.reservoir_ids == compiled.network.reservoir_ids
+    for name in NETWORK_ARRAYS + ("outflow_reservoir", "outflow_river", "delivery_river", "delivery_reservoir"):
+        assert np.array_equal(getattr(cached.network, name), getattr(compiled.network, name)), name
+
+
+def test_broken_cache_file_is_compiled_again(tmp_path, monkeypatch):
+    path = tmp_path / "two_lakes.json"
+    path.write_text(json.dumps(DEFINITION))
+    monkeypatch.setattr(environment, "_compiled", {})
+    compiled = load_environment(str(path), data_dir=str(tmp_path))
+
+    cache_file = tmp_path / ".cache" / os.listdir(tmp_path / ".cache")[0]
+    cache_file.write_bytes(b"not an npz file")
+    monkeypatch.setattr(environment, "_compiled", {})
+
+    assert load_environment(str(path), data_dir=str(tmp_path)).reservoirs == compiled.reservoirs
+
+
+def test_norwegian_builds_from_the_cache(tmp_path, monkeypatch):
+    from hydro_trader.simulation import Simulation
+
+    data_dir = tmp_path / "data"
+    shutil.copytree(DATA_DIR, data_dir, ignore=shutil.ignore_patterns(".cache"))
+    states = []
+    for _ in range(2):
+        monkeypatch.setattr(environment, "_compiled", {})
+        simulation = Simulation(data_dir=str(data_dir))
+        simulation.create_environment("norwegian")
+        simulation.simulate_day()
+        states.append(simulation.get_timestep_state())
+    assert states[0] == states[1]
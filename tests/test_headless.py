@@ -0,0 +1,64 @@
+import os
+
+from hydro_trader.delta import SharedEncoder
+from hydro_trader.game import create_game
+from hydro_trader.headless import HeadlessRunner
+from hydro_trader.server import Server
+from hydro_trader.strategies import FillLevelStrategy
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+N_TIMESTEPS = 20
+PLAYERS = {"player_0": 2.5, "player_1": 3.5}
+
+
+def _strategy(player_id, game):
+    strategy = FillLevelStrategy(power_price=PLAYERS[player_id], min_fill=0.3)
+    strategy.player_id = player_id
+    strategy.initial_state = game.get_full_state(player_id)
+    strategy.got_initial_state()
+    return strategy
+
+
+def _server_style_run():
+    """Plays a game with the tick of the server, in the order of its game loop"""
+    game = create_game(data_dir=DATA_DIR)
+    game.verbose = False
+    game.n_timesteps = N_TIMESTEPS
+    for player_id in PLAYERS:
+        game.add_player(player_id, player_id)
+    strategies = {player_id: _strategy(player_id, game) for player_id in PLAYERS}
+
+    n_processed = 0
+    while True:
+        is_game_over = game.is_game_over()
+
+        plans = {}
+        for player_id, strategy in strategies.items():
+            strategy.current_state = game.get_timestep_state(player_id)
+            plan = strategy.get_production_plan_and_power_price()
+            plans[player_id] = (plan["reservoir_ids"], plan["power_price"])
+
+        Server._tick(game, plans, list(PLAYERS), {}, {}, SharedEncoder())
+        n_processed += 1
+
+        if is_game_over:
+            break
+    return game, n_processed
+
+
+def test_headless_matches_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # the server tick writes the scoreboard
+
+    server_game, n_processed = _server_style_run()
+
+    runner = HeadlessRunner(create_game(data_dir=DATA_DIR))
+    for player_id, price in PLAYERS.items():
+        runner.add_player(player_id, player_id, FillLevelStrategy(power_price=price, min_fill=0.3))
+    results = runner.run(N_TIMESTEPS)
+
+    assert n_processed == N_TIMESTEPS
+    assert results["n_timesteps"] == N_TIMESTEPS
+    assert runner.game.timestep == server_game.timestep
+    for player_id in PLAYERS:
+        assert results["players"][player_id]["cash"] == server_game.cash[player_id]
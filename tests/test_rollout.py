@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from hydro_trader.simulation import Simulation
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def _expected(simulation, plans, horizon):
+    """The production and water of every plan by stepping forks with simulate_day"""
+    production, water = [], []
+    for plan in plans:
+        fork = simulation.fork()
+        total = 0.0
+        for _ in range(horizon):
+            for reservoir in fork.reservoirs:
+                fork.set_production(reservoir.id, reservoir.id in plan)
+            total += fork.simulate_day()[0]
+        production.append(total)
+        water.append([r.water_amount for r in fork.reservoirs])
+    return np.array(production), np.array(water)
+
+
+def test_rollout_reuses_its_batch_and_follows_the_simulation():
+    simulation = Simulation(data_dir=DATA_DIR)
+    simulation.create_environment("norwegian")
+    ids = [r.id for r in simulation.reservoirs]
+    plans = [[], ids, ids[:1], ids[1:]]
+
+    simulation.rollout(plans, 3)
+    batch = simulation._rollout_batch[2]
+
+    for day in range(30):
+        result = simulation.rollout(plans, 5)
+        production, water = _expected(simulation, plans, 5)
+        assert np.allclose(result["production_mwh"], production, rtol=1e-12), day
+        assert np.allclose(result["water_amount"], water, rtol=1e-12), day
+
+        for reservoir_id in ids[day % len(ids):]:
+            simulation.set_production(reservoir_id, True)
+        simulation.simulate_day()
+
+    assert simulation._rollout_batch[2] is batch
+
+    # a fork shares the batch but rolls out from its own state
+    fork = simulation.fork()
+    fork.simulate_day()
+    assert np.allclose(fork.rollout(plans, 5)["water_amount"], _expected(fork, plans, 5)[1], rtol=1e-12)
+    assert fork._rollout_batch[2] is batch
+
+    # new natural inflow series need a new batch
+    simulation.precompute_natural_inflow()
+    simulation.rollout(plans, 1)
+    assert simulation._rollout_batch[2] is not batch
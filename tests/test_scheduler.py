@@ -0,0 +1,51 @@
+import asyncio
+
+from hydro_trader.scheduler import TickNotifier
+
+
+def test_waiter_that_is_behind_returns_at_once():
+    async def main():
+        notifier = TickNotifier()
+        notifier.notify()
+        notifier.notify()
+        # no tick is needed, the waiter missed two
+        assert await asyncio.wait_for(notifier.wait(0), timeout=0.1) == 2
+
+    asyncio.run(main())
+
+
+def test_one_notify_wakes_every_waiter():
+    async def main():
+        notifier = TickNotifier()
+        waiters = [asyncio.create_task(notifier.wait(0)) for _ in range(50)]
+        await asyncio.sleep(0)
+        assert not any(waiter.done() for waiter in waiters)
+
+        notifier.notify()
+        assert await asyncio.wait_for(asyncio.gather(*waiters), timeout=0.1) == [1] * 50
+
+        # the next tick needs a new notify
+        waiter = asyncio.create_task(notifier.wait(1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        notifier.notify()
+        assert await asyncio.wait_for(waiter, timeout=0.1) == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_wake_or_cancel_the_others():
+    async def main():
+        notifier = TickNotifier()
+        waiters = [asyncio.create_task(notifier.wait(0)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert waiters[0].cancelled()
+        assert not waiters[1].done() and not waiters[2].done()
+
+        notifier.notify()
+        assert await asyncio.wait_for(asyncio.gather(waiters[1], waiters[2]), timeout=0.1) == [1, 1]
+
+    asyncio.run(main())
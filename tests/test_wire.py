@@ -0,0 +1,136 @@
+import pytest
+
+from hydro_trader.wire import FLOAT_ARRAY_EXT, StateCodec, array_header, map_header, pack_items, packb, unpackb
+
+
+INT_BOUNDARIES = [0, 1, 127, 128, 255, 256, 65535, 65536, 2**31 - 1, 2**31, 2**32 - 1, 2**32, 2**63 - 1, 2**63, 2**64 - 1,
+                  -1, -32, -33, -128, -129, -32768, -32769, -2**31, -2**31 - 1, -2**63]
+
+
+@pytest.mark.parametrize("value", INT_BOUNDARIES)
+def test_int_round_trip(value):
+    assert unpackb(packb(value)) == value
+    assert type(unpackb(packb(value))) is int
+
+
+def test_small_ints_are_one_byte():
+    assert packb(0) == b"\x00" and packb(127) == b"\x7f"
+    assert packb(-1) == b"\xff" and packb(-32) == b"\xe0"
+
+
+def test_int_too_large():
+    with pytest.raises(ValueError):
+        packb(2**64)
+    with pytest.raises(ValueError):
+        packb(-2**63 - 1)
+
+
+@pytest.mark.parametrize("value", [0.0, -0.0, 1.5, -2.25, 1e-300, 1e300, float("inf"), 3.141592653589793])
+def test_float_round_trip(value):
+    assert unpackb(packb(value)) == value
+    assert type(unpackb(packb(value))) is float
+
+
+@pytest.mark.parametrize("value", [[], [1.5], [1.5, -2.0], [0.1] * 300, [0.5] * 70000])
+def test_float_list_round_trip(value):
+    assert unpackb(packb(value)) == value
+
+
+def test_float_lists_are_packed_as_arrays():
+    data = packb([1.0, 2.0])
+    assert data[0] == 0xc7 and data[1] == 16 and data[2] == FLOAT_ARRAY_EXT
+    # one float is not worth an array, a mixed list is packed item by item
+    assert packb([1.0]) == array_header(1) + packb(1.0)
+    assert unpackb(packb([1.0, 2, True, None])) == [1.0, 2, True, None]
+
+
+@pytest.mark.parametrize("value", ["", "a", "x" * 31, "x" * 32, "x" * 255, "x" * 256, "x" * 70000, "Kølasnuten-Sør"])
+def test_str_round_trip(value):
+    assert unpackb(packb(value)) == value
+
+
+@pytest.mark.parametrize("value", [b"", b"\x00\xff", b"x" * 255, b"x" * 256, b"x" * 70000])
+def test_bin_round_trip(value):
+    assert unpackb(packb(value)) == value
+
+
+@pytest.mark.parametrize("n", [0, 15, 16, 65535, 65536])
+def test_container_headers(n):
+    assert unpackb(packb(list(range(n)))) == list(range(n))
+    assert unpackb(packb({str(i): i for i in range(n)})) == {str(i): i for i in range(n)}
+
+
+def test_nested_maps_and_stitching():
+    value = {"a": {"b": [1, {"c": None}], "d": [0.5, 0.25]}, "e": True, "f": False, "g": (1, "two"), 3: "int key"}
+    expected = dict(value, g=[1, "two"])
+    assert unpackb(packb(value)) == expected
+
+    first, second = {"a": 1, "b": [2.0, 3.0]}, {"c": {"d": "e"}}
+    stitched = map_header(3) + pack_items(first) + pack_items(second)
+    assert stitched == packb({**first, **second})
+
+
+def test_subclasses_are_packed_as_their_base_type():
+    import numpy as np
+    from collections import defaultdict
+
+    data = packb({"f": np.float64(1.5), "d": defaultdict(int, x=1), "l": [np.float64(0.5), np.float64(1.5)]})
+    assert unpackb(data) == {"f": 1.5, "d": {"x": 1}, "l": [0.5, 1.5]}
+
+
+def test_invalid_data():
+    with pytest.raises(TypeError):
+        packb(object())
+    with pytest.raises(ValueError):
+        unpackb(packb(1) + b"\x00")
+    with pytest.raises(ValueError):
+        unpackb(b"\xc1")
+
+
+CODEC = StateCodec(["r1", "r2", "r3"], ["river"], ["m1", "m2"])
+
+STATE = {
+    "reservoirs": {
+        "r1": {"water_amount": 1.5, "did_rain": True},
+        "r2": {"water_amount": 2.5, "did_rain": False},
+        "r3": {"water_amount": 0.0, "did_rain": True},
+    },
+    "rivers": {"river": {"flow": [1.0, 2.0, 3.0]}},
+    "mountains": {"m1": {"snow_height": 1.0, "temperature": -3.0}, "m2": {"snow_height": 0.5, "temperature": 2.0}},
+    "cash": 12.5,
+    "timestep": 7,
+    "other_players": [{"name": "b", "cash": -1.0}],
+}
+
+
+def test_codec_full_groups_as_columns():
+    compact = CODEC.compact(STATE)
+    assert compact["reservoirs"] == [["water_amount", "did_rain"], [1.5, 2.5, 0.0], [True, False, True]]
+    assert CODEC.expand(compact) == STATE
+    assert CODEC.decode(CODEC.encode(STATE)) == STATE
+
+
+def test_codec_partial_groups_by_index():
+    changes = {"reservoirs": {"r3": {"water_amount": 4.0}, "r1": {"did_rain": False}}, "mountains": {"m2": {"temperature": 1.0}},
+               "cash": 13.0}
+    compact = CODEC.compact(changes)
+    assert compact["reservoirs"] == {2: {"water_amount": 4.0}, 0: {"did_rain": False}}
+    assert CODEC.decode(CODEC.encode(changes)) == changes
+
+
+def test_codec_groups_with_different_fields_by_index():
+    state = dict(STATE, reservoirs=dict(STATE["reservoirs"], r2={"water_amount": 2.5}))
+    assert isinstance(CODEC.compact(state)["reservoirs"], dict)
+    assert CODEC.decode(CODEC.encode(state)) == state
+
+
+def test_codec_messages():
+    keyframe = {"type": "keyframe", "seq": 3, "state": STATE}
+    delta = {"type": "delta", "seq": 4, "base": 3, "changes": {"rivers": {"river": {"flow": {"shift": 1, "values": [9.0]}}}}}
+    for message in (keyframe, delta, {"status": "started"}, [1, 2]):
+        assert CODEC.decode(CODEC.encode(message)) == message
+
+
+def test_codec_from_state():
+    codec = StateCodec.from_state(STATE)
+    assert codec.ids == {"reservoirs": ["r1", "r2", "r3"], "rivers": ["river"], "mountains": ["m1", "m2"]}